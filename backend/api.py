@@ -1,22 +1,32 @@
 import os
 import sys
-import shutil
 import time
 import logging
 import json
+import asyncio
+import threading
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Optional, Tuple
 
+import aiofiles
 import numpy as np
-import nibabel as nib
-import matplotlib.pyplot as plt
-from PIL import Image, ImageDraw
+from PIL import Image
 from dotenv import load_dotenv
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 
+# Try to import numba for the fused overlay kernel, fall back to NumPy if not available
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -28,23 +38,34 @@ if PROJECT_ROOT not in sys.path:
 # Reuse prediction utilities from main.py
 from backend.main import (
     build_model,
-    load_nifti,
+    load_nifti_bytes,
+    save_nifti,
     prepare_input,
     predict_segmentation,
+    probs_to_labels,
     assemble_full_volume,
 )
 
+# TensorRT engine (falls back to Keras when unavailable)
+from backend.trt_engine import load_trt_model, TRTModel
+
 # Import similarity search functionality
 from backend.similarity_search import search_similar_cases, is_similarity_search_available
 from backend.multifieldannotator_predictor import MultiFieldAnnotatorPredictor
 
 # Import overlay generation functionality
-from backend.overlay_generator import get_overlay_image_bytes, get_nifti_preview_bytes
+from backend.overlay_generator import get_cached_overlay_image_bytes, get_nifti_preview_bytes, OVERLAY_MEDIA_TYPE
 
 
 PUBLIC_DATA_DIR = os.path.join(PROJECT_ROOT, "public", "data")
 MODEL_PATH = os.path.join(PROJECT_ROOT, "backend", "model", "brain_tumor_unet_final.h5")
 
+# Chunk size for streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Number of encoded /preview PNGs kept in memory, keyed by (upload digest, size)
+PREVIEW_CACHE_SIZE = 256
+
 os.makedirs(PUBLIC_DATA_DIR, exist_ok=True)
 
 # Set up logging
@@ -98,67 +119,181 @@ class ReportResponse(BaseModel):
 
 
 _model = None
+_model_lock = threading.Lock()
+
+# How long a similarity-search availability probe result is reused
+SIMILARITY_CHECK_TTL_SECONDS = 30
 
 
 def get_model():
     global _model
     if _model is None:
-        if not os.path.exists(MODEL_PATH):
-            raise RuntimeError(f"Model not found at {MODEL_PATH}")
-        _model = build_model(MODEL_PATH)
+        # Guard against startup warmup and the first request initializing twice
+        with _model_lock:
+            if _model is None:
+                if not os.path.exists(MODEL_PATH):
+                    raise RuntimeError(f"Model not found at {MODEL_PATH}")
+                _model = load_trt_model(MODEL_PATH) or build_model(MODEL_PATH, mixed_precision=True)
     return _model
 
 
-def convert_nifti_to_rgb_visualization(nifti_path: str, flair_path: str, output_path: str) -> None:
-    """
-    Convert a NIfTI segmentation file to an RGB visualization image overlaid on FLAIR.
+_predictor = None
 
-    Args:
-        nifti_path: Path to the input NIfTI segmentation file
-        flair_path: Path to the FLAIR NIfTI file for background
-        output_path: Path where the RGB visualization PNG will be saved
-    """
-    try:
-        # Load the segmentation and FLAIR images
-        seg_img = nib.load(nifti_path)
-        seg_data = seg_img.get_fdata()
 
-        flair_img = nib.load(flair_path)
-        flair_data = flair_img.get_fdata()
+def get_predictor() -> MultiFieldAnnotatorPredictor:
+    """Return the process-wide consensus predictor, creating it on first use."""
+    global _predictor
+    if _predictor is None:
+        _predictor = MultiFieldAnnotatorPredictor(verbose=False)
+    return _predictor
 
-        # Extract middle axial slice
-        z_idx = seg_data.shape[2] // 2
-        slice_seg = seg_data[:, :, z_idx]
-        slice_flair = flair_data[:, :, z_idx]
 
-        # Normalize FLAIR slice to 0-255 range
-        slice_flair_norm = (slice_flair - slice_flair.min()) / (np.ptp(slice_flair)) * 255
-        base_img = Image.fromarray(slice_flair_norm.astype(np.uint8)).convert("RGB")
+@lru_cache(maxsize=1)
+def _similarity_availability(epoch: int) -> Tuple[bool, Optional[str]]:
+    return is_similarity_search_available()
+
 
-        # Create segmentation overlay (in red with transparency)
-        overlay = Image.new("RGBA", base_img.size)
-        overlay_data = overlay.load()
-        for y in range(slice_seg.shape[0]):
-            for x in range(slice_seg.shape[1]):
-                if slice_seg[y, x] > 0:
-                    overlay_data[x, y] = (255, 0, 0, 120)  # Red with transparency
+def similarity_search_availability() -> Tuple[bool, Optional[str]]:
+    """Return is_similarity_search_available(), probed at most once per TTL window."""
+    return _similarity_availability(int(time.monotonic() // SIMILARITY_CHECK_TTL_SECONDS))
 
-        # Merge base FLAIR and segmentation overlay
-        combined_img = Image.alpha_composite(base_img.convert("RGBA"), overlay)
 
-        # Save the combined image (clean visualization without annotations)
-        combined_img.convert("RGB").save(output_path, "PNG")
+# Segmentation overlay: red with alpha 120/255 over the grayscale FLAIR slice
+OVERLAY_ALPHA = 120.0 / 255.0
+
+
+def _composite_overlay_numpy(flair2d: np.ndarray, seg2d: np.ndarray, lo: float, scale: float,
+                             out: np.ndarray) -> None:
+    """NumPy fallback for `_composite_overlay`."""
+    gray = np.subtract(flair2d, lo, dtype=np.float32)
+    np.multiply(gray, scale, out=gray)
+    np.clip(gray, 0.0, 255.0, out=gray)
+    base = gray.astype(np.uint8)
+    out[...] = base[..., None]
+
+    mask = seg2d > 0
+    tinted = base[mask] * np.float32(1.0 - OVERLAY_ALPHA)
+    out[mask, 0] = tinted + np.float32(255.0 * OVERLAY_ALPHA)
+    out[mask, 1] = tinted
+    out[mask, 2] = tinted
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _composite_overlay(flair2d, seg2d, lo, scale, out):
+        """Normalize FLAIR and alpha-blend the red tumor tint in one pass, writing (H, W, 3) uint8."""
+        keep = 1.0 - OVERLAY_ALPHA
+        tint = 255.0 * OVERLAY_ALPHA
+        height, width = flair2d.shape
+        for y in prange(height):
+            for x in range(width):
+                v = (flair2d[y, x] - lo) * scale
+                v = np.floor(min(max(v, 0.0), 255.0))
+                if seg2d[y, x] > 0:
+                    g = v * keep
+                    out[y, x, 0] = np.uint8(g + tint)
+                    out[y, x, 1] = np.uint8(g)
+                    out[y, x, 2] = np.uint8(g)
+                else:
+                    out[y, x, 0] = np.uint8(v)
+                    out[y, x, 1] = np.uint8(v)
+                    out[y, x, 2] = np.uint8(v)
+else:
+    _composite_overlay = _composite_overlay_numpy
+
+
+def convert_nifti_to_rgb_visualization(seg_volume: np.ndarray, flair_volume: np.ndarray, output_path: str) -> None:
+    """
+    Convert a segmentation volume to an RGB visualization image overlaid on FLAIR.
+
+    Args:
+        seg_volume: 3D segmentation label volume (H, W, D)
+        flair_volume: 3D FLAIR volume (H, W, D) already loaded for prediction
+        output_path: Path where the RGB visualization PNG will be saved
+    """
+    try:
+        # Extract middle axial slice
+        z_idx = seg_volume.shape[2] // 2
+        slice_seg = seg_volume[:, :, z_idx]
+        slice_flair = flair_volume[:, :, z_idx]
+
+        # Normalize FLAIR to 0-255 and blend the red segmentation overlay in a single pass
+        lo = float(slice_flair.min())
+        scale = 255.0 / max(float(np.ptp(slice_flair)), 1e-6)
+        rgb = np.empty(slice_seg.shape + (3,), dtype=np.uint8)
+        _composite_overlay(np.ascontiguousarray(slice_flair), np.ascontiguousarray(slice_seg), lo, scale, rgb)
+
+        # Save the combined image (clean visualization without annotations); frombuffer
+        # wraps the contiguous array without a copy, and level-1 deflate keeps encoding cheap
+        height, width = slice_seg.shape
+        Image.frombuffer("RGB", (width, height), rgb, "raw", "RGB", 0, 1).save(
+            output_path, "PNG", optimize=False, compress_level=1
+        )
 
     except Exception as e:
         # If visualization fails, create a simple error image
+        from PIL import ImageDraw
         error_img = Image.new("RGB", (512, 512), color=(0, 0, 0))
         draw = ImageDraw.Draw(error_img)
         draw.text((256, 256), 'Visualization\nUnavailable',
                  fill=(255, 255, 255), anchor="mm")
-        error_img.save(output_path, "PNG")
+        error_img.save(output_path, "PNG", optimize=False, compress_level=1)
         print(f"Warning: Failed to generate visualization: {e}")
 
 
+async def write_bytes(out_path: str, raw: bytes) -> None:
+    """Write a payload to disk without blocking the event loop."""
+    async with aiofiles.open(out_path, "wb") as f:
+        await f.write(raw)
+
+
+_preview_cache: "OrderedDict[Tuple[str, int], bytes]" = OrderedDict()
+
+
+def _preview_cache_get(key: Tuple[str, int]) -> Optional[bytes]:
+    image_bytes = _preview_cache.get(key)
+    if image_bytes is not None:
+        _preview_cache.move_to_end(key)
+    return image_bytes
+
+
+def _preview_cache_put(key: Tuple[str, int], image_bytes: bytes) -> None:
+    _preview_cache[key] = image_bytes
+    _preview_cache.move_to_end(key)
+    while len(_preview_cache) > PREVIEW_CACHE_SIZE:
+        _preview_cache.popitem(last=False)
+
+
+def copy_and_hash(src, dst) -> str:
+    """Copy a file object to another in large chunks, returning the content digest."""
+    digest = hashlib.blake2b(digest_size=16)
+    while chunk := src.read(UPLOAD_CHUNK_SIZE):
+        digest.update(chunk)
+        dst.write(chunk)
+    return digest.hexdigest()
+
+
+@app.on_event("startup")
+async def warmup_model():
+    """
+    Create the consensus predictor, load the segmentation model and run one dummy
+    inference before serving traffic, so the first requests do not pay for graph
+    building / engine deserialization.
+    """
+    get_predictor()
+
+    if not os.path.exists(MODEL_PATH):
+        logger.warning(f"Skipping model warmup, model not found at {MODEL_PATH}")
+        return
+    try:
+        model = get_model()
+        dummy = np.zeros((1,) + tuple(model.input_shape[1:]), dtype=np.float32)
+        model.predict(dummy, verbose=0)
+        logger.info("Segmentation model warmed up")
+    except Exception as e:
+        logger.warning(f"Model warmup failed: {e}")
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -166,6 +301,7 @@ def health():
 
 @app.post("/predict", response_model=PredictResponse)
 async def predict(
+    background_tasks: BackgroundTasks,
     flair: UploadFile = File(...),
     t1: UploadFile = File(...),
     t1ce: UploadFile = File(...),
@@ -179,16 +315,17 @@ async def predict(
     case_dir = os.path.join(PUBLIC_DATA_DIR, safe_case)
     os.makedirs(case_dir, exist_ok=True)
 
-    # Persist uploads so nibabel can read them, and so frontend can list them later if needed
+    # Read uploads into memory; they are decoded from there and only persisted to disk
+    # afterwards (in the background) so the frontend can list them later
+    names = ("flair", "t1", "t1ce", "t2")
+    uploads = {"flair": flair, "t1": t1, "t1ce": t1ce, "t2": t2}
     paths = {}
     try:
-        for name, upload in ("flair", flair), ("t1", t1), ("t1ce", t1ce), ("t2", t2):
+        for name, upload in uploads.items():
             # Keep/force expected filename suffixes
             ext = ".nii.gz" if upload.filename.endswith(".nii.gz") else ".nii"
-            out_path = os.path.join(case_dir, f"{safe_case}_{name}{ext}")
-            with open(out_path, "wb") as f:
-                shutil.copyfileobj(upload.file, f)
-            paths[name] = out_path
+            paths[name] = os.path.join(case_dir, f"{safe_case}_{name}{ext}")
+        raw = dict(zip(names, await asyncio.gather(*(uploads[name].read() for name in names))))
     finally:
         # Ensure file buffers are closed
         for up in (flair, t1, t1ce, t2):
@@ -197,13 +334,14 @@ async def predict(
             except Exception:
                 pass
 
-    # Load volumes
+    for name in names:
+        background_tasks.add_task(write_bytes, paths[name], raw[name])
+
+    # Decode volumes concurrently (nibabel/zlib decoding releases the GIL)
     try:
-        modalities = {}
-        modalities["flair"], affine, header = load_nifti(paths["flair"])
-        modalities["t1"], _, _ = load_nifti(paths["t1"]) 
-        modalities["t1ce"], _, _ = load_nifti(paths["t1ce"]) 
-        modalities["t2"], _, _ = load_nifti(paths["t2"]) 
+        loaded = await asyncio.gather(*(asyncio.to_thread(load_nifti_bytes, raw[name]) for name in names))
+        modalities = {name: data for name, (data, _, _) in zip(names, loaded)}
+        _, affine, header = loaded[0]
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to load NIfTI files: {e}")
 
@@ -227,25 +365,34 @@ async def predict(
 
     # Prepare batch, predict, and assemble full volume
     x_batch = prepare_input(modalities, channel_order)
-    labels_fullres = predict_segmentation(model, x_batch, (original_h, original_w))
+    # Each request is already a full VOLUME_SLICES batch; run it off the event loop
+    if isinstance(model, TRTModel):
+        # Hand the engine its native input precision (float16 for FP16-I/O engines)
+        x_batch = np.ascontiguousarray(x_batch, dtype=model.input_dtype)
+        probs = await asyncio.to_thread(model.predict, x_batch, verbose=0)
+        labels_fullres = probs_to_labels(probs, (original_h, original_w))
+    else:
+        # Direct model call with the argmax on the device
+        labels_fullres = await asyncio.to_thread(predict_segmentation, model, x_batch, (original_h, original_w))
     seg_volume = assemble_full_volume(labels_fullres, (original_h, original_w, original_d))
 
     # Save segmentation next to inputs
     seg_path = os.path.join(case_dir, f"{safe_case}_seg.nii")
-    nib.save(nib.Nifti1Image(seg_volume.astype(np.int16), affine, header), seg_path)
+    await asyncio.to_thread(save_nifti, seg_volume, affine, header, seg_path)
 
-    # Generate RGB visualization with FLAIR overlay
+    # Generate RGB visualization with FLAIR overlay after the response is sent
+    # (sync background tasks run in Starlette's threadpool)
     viz_path = os.path.join(case_dir, f"{safe_case}_seg_visualization.png")
-    flair_path = paths["flair"]  # Get the FLAIR file path
-    convert_nifti_to_rgb_visualization(seg_path, flair_path, viz_path)
+    background_tasks.add_task(convert_nifti_to_rgb_visualization, seg_volume, modalities["flair"], viz_path)
 
     # Perform similarity search
     similarity_results = None
     try:
-        is_available, error_msg = is_similarity_search_available()
+        is_available, error_msg = similarity_search_availability()
         if is_available:
             print("Performing similarity search...")
-            similar_cases = search_similar_cases(seg_path)
+            # Reuse the in-memory volume rather than re-reading the saved NIfTI
+            similar_cases = search_similar_cases(seg_volume)
             if similar_cases:
                 similarity_results = [
                     SimilarityMatch(
@@ -283,8 +430,8 @@ async def consensus(request: ConsensusRequest):
     Generate consensus labels from multiple radiologist assessments.
     """
     try:
-        # Initialize the predictor
-        predictor = MultiFieldAnnotatorPredictor(verbose=True)
+        # Reuse the shared predictor
+        predictor = get_predictor()
 
         # Convert assessments to the format expected by add_new_scan
         scan_data = {
@@ -307,8 +454,8 @@ async def consensus(request: ConsensusRequest):
         os.makedirs(case_dir, exist_ok=True)
         scan_data_path = os.path.join(case_dir, "scan_data.json")
 
-        with open(scan_data_path, "w") as f:
-            json.dump(scan_data, f, indent=2)
+        async with aiofiles.open(scan_data_path, "w") as f:
+            await f.write(json.dumps(scan_data, indent=2))
 
         # Process the scan data
         result = predictor.add_new_scan(scan_data)
@@ -359,7 +506,7 @@ async def generate_report(request: ReportRequest):
         generator = LLMReportGenerator(api_key=api_key)
 
         # Generate the report
-        report_path = generator.generate_report(request.scan_id, case_dir)
+        report_path = await generator.generate_report_async(request.scan_id, case_dir)
 
         # Create download URL and filename
         report_filename = os.path.basename(report_path)
@@ -394,15 +541,20 @@ async def generate_nifti_preview(file: UploadFile = File(...), size: int = 256):
         import tempfile
         with tempfile.NamedTemporaryFile(delete=False, suffix='.nii.gz' if file.filename.endswith('.nii.gz') else '.nii') as temp_file:
             # Copy uploaded file to temporary location
-            shutil.copyfileobj(file.file, temp_file)
+            digest = copy_and_hash(file.file, temp_file)
             temp_path = temp_file.name
 
         try:
-            # Generate preview image
-            image_bytes = get_nifti_preview_bytes(temp_path, (size, size))
-
+            # Serve repeated previews of the same upload from memory
+            cache_key = (digest, size)
+            image_bytes = _preview_cache_get(cache_key)
             if image_bytes is None:
-                raise HTTPException(status_code=400, detail="Failed to generate preview from NIfTI file")
+                # Generate preview image
+                image_bytes = get_nifti_preview_bytes(temp_path, (size, size))
+
+                if image_bytes is None:
+                    raise HTTPException(status_code=400, detail="Failed to generate preview from NIfTI file")
+                _preview_cache_put(cache_key, image_bytes)
 
             # Return image with appropriate headers
             from fastapi.responses import Response
@@ -445,8 +597,8 @@ async def get_overlay_image(case_id: str, size: int = 96):
         size: Image size in pixels (default: 96x96)
     """
     try:
-        # Generate overlay image
-        image_bytes = get_overlay_image_bytes(case_id, (size, size))
+        # Generate overlay image (cached in-process per case files' mtimes)
+        image_bytes = get_cached_overlay_image_bytes(case_id, (size, size))
 
         if image_bytes is None:
             raise HTTPException(status_code=404, detail=f"Could not generate overlay for case {case_id}")
@@ -455,9 +607,10 @@ async def get_overlay_image(case_id: str, size: int = 96):
         from fastapi.responses import Response
         return Response(
             content=image_bytes,
-            media_type="image/png",
+            media_type=OVERLAY_MEDIA_TYPE,
             headers={
-                "Content-Disposition": f"inline; filename=overlay_{case_id}_{size}x{size}.png"
+                "Content-Disposition": f"inline; filename=overlay_{case_id}_{size}x{size}.{OVERLAY_MEDIA_TYPE.split('/')[1]}",
+                "Cache-Control": "public, max-age=3600, immutable"
             }
         )
 
@@ -4,9 +4,20 @@ Manages environment variables and default settings for CLIP and Pinecone integra
 """
 
 import os
+from functools import lru_cache
 from typing import Optional
 
 
+@lru_cache(maxsize=None)
+def _has_cuda() -> bool:
+    """Probe torch for CUDA once; torch is imported on first use, not at config import."""
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
 class SimilaritySearchConfig:
     """Configuration class for similarity search functionality."""
     
@@ -22,11 +33,38 @@ class SimilaritySearchConfig:
     # CLIP Model Configuration
     CLIP_MODEL_NAME: str = os.getenv("CLIP_MODEL_NAME", "openai/clip-vit-base-patch32")
     CLIP_IMAGE_SIZE: int = int(os.getenv("CLIP_IMAGE_SIZE", "224"))
+    # TorchScript export of the CLIP image encoder, traced on first load and reused by later
+    # processes to skip from_pretrained; one file per device/dtype, stamped with the model
+    # name it was traced from (set to "" to disable)
+    CLIP_MODEL_CACHE_PATH: str = os.getenv(
+        "CLIP_MODEL_CACHE_PATH", os.path.join(os.path.dirname(__file__), "cache", "clip_image_encoder.pt")
+    )
     
     # Similarity Search Settings
     TOP_K_RESULTS: int = int(os.getenv("SIMILARITY_TOP_K", "3"))
     SIMILARITY_THRESHOLD: float = float(os.getenv("SIMILARITY_THRESHOLD", "0.0"))
     
+    # Vector backend for CLIP queries: "faiss" searches an in-process index of saved
+    # embeddings, "pinecone" the hosted index, "auto" uses faiss when the saved index exists
+    VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "auto").lower()
+    LOCAL_INDEX_DIR: str = os.getenv(
+        "LOCAL_INDEX_DIR", os.path.join(os.path.dirname(__file__), "cache", "clip_index")
+    )
+    # Local index encoding: "sq8" (int8 scalar quantization), "ivfpq" (large corpora) or "flat" (exact fp32)
+    LOCAL_INDEX_QUANTIZATION: str = os.getenv("LOCAL_INDEX_QUANTIZATION", "sq8").lower()
+    
+    # Mask-descriptor search: query a small shape-descriptor index instead of embedding
+    # the binary tumor mask with CLIP (the index must be populated first)
+    ENABLE_MASK_DESCRIPTOR_SEARCH: bool = os.getenv("ENABLE_MASK_DESCRIPTOR_SEARCH", "false").lower() == "true"
+    PINECONE_MASK_INDEX_NAME: str = os.getenv("PINECONE_MASK_INDEX_NAME", "testmed-mask")
+    
+    # Query cache: embeddings and results of repeated segmentation queries
+    QUERY_CACHE_SIZE: int = int(os.getenv("SIMILARITY_QUERY_CACHE_SIZE", "256"))
+    QUERY_CACHE_TTL_SECONDS: float = float(os.getenv("SIMILARITY_QUERY_CACHE_TTL", "300"))
+    
+    # Similar-case overlay thumbnails: "PNG" (lossless, zlib level 1) or "WEBP" (faster, lossy)
+    OVERLAY_IMAGE_FORMAT: str = os.getenv("OVERLAY_IMAGE_FORMAT", "PNG").upper()
+    
     # Feature Flags
     ENABLE_SIMILARITY_SEARCH: bool = os.getenv("ENABLE_SIMILARITY_SEARCH", "true").lower() == "true"
     
@@ -50,16 +88,18 @@ class SimilaritySearchConfig:
         if cls.CLIP_IMAGE_SIZE <= 0:
             return False, "CLIP_IMAGE_SIZE must be positive"
         
+        if cls.VECTOR_BACKEND not in ("auto", "faiss", "pinecone"):
+            return False, "VECTOR_BACKEND must be auto, faiss or pinecone"
+        
+        if cls.OVERLAY_IMAGE_FORMAT not in ("PNG", "WEBP"):
+            return False, "OVERLAY_IMAGE_FORMAT must be PNG or WEBP"
+        
         return True, None
     
     @classmethod
     def get_device(cls) -> str:
         """Get the appropriate device for CLIP model (cuda if available, else cpu)."""
-        try:
-            import torch
-            return "cuda" if torch.cuda.is_available() else "cpu"
-        except ImportError:
-            return "cpu"
+        return "cuda" if _has_cuda() else "cpu"
 
 
 # Global configuration instance
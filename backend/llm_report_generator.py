@@ -3,25 +3,552 @@ LLM-based medical report generator for NeuroGrade.
 Integrates with the consensus system to generate comprehensive cancer reports.
 """
 
-import json
-import base64
 import os
+import asyncio
 import openai
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from datetime import datetime
+from pathlib import Path
+from string import Template
+
+# Prefer the SIMD-accelerated base64 encoder, fall back to the stdlib
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Prefer orjson for parsing the case JSON files, fall back to the stdlib
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 # Try to import weasyprint, handle gracefully if not available
 try:
     from weasyprint import HTML, CSS
+    from weasyprint.text.fonts import FontConfiguration
     WEASYPRINT_AVAILABLE = True
 except ImportError:
     WEASYPRINT_AVAILABLE = False
     HTML = None
     CSS = None
+    FontConfiguration = None
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# Read size for streaming base64 encoding; a multiple of 3 so no chunk is padded
+BASE64_CHUNK_SIZE = 3 * 65536
+
+# Completion budget for the generated report body
+REPORT_MAX_TOKENS = 2048
+
+# Field names radiologists' comments may be stored under, in priority order
+_COMMENT_KEYS = ("Additional Comments", "comments", "Comments")
+
+# Critical findings shown in the report header: (template placeholder, verdict key)
+_FINDING_KEYS = (
+    ("consensus_location", "Tumor Location"),
+    ("consensus_type", "Tumor Type"),
+    ("consensus_grade", "Tumor Grade"),
+    ("consensus_size", "Size"),
+    ("consensus_confidence", "Confidence"),
+)
+
+# Static report-generation instructions appended to every prompt
+_INSTRUCTIONS = """=== REPORT GENERATION INSTRUCTIONS ===
+
+You are an experienced neuro-surgeon preparing an MRI-based brain cancer report for a patient.
+Analyze the provided MRI scan image and integrate BOTH data sources above:
+
+1. **Consensus Findings**: Use these as the primary diagnostic conclusions (most reliable)
+2. **Individual Comments**: Incorporate these clinical insights and observations for context
+
+Write the report in **pure HTML** using the professional medical report structure provided.
+Do **NOT** wrap your answer in ```html or ``` code fences. Output only the raw HTML content.
+
+**IMPORTANT STYLING REQUIREMENTS:**
+- Use the CSS classes provided in the template for proper formatting
+- Use `<div class="section-header">SECTION NAME</div>` for main sections
+- Use `<div class="subsection-header">Subsection Name</div>` for subsections
+- Use `<div class="consensus-block">` for consensus findings content
+- Use `<div class="radiologist-block">` for individual radiologist observations
+- Use `<div class="content-block">` for general content blocks
+- Use `<div class="radiologist-name">Dr. Name</div>` for radiologist names
+- Do not include <html>, <head>, or <body> tags — only the content
+
+**REQUIRED SECTIONS (in this exact order):**
+
+1. **EXECUTIVE SUMMARY**
+   ```html
+   <div class="section-header">Executive Summary</div>
+   <div class="content-block">
+   [Brief clinical overview based on consensus findings - 2-3 sentences]
+   </div>
+   ```
+
+2. **CONSENSUS DIAGNOSIS**
+   ```html
+   <div class="section-header">Consensus Diagnosis</div>
+   <div class="consensus-block">
+   [Present the algorithmic consensus as the primary diagnostic conclusion]
+   </div>
+   ```
+
+3. **INDIVIDUAL RADIOLOGIST OBSERVATIONS**
+   ```html
+   <div class="section-header">Individual Radiologist Observations</div>
+   [For each radiologist comment, use:]
+   <div class="radiologist-block">
+   <div class="radiologist-name">Dr. [Name]</div>
+   [Their specific observations and insights]
+   </div>
+   ```
+
+4. **INTEGRATED CLINICAL ANALYSIS**
+   ```html
+   <div class="section-header">Integrated Clinical Analysis</div>
+   <div class="content-block">
+   [Synthesize consensus findings with individual observations]
+   </div>
+   ```
+
+5. **RECOMMENDATIONS & NEXT STEPS**
+   ```html
+   <div class="section-header">Recommendations & Next Steps</div>
+   <div class="content-block">
+   [Evidence-based clinical recommendations]
+   </div>
+   ```
+
+**KEY REQUIREMENTS:**
+- Use medical terminology appropriate for healthcare professionals
+- Clearly distinguish between consensus findings (most reliable) and individual observations
+- Present information in a scannable format for busy clinicians
+- Include specific clinical recommendations based on findings
+- Maintain professional, clinical tone throughout
+"""
+
+# Report stylesheet. WeasyPrint gets it pre-parsed (see REPORT_STYLESHEET); the
+# HTML fallback inlines it through the $inline_style placeholder.
+REPORT_CSS = """
+@page {
+    size: A4;
+    margin: 1in;
+    @top-center {
+        content: "CONFIDENTIAL MEDICAL REPORT";
+        font-size: 8pt;
+        color: #666;
+        font-family: 'Times New Roman', serif;
+    }
+    @bottom-center {
+        content: "Page " counter(page) " of " counter(pages);
+        font-size: 8pt;
+        color: #666;
+        font-family: 'Times New Roman', serif;
+    }
+}
+
+/* Base Typography */
+body {
+    font-family: 'Times New Roman', serif;
+    line-height: 1.4;
+    color: #000;
+    font-size: 11pt;
+    margin: 0;
+    padding: 0;
+}
+
+/* Medical Report Header */
+.medical-header {
+    border: 2px solid #1a365d;
+    padding: 15px;
+    margin-bottom: 20px;
+    background: linear-gradient(135deg, #f8fafc 0%, #e2e8f0 100%);
+    page-break-inside: avoid;
+}
+
+.institution-info {
+    text-align: center;
+    border-bottom: 1px solid #1a365d;
+    padding-bottom: 10px;
+    margin-bottom: 10px;
+}
+
+.institution-name {
+    font-size: 16pt;
+    font-weight: bold;
+    color: #1a365d;
+    margin: 0;
+    letter-spacing: 0.5px;
+}
+
+.department {
+    font-size: 12pt;
+    color: #2d3748;
+    margin: 2px 0;
+    font-style: italic;
+}
+
+.report-title {
+    font-size: 14pt;
+    font-weight: bold;
+    color: #1a365d;
+    text-align: center;
+    margin: 10px 0 5px 0;
+    text-transform: uppercase;
+    letter-spacing: 1px;
+}
+
+/* Patient & Case Information */
+.case-info {
+    display: table;
+    width: 100%;
+    margin-top: 10px;
+}
+
+.case-info-row {
+    display: table-row;
+}
+
+.case-info-cell {
+    display: table-cell;
+    padding: 3px 10px;
+    border-bottom: 1px dotted #cbd5e0;
+    vertical-align: top;
+}
+
+.case-info-label {
+    font-weight: bold;
+    color: #2d3748;
+    width: 25%;
+}
+
+.case-info-value {
+    color: #1a202c;
+    width: 75%;
+}
+
+/* Critical Information Box */
+.critical-findings {
+    background: #fef5e7;
+    border: 2px solid #ed8936;
+    border-radius: 8px;
+    padding: 15px;
+    margin: 20px 0;
+    page-break-inside: avoid;
+}
+
+.critical-title {
+    font-size: 13pt;
+    font-weight: bold;
+    color: #c05621;
+    margin: 0 0 10px 0;
+    text-align: center;
+    text-transform: uppercase;
+}
+
+.findings-grid {
+    display: table;
+    width: 100%;
+    border-collapse: collapse;
+}
+
+.findings-row {
+    display: table-row;
+}
+
+.findings-cell {
+    display: table-cell;
+    padding: 8px 12px;
+    border: 1px solid #ed8936;
+    background: #fffbf0;
+    vertical-align: top;
+}
+
+.findings-label {
+    font-weight: bold;
+    color: #744210;
+    width: 30%;
+}
+
+.findings-value {
+    color: #1a202c;
+    font-weight: bold;
+    width: 70%;
+}
+
+/* Section Headers */
+.section-header {
+    background: #1a365d;
+    color: white;
+    padding: 8px 15px;
+    margin: 25px 0 15px 0;
+    font-size: 12pt;
+    font-weight: bold;
+    text-transform: uppercase;
+    letter-spacing: 0.5px;
+    page-break-after: avoid;
+}
+
+.subsection-header {
+    color: #1a365d;
+    font-size: 11pt;
+    font-weight: bold;
+    margin: 15px 0 8px 0;
+    padding-bottom: 3px;
+    border-bottom: 1px solid #cbd5e0;
+    page-break-after: avoid;
+}
+
+/* Content Styling */
+.content-block {
+    margin-bottom: 15px;
+    padding: 10px;
+    background: #f7fafc;
+    border-left: 4px solid #4299e1;
+}
+
+.consensus-block {
+    background: #e6fffa;
+    border-left: 4px solid #38b2ac;
+    padding: 12px;
+    margin: 10px 0;
+}
+
+.radiologist-block {
+    background: #faf5ff;
+    border-left: 4px solid #9f7aea;
+    padding: 10px;
+    margin: 8px 0;
+}
+
+.radiologist-name {
+    font-weight: bold;
+    color: #553c9a;
+    margin-bottom: 5px;
+}
+
+/* Image Styling */
+.image-container {
+    text-align: center;
+    margin: 20px 0;
+    page-break-inside: avoid;
+}
+
+.scan-image {
+    max-width: 350px;
+    width: 100%;
+    border: 2px solid #1a365d;
+    border-radius: 8px;
+    box-shadow: 0 4px 8px rgba(0,0,0,0.1);
+}
+
+.image-caption {
+    font-size: 10pt;
+    color: #4a5568;
+    font-style: italic;
+    margin-top: 8px;
+    text-align: center;
+}
+
+/* Lists and Text */
+ul {
+    margin: 10px 0;
+    padding-left: 20px;
+}
+
+li {
+    margin-bottom: 4px;
+    line-height: 1.3;
+}
+
+p {
+    margin: 8px 0;
+    text-align: justify;
+    line-height: 1.4;
+}
+
+strong {
+    color: #1a202c;
+    font-weight: bold;
+}
+
+/* Footer */
+.report-footer {
+    margin-top: 30px;
+    padding: 15px;
+    border-top: 2px solid #1a365d;
+    background: #f7fafc;
+    font-size: 9pt;
+    color: #4a5568;
+    page-break-inside: avoid;
+}
+
+.footer-row {
+    margin: 3px 0;
+}
+
+.disclaimer {
+    font-style: italic;
+    text-align: center;
+    margin-top: 10px;
+    color: #718096;
+}
+
+/* Utility Classes */
+.text-center { text-align: center; }
+.text-bold { font-weight: bold; }
+.text-italic { font-style: italic; }
+.page-break { page-break-before: always; }
+.no-break { page-break-inside: avoid; }
+
+/* Print Optimizations */
+@media print {
+    body { -webkit-print-color-adjust: exact; }
+    .medical-header { background: #f8fafc !important; }
+}
+"""
+
+# Full HTML report document, parsed once at import. Placeholders are filled per report.
+REPORT_HTML = """<!DOCTYPE html>
+<html>
+<head>
+    <title>Medical Report - $scan_id</title>
+    <meta charset="utf-8">
+    $inline_style
+</head>
+<body>
+    <!-- Medical Report Header -->
+    <div class="medical-header">
+        <div class="institution-info">
+            <div class="institution-name">NeuroGrade Medical Center</div>
+            <div class="department">Department of Radiology & Neuroimaging</div>
+        </div>
+        <div class="report-title">Brain Tumor Analysis Report</div>
+
+        <div class="case-info">
+            <div class="case-info-row">
+                <div class="case-info-cell case-info-label">Case ID:</div>
+                <div class="case-info-cell case-info-value">$scan_id</div>
+                <div class="case-info-cell case-info-label">Report Date:</div>
+                <div class="case-info-cell case-info-value">$report_date</div>
+            </div>
+            <div class="case-info-row">
+                <div class="case-info-cell case-info-label">Study Type:</div>
+                <div class="case-info-cell case-info-value">MRI Brain with AI Segmentation</div>
+                <div class="case-info-cell case-info-label">Generated:</div>
+                <div class="case-info-cell case-info-value">$report_time</div>
+            </div>
+            <div class="case-info-row">
+                <div class="case-info-cell case-info-label">Analysis Method:</div>
+                <div class="case-info-cell case-info-value" style="font-weight: bold;">Multi-Radiologist Consensus + AI</div>
+                <div class="case-info-cell case-info-label">Priority:</div>
+                <div class="case-info-cell case-info-value" style="color: #c53030; font-weight: bold;">URGENT REVIEW</div>
+            </div>
+        </div>
+    </div>
+
+    <!-- MRI Visualization -->
+    <div class="image-container">
+        <img src="$image_src" alt="MRI Brain Segmentation" class="scan-image">
+        <div class="image-caption">
+            <strong>Figure 1:</strong> MRI FLAIR sequence with AI-generated tumor segmentation overlay (red region)
+        </div>
+    </div>
+
+    <!-- Critical Findings Summary -->
+    <div class="critical-findings">
+        <div class="critical-title">⚠ Critical Findings Summary</div>
+        <div class="findings-grid">
+            <div class="findings-row">
+                <div class="findings-cell findings-label">Tumor Location:</div>
+                <div class="findings-cell findings-value">$consensus_location</div>
+            </div>
+            <div class="findings-row">
+                <div class="findings-cell findings-label">Tumor Type:</div>
+                <div class="findings-cell findings-value">$consensus_type</div>
+            </div>
+            <div class="findings-row">
+                <div class="findings-cell findings-label">WHO Grade:</div>
+                <div class="findings-cell findings-value">$consensus_grade</div>
+            </div>
+            <div class="findings-row">
+                <div class="findings-cell findings-label">Estimated Size:</div>
+                <div class="findings-cell findings-value">$consensus_size</div>
+            </div>
+            <div class="findings-row">
+                <div class="findings-cell findings-label">Confidence Level:</div>
+                <div class="findings-cell findings-value">$consensus_confidence</div>
+            </div>
+        </div>
+    </div>
+
+    <!-- Main Report Content -->
+    $html_content
+
+    <!-- Report Footer -->
+    <div class="report-footer">
+        <div class="footer-row"><strong>NeuroGrade Medical Report Generation System</strong></div>
+        <div class="footer-row">Multi-Radiologist Consensus Analysis with AI-Assisted Interpretation</div>
+        <div class="footer-row">Report ID: $scan_id | Generated: $report_timestamp</div>
+        <div class="disclaimer">
+            This report is generated for medical professional use only. Clinical decisions should be made in consultation with qualified healthcare providers.
+            This AI-assisted analysis is intended to support, not replace, professional medical judgment.
+        </div>
+    </div>
+</body>
+</html>"""
+
+# The document is split around the image source so a (large) base64 image is
+# never copied into an interpolated string; see LLMReportGenerator.render_report_parts
+REPORT_TEMPLATE_HEAD, REPORT_TEMPLATE_TAIL = (
+    Template(part) for part in REPORT_HTML.split("$image_src")
+)
+
+# Parse the stylesheet and set up fonts once per process rather than per report
+if WEASYPRINT_AVAILABLE:
+    REPORT_FONT_CONFIG = FontConfiguration()
+    REPORT_STYLESHEET = CSS(string=REPORT_CSS, font_config=REPORT_FONT_CONFIG)
+else:
+    REPORT_FONT_CONFIG = None
+    REPORT_STYLESHEET = None
+
+
+@lru_cache(maxsize=128)
+def _load_scan_data_cached(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Parse a scan data JSON file; keyed on mtime so edits invalidate the entry."""
+    with open(path, "rb") as f:
+        return json_loads(f.read())
+
+
+@lru_cache(maxsize=128)
+def _load_consensus_verdict_cached(path: str, mtime_ns: int) -> Dict[str, Any]:
+    """Parse a consensus JSON file and return its single verdict; keyed on mtime."""
+    with open(path, "rb") as f:
+        data = json_loads(f.read())
+    # Get the first (and only) scan's verdict
+    if not data:
+        return {}
+    _, verdict = next(iter(data.items()))
+    return verdict
+
+
+@lru_cache(maxsize=4)
+def get_openai_client(api_key: str) -> openai.OpenAI:
+    """Return a shared OpenAI client per API key so its HTTP connection pool is reused across reports."""
+    return openai.OpenAI(api_key=api_key)
+
+
+@lru_cache(maxsize=4)
+def get_async_openai_client(api_key: str) -> openai.AsyncOpenAI:
+    """Async counterpart of get_openai_client for generate_report_async."""
+    return openai.AsyncOpenAI(api_key=api_key)
+
+
 class LLMReportGenerator:
     """
     LLM-based report generator that creates comprehensive medical reports
@@ -39,7 +566,8 @@ class LLMReportGenerator:
         if not self.api_key:
             raise ValueError("OpenAI API key is required. Set OPENAI_API_KEY environment variable or pass api_key parameter.")
         
-        openai.api_key = self.api_key
+        self._client = get_openai_client(self.api_key)
+        self._aclient = get_async_openai_client(self.api_key)
 
     @staticmethod
     def load_scan_data(scan_data_path: str) -> Dict[str, Any]:
@@ -53,9 +581,7 @@ class LLMReportGenerator:
             Dictionary containing scan data
         """
         try:
-            with open(scan_data_path, "r") as f:
-                data = json.load(f)
-            return data
+            return _load_scan_data_cached(scan_data_path, os.stat(scan_data_path).st_mtime_ns)
         except Exception as e:
             logger.error(f"Failed to load scan data from {scan_data_path}: {e}")
             return {}
@@ -72,13 +598,7 @@ class LLMReportGenerator:
             Dictionary containing consensus verdict
         """
         try:
-            with open(consensus_path, "r") as f:
-                data = json.load(f)
-            # Get the first (and only) scan's verdict
-            if not data:
-                return {}
-            _, verdict = next(iter(data.items()))
-            return verdict
+            return _load_consensus_verdict_cached(consensus_path, os.stat(consensus_path).st_mtime_ns)
         except Exception as e:
             logger.error(f"Failed to load consensus verdict from {consensus_path}: {e}")
             return {}
@@ -104,7 +624,7 @@ class LLMReportGenerator:
 
         for doctor, details in scan_info.items():
             # Check for different possible comment field names
-            comment = details.get("Additional Comments") or details.get("comments") or details.get("Comments")
+            comment = next((v for k in _COMMENT_KEYS if (v := details.get(k))), None)
             if comment and comment.strip():
                 # Format: "Dr. Name: Clinical observation..."
                 comments.append(f"{doctor}: {comment}")
@@ -123,8 +643,11 @@ class LLMReportGenerator:
             Base64 encoded string
         """
         try:
+            encoded = bytearray()
             with open(image_path, "rb") as img_file:
-                return base64.b64encode(img_file.read()).decode("utf-8")
+                while chunk := img_file.read(BASE64_CHUNK_SIZE):
+                    encoded += base64.b64encode(chunk)
+            return encoded.decode("ascii")
         except Exception as e:
             logger.error(f"Failed to encode image {image_path}: {e}")
             raise
@@ -140,105 +663,70 @@ class LLMReportGenerator:
         Returns:
             Formatted prompt string
         """
-        prompt = (
+        parts = [
             "You are a medical AI assistant. Generate a comprehensive cancer report for the following brain scan.\n\n"
             "You have access to two distinct data sources:\n\n"
-        )
+        ]
 
         # Section 1: Algorithmic Consensus Findings
-        prompt += "=== CONSENSUS FINDINGS (Multi-Radiologist Algorithm) ===\n"
-        prompt += "The following represents the final consensus determined by a sophisticated multi-annotator algorithm "
-        prompt += "that analyzed assessments from multiple radiologists using cleanlab technology:\n\n"
+        parts.append("=== CONSENSUS FINDINGS (Multi-Radiologist Algorithm) ===\n")
+        parts.append("The following represents the final consensus determined by a sophisticated multi-annotator algorithm ")
+        parts.append("that analyzed assessments from multiple radiologists using cleanlab technology:\n\n")
 
-        for k, v in verdict.items():
-            prompt += f"• {k}: {v}\n"
-        prompt += "\n"
+        parts.append("\n".join(f"• {k}: {v}" for k, v in verdict.items()))
+        parts.append("\n\n" if verdict else "\n")
 
         # Section 2: Individual Radiologist Comments
-        prompt += "=== INDIVIDUAL RADIOLOGIST OBSERVATIONS ===\n"
+        parts.append("=== INDIVIDUAL RADIOLOGIST OBSERVATIONS ===\n")
         if comments:
-            prompt += "The following are individual clinical observations and insights from each radiologist:\n\n"
-            for comment in comments:
-                prompt += f"• {comment}\n"
-            prompt += "\n"
+            parts.append("The following are individual clinical observations and insights from each radiologist:\n\n")
+            parts.append("\n".join(f"• {comment}" for comment in comments))
+            parts.append("\n\n")
         else:
-            prompt += "No individual radiologist comments were provided.\n\n"
-
-        prompt += """=== REPORT GENERATION INSTRUCTIONS ===
-
-You are an experienced neuro-surgeon preparing an MRI-based brain cancer report for a patient.
-Analyze the provided MRI scan image and integrate BOTH data sources above:
-
-1. **Consensus Findings**: Use these as the primary diagnostic conclusions (most reliable)
-2. **Individual Comments**: Incorporate these clinical insights and observations for context
-
-Write the report in **pure HTML** using the professional medical report structure provided.
-Do **NOT** wrap your answer in ```html or ``` code fences. Output only the raw HTML content.
-
-**IMPORTANT STYLING REQUIREMENTS:**
-- Use the CSS classes provided in the template for proper formatting
-- Use `<div class="section-header">SECTION NAME</div>` for main sections
-- Use `<div class="subsection-header">Subsection Name</div>` for subsections
-- Use `<div class="consensus-block">` for consensus findings content
-- Use `<div class="radiologist-block">` for individual radiologist observations
-- Use `<div class="content-block">` for general content blocks
-- Use `<div class="radiologist-name">Dr. Name</div>` for radiologist names
-- Do not include <html>, <head>, or <body> tags — only the content
-
-**REQUIRED SECTIONS (in this exact order):**
-
-1. **EXECUTIVE SUMMARY**
-   ```html
-   <div class="section-header">Executive Summary</div>
-   <div class="content-block">
-   [Brief clinical overview based on consensus findings - 2-3 sentences]
-   </div>
-   ```
-
-2. **CONSENSUS DIAGNOSIS**
-   ```html
-   <div class="section-header">Consensus Diagnosis</div>
-   <div class="consensus-block">
-   [Present the algorithmic consensus as the primary diagnostic conclusion]
-   </div>
-   ```
+            parts.append("No individual radiologist comments were provided.\n\n")
 
-3. **INDIVIDUAL RADIOLOGIST OBSERVATIONS**
-   ```html
-   <div class="section-header">Individual Radiologist Observations</div>
-   [For each radiologist comment, use:]
-   <div class="radiologist-block">
-   <div class="radiologist-name">Dr. [Name]</div>
-   [Their specific observations and insights]
-   </div>
-   ```
+        parts.append(_INSTRUCTIONS)
+        return "".join(parts)
 
-4. **INTEGRATED CLINICAL ANALYSIS**
-   ```html
-   <div class="section-header">Integrated Clinical Analysis</div>
-   <div class="content-block">
-   [Synthesize consensus findings with individual observations]
-   </div>
-   ```
+    @staticmethod
+    def render_report_parts(
+        scan_id: str,
+        image_b64: Optional[str] = None,
+        image_uri: Optional[str] = None,
+        inline_css: bool = True,
+        **fields: Any
+    ) -> List[str]:
+        """
+        Render the HTML report as fragments around the image source so callers can
+        stream it to disk without copying the base64 image into one large string.
 
-5. **RECOMMENDATIONS & NEXT STEPS**
-   ```html
-   <div class="section-header">Recommendations & Next Steps</div>
-   <div class="content-block">
-   [Evidence-based clinical recommendations]
-   </div>
-   ```
+        Args:
+            scan_id: Scan identifier
+            image_b64: Base64 encoded visualization image, embedded as a data URL
+            image_uri: URI of the visualization image, used instead of image_b64
+            inline_css: Embed REPORT_CSS in a <style> block (False when the
+                stylesheet is passed to WeasyPrint separately)
+            **fields: consensus_* values and the LLM html_content
 
-**KEY REQUIREMENTS:**
-- Use medical terminology appropriate for healthcare professionals
-- Clearly distinguish between consensus findings (most reliable) and individual observations
-- Present information in a scannable format for busy clinicians
-- Include specific clinical recommendations based on findings
-- Maintain professional, clinical tone throughout
-"""
-        return prompt
+        Returns:
+            List of HTML fragments that concatenate to the full document
+        """
+        now = datetime.now()
+        values = dict(
+            fields,
+            scan_id=scan_id,
+            inline_style=f"<style>{REPORT_CSS}</style>" if inline_css else "",
+            report_date=now.strftime('%B %d, %Y'),
+            report_time=now.strftime('%H:%M %Z'),
+            report_timestamp=now.strftime('%Y-%m-%d %H:%M:%S')
+        )
+        return [
+            REPORT_TEMPLATE_HEAD.substitute(values),
+            *((image_uri,) if image_uri else ("data:image/png;base64,", image_b64)),
+            REPORT_TEMPLATE_TAIL.substitute(values)
+        ]
 
-    def generate_report(
+    def _prepare_report(
         self,
         scan_id: str,
         case_dir: str,
@@ -246,64 +734,63 @@ Do **NOT** wrap your answer in ```html or ``` code fences. Output only the raw H
         consensus_path: Optional[str] = None,
         visualization_path: Optional[str] = None,
         output_path: Optional[str] = None
-    ) -> str:
+    ) -> Tuple[str, str, str, List[Dict[str, Any]], Dict[str, Any]]:
         """
-        Generate a comprehensive medical report.
-        
-        Args:
-            scan_id: Scan identifier
-            case_dir: Case directory path
-            scan_data_path: Path to scan data JSON (optional, will use default location)
-            consensus_path: Path to consensus JSON (optional, will use default location)
-            visualization_path: Path to visualization image (optional, will use default location)
-            output_path: Output HTML path (optional, will use default location)
-            
+        Load the case files and build everything needed before the LLM call.
+
         Returns:
-            Path to the generated PDF report
+            Tuple of (output_path, visualization_path, image_b64, messages, consensus_fields)
         """
         # Set default paths if not provided
         if scan_data_path is None:
             scan_data_path = os.path.join(case_dir, "scan_data.json")
         if consensus_path is None:
             consensus_path = os.path.join(case_dir, "consensus_labels.json")
-        if visualization_path is None:
-            visualization_path = os.path.join(case_dir, f"{scan_id}_seg_visualization.png")
         if output_path is None:
             output_path = os.path.join(case_dir, "medical_report.pdf")
 
-        # Load data
-        scan_data = self.load_scan_data(scan_data_path)
-        verdict = self.load_consensus_verdict(consensus_path)
-        comments = self.extract_radiologist_comments(scan_data)
+        # List the case directory once instead of stat-ing each candidate image
+        present = {entry.name for entry in os.scandir(case_dir)}
 
         # Check if visualization image exists
-        if not os.path.exists(visualization_path):
+        if visualization_path is None:
+            visualization_path = os.path.join(case_dir, f"{scan_id}_seg_visualization.png")
+            found = f"{scan_id}_seg_visualization.png" in present
+        else:
+            found = os.path.exists(visualization_path)
+
+        if not found:
             logger.warning(f"Visualization image not found at {visualization_path}")
             # Try alternative naming patterns
-            alt_paths = [
-                os.path.join(case_dir, f"{scan_id}_visualization.png"),
-                os.path.join(case_dir, "visualization.png"),
-                os.path.join(case_dir, "segmentation.png")
+            alt_names = [
+                f"{scan_id}_visualization.png",
+                "visualization.png",
+                "segmentation.png"
             ]
-            for alt_path in alt_paths:
-                if os.path.exists(alt_path):
-                    visualization_path = alt_path
+            for alt_name in alt_names:
+                if alt_name in present:
+                    visualization_path = os.path.join(case_dir, alt_name)
                     break
             else:
                 raise FileNotFoundError(f"No visualization image found for case {scan_id}")
 
-        # Encode image
-        image_b64 = self.encode_image_to_base64(visualization_path)
-        
+        # Load data and encode the image concurrently; orjson and pybase64 release the GIL
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            scan_future = executor.submit(self.load_scan_data, scan_data_path)
+            verdict_future = executor.submit(self.load_consensus_verdict, consensus_path)
+            image_future = executor.submit(self.encode_image_to_base64, visualization_path)
+
+            scan_data = scan_future.result()
+            verdict = verdict_future.result()
+            image_b64 = image_future.result()
+
+        comments = self.extract_radiologist_comments(scan_data)
+
         # Build prompt
         prompt = self.build_prompt(comments, verdict)
 
         # Extract consensus values for the critical findings section
-        consensus_location = verdict.get("Tumor Location", "Not specified")
-        consensus_type = verdict.get("Tumor Type", "Not specified")
-        consensus_grade = verdict.get("Tumor Grade", "Not specified")
-        consensus_size = verdict.get("Size", "Not specified")
-        consensus_confidence = verdict.get("Confidence", "Not specified")
+        consensus_fields = {field: verdict.get(key, "Not specified") for field, key in _FINDING_KEYS}
 
         # Prepare messages for OpenAI API
         messages = [
@@ -320,409 +807,164 @@ Do **NOT** wrap your answer in ```html or ``` code fences. Output only the raw H
             }
         ]
 
+        return output_path, visualization_path, image_b64, messages, consensus_fields
+
+    def _write_report(
+        self,
+        scan_id: str,
+        visualization_path: str,
+        image_b64: str,
+        fields: Dict[str, Any],
+        output_path: str,
+        embed_image: bool = True
+    ) -> str:
+        """
+        Render and write the report as PDF, falling back to HTML.
+
+        Args:
+            scan_id: Scan identifier
+            visualization_path: Path to the visualization image (referenced by the PDF)
+            image_b64: Base64 encoded visualization image (embedded in HTML reports)
+            fields: consensus_* values and the LLM html_content
+            output_path: Output PDF path
+            embed_image: Embed the image in HTML reports as a data URL; when False
+                they link to the PNG on disk instead
+
+        Returns:
+            Path to the written report
+        """
+        image_uri = Path(visualization_path).resolve().as_uri()
+        html_image = {"image_b64": image_b64} if embed_image else {"image_uri": image_uri}
+
+        # Generate PDF from HTML
+        if WEASYPRINT_AVAILABLE:
+            try:
+                # Create HTML object and generate PDF with the pre-parsed stylesheet;
+                # WeasyPrint reads the PNG directly instead of decoding a data URL
+                report_parts = self.render_report_parts(
+                    scan_id,
+                    image_uri=image_uri,
+                    inline_css=False,
+                    **fields
+                )
+                html_doc = HTML(string="".join(report_parts))
+                html_doc.write_pdf(
+                    output_path,
+                    stylesheets=[REPORT_STYLESHEET],
+                    font_config=REPORT_FONT_CONFIG
+                )
+
+                logger.info(f"PDF medical report generated successfully: {output_path}")
+                return output_path
+
+            except Exception as e:
+                logger.error(f"Failed to generate PDF with weasyprint: {e}")
+                # Fallback to HTML
+                html_output_path = str(Path(output_path).with_suffix('.html'))
+                with open(html_output_path, "w", encoding="utf-8") as f:
+                    f.writelines(self.render_report_parts(scan_id, **html_image, **fields))
+                logger.info(f"Fallback: HTML report saved as {html_output_path}")
+                return html_output_path
+        else:
+            # Weasyprint not available, save as HTML
+            logger.warning("weasyprint not available, generating HTML report instead of PDF")
+            html_output_path = str(Path(output_path).with_suffix('.html'))
+            with open(html_output_path, "w", encoding="utf-8") as f:
+                f.writelines(self.render_report_parts(scan_id, **html_image, **fields))
+            logger.info(f"HTML report saved as {html_output_path}")
+            return html_output_path
+
+    def generate_report(
+        self,
+        scan_id: str,
+        case_dir: str,
+        scan_data_path: Optional[str] = None,
+        consensus_path: Optional[str] = None,
+        visualization_path: Optional[str] = None,
+        output_path: Optional[str] = None,
+        embed_image: bool = True
+    ) -> str:
+        """
+        Generate a comprehensive medical report.
+        
+        Args:
+            scan_id: Scan identifier
+            case_dir: Case directory path
+            scan_data_path: Path to scan data JSON (optional, will use default location)
+            consensus_path: Path to consensus JSON (optional, will use default location)
+            visualization_path: Path to visualization image (optional, will use default location)
+            output_path: Output HTML path (optional, will use default location)
+            embed_image: Embed the image in an HTML fallback report (False links the PNG on disk)
+            
+        Returns:
+            Path to the generated PDF report
+        """
+        output_path, visualization_path, image_b64, messages, consensus_fields = self._prepare_report(
+            scan_id, case_dir, scan_data_path, consensus_path, visualization_path, output_path
+        )
+
         try:
-            # Generate report using OpenAI API
-            response = openai.chat.completions.create(
+            # Generate report using OpenAI API, buffering tokens as they are streamed
+            stream = self._client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=messages,
-                max_tokens=2048
+                max_tokens=REPORT_MAX_TOKENS,
+                stream=True
             )
 
-            html_content = response.choices[0].message.content
+            chunks = [event.choices[0].delta.content or "" for event in stream if event.choices]
+            html_content = "".join(chunks)
 
             # Create full HTML document with professional medical report styling
-            full_html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <title>Medical Report - {scan_id}</title>
-    <meta charset="utf-8">
-    <style>
-        @page {{
-            size: A4;
-            margin: 1in;
-            @top-center {{
-                content: "CONFIDENTIAL MEDICAL REPORT";
-                font-size: 8pt;
-                color: #666;
-                font-family: 'Times New Roman', serif;
-            }}
-            @bottom-center {{
-                content: "Page " counter(page) " of " counter(pages);
-                font-size: 8pt;
-                color: #666;
-                font-family: 'Times New Roman', serif;
-            }}
-        }}
-
-        /* Base Typography */
-        body {{
-            font-family: 'Times New Roman', serif;
-            line-height: 1.4;
-            color: #000;
-            font-size: 11pt;
-            margin: 0;
-            padding: 0;
-        }}
-
-        /* Medical Report Header */
-        .medical-header {{
-            border: 2px solid #1a365d;
-            padding: 15px;
-            margin-bottom: 20px;
-            background: linear-gradient(135deg, #f8fafc 0%, #e2e8f0 100%);
-            page-break-inside: avoid;
-        }}
-
-        .institution-info {{
-            text-align: center;
-            border-bottom: 1px solid #1a365d;
-            padding-bottom: 10px;
-            margin-bottom: 10px;
-        }}
-
-        .institution-name {{
-            font-size: 16pt;
-            font-weight: bold;
-            color: #1a365d;
-            margin: 0;
-            letter-spacing: 0.5px;
-        }}
-
-        .department {{
-            font-size: 12pt;
-            color: #2d3748;
-            margin: 2px 0;
-            font-style: italic;
-        }}
-
-        .report-title {{
-            font-size: 14pt;
-            font-weight: bold;
-            color: #1a365d;
-            text-align: center;
-            margin: 10px 0 5px 0;
-            text-transform: uppercase;
-            letter-spacing: 1px;
-        }}
-
-        /* Patient & Case Information */
-        .case-info {{
-            display: table;
-            width: 100%;
-            margin-top: 10px;
-        }}
-
-        .case-info-row {{
-            display: table-row;
-        }}
-
-        .case-info-cell {{
-            display: table-cell;
-            padding: 3px 10px;
-            border-bottom: 1px dotted #cbd5e0;
-            vertical-align: top;
-        }}
-
-        .case-info-label {{
-            font-weight: bold;
-            color: #2d3748;
-            width: 25%;
-        }}
-
-        .case-info-value {{
-            color: #1a202c;
-            width: 75%;
-        }}
-
-        /* Critical Information Box */
-        .critical-findings {{
-            background: #fef5e7;
-            border: 2px solid #ed8936;
-            border-radius: 8px;
-            padding: 15px;
-            margin: 20px 0;
-            page-break-inside: avoid;
-        }}
-
-        .critical-title {{
-            font-size: 13pt;
-            font-weight: bold;
-            color: #c05621;
-            margin: 0 0 10px 0;
-            text-align: center;
-            text-transform: uppercase;
-        }}
-
-        .findings-grid {{
-            display: table;
-            width: 100%;
-            border-collapse: collapse;
-        }}
-
-        .findings-row {{
-            display: table-row;
-        }}
-
-        .findings-cell {{
-            display: table-cell;
-            padding: 8px 12px;
-            border: 1px solid #ed8936;
-            background: #fffbf0;
-            vertical-align: top;
-        }}
-
-        .findings-label {{
-            font-weight: bold;
-            color: #744210;
-            width: 30%;
-        }}
-
-        .findings-value {{
-            color: #1a202c;
-            font-weight: bold;
-            width: 70%;
-        }}
-
-        /* Section Headers */
-        .section-header {{
-            background: #1a365d;
-            color: white;
-            padding: 8px 15px;
-            margin: 25px 0 15px 0;
-            font-size: 12pt;
-            font-weight: bold;
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-            page-break-after: avoid;
-        }}
-
-        .subsection-header {{
-            color: #1a365d;
-            font-size: 11pt;
-            font-weight: bold;
-            margin: 15px 0 8px 0;
-            padding-bottom: 3px;
-            border-bottom: 1px solid #cbd5e0;
-            page-break-after: avoid;
-        }}
-
-        /* Content Styling */
-        .content-block {{
-            margin-bottom: 15px;
-            padding: 10px;
-            background: #f7fafc;
-            border-left: 4px solid #4299e1;
-        }}
-
-        .consensus-block {{
-            background: #e6fffa;
-            border-left: 4px solid #38b2ac;
-            padding: 12px;
-            margin: 10px 0;
-        }}
-
-        .radiologist-block {{
-            background: #faf5ff;
-            border-left: 4px solid #9f7aea;
-            padding: 10px;
-            margin: 8px 0;
-        }}
-
-        .radiologist-name {{
-            font-weight: bold;
-            color: #553c9a;
-            margin-bottom: 5px;
-        }}
-
-        /* Image Styling */
-        .image-container {{
-            text-align: center;
-            margin: 20px 0;
-            page-break-inside: avoid;
-        }}
-
-        .scan-image {{
-            max-width: 350px;
-            width: 100%;
-            border: 2px solid #1a365d;
-            border-radius: 8px;
-            box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-        }}
-
-        .image-caption {{
-            font-size: 10pt;
-            color: #4a5568;
-            font-style: italic;
-            margin-top: 8px;
-            text-align: center;
-        }}
-
-        /* Lists and Text */
-        ul {{
-            margin: 10px 0;
-            padding-left: 20px;
-        }}
-
-        li {{
-            margin-bottom: 4px;
-            line-height: 1.3;
-        }}
-
-        p {{
-            margin: 8px 0;
-            text-align: justify;
-            line-height: 1.4;
-        }}
-
-        strong {{
-            color: #1a202c;
-            font-weight: bold;
-        }}
-
-        /* Footer */
-        .report-footer {{
-            margin-top: 30px;
-            padding: 15px;
-            border-top: 2px solid #1a365d;
-            background: #f7fafc;
-            font-size: 9pt;
-            color: #4a5568;
-            page-break-inside: avoid;
-        }}
-
-        .footer-row {{
-            margin: 3px 0;
-        }}
-
-        .disclaimer {{
-            font-style: italic;
-            text-align: center;
-            margin-top: 10px;
-            color: #718096;
-        }}
-
-        /* Utility Classes */
-        .text-center {{ text-align: center; }}
-        .text-bold {{ font-weight: bold; }}
-        .text-italic {{ font-style: italic; }}
-        .page-break {{ page-break-before: always; }}
-        .no-break {{ page-break-inside: avoid; }}
-
-        /* Print Optimizations */
-        @media print {{
-            body {{ -webkit-print-color-adjust: exact; }}
-            .medical-header {{ background: #f8fafc !important; }}
-        }}
-    </style>
-</head>
-<body>
-    <!-- Medical Report Header -->
-    <div class="medical-header">
-        <div class="institution-info">
-            <div class="institution-name">NeuroGrade Medical Center</div>
-            <div class="department">Department of Radiology & Neuroimaging</div>
-        </div>
-        <div class="report-title">Brain Tumor Analysis Report</div>
+            fields = dict(consensus_fields, html_content=html_content)
+            return self._write_report(scan_id, visualization_path, image_b64, fields, output_path, embed_image)
 
-        <div class="case-info">
-            <div class="case-info-row">
-                <div class="case-info-cell case-info-label">Case ID:</div>
-                <div class="case-info-cell case-info-value">{scan_id}</div>
-                <div class="case-info-cell case-info-label">Report Date:</div>
-                <div class="case-info-cell case-info-value">{__import__('datetime').datetime.now().strftime('%B %d, %Y')}</div>
-            </div>
-            <div class="case-info-row">
-                <div class="case-info-cell case-info-label">Study Type:</div>
-                <div class="case-info-cell case-info-value">MRI Brain with AI Segmentation</div>
-                <div class="case-info-cell case-info-label">Generated:</div>
-                <div class="case-info-cell case-info-value">{__import__('datetime').datetime.now().strftime('%H:%M %Z')}</div>
-            </div>
-            <div class="case-info-row">
-                <div class="case-info-cell case-info-label">Analysis Method:</div>
-                <div class="case-info-cell case-info-value" style="font-weight: bold;">Multi-Radiologist Consensus + AI</div>
-                <div class="case-info-cell case-info-label">Priority:</div>
-                <div class="case-info-cell case-info-value" style="color: #c53030; font-weight: bold;">URGENT REVIEW</div>
-            </div>
-        </div>
-    </div>
+        except Exception as e:
+            logger.error(f"Failed to generate report: {e}")
+            raise
 
-    <!-- MRI Visualization -->
-    <div class="image-container">
-        <img src="data:image/png;base64,{image_b64}" alt="MRI Brain Segmentation" class="scan-image">
-        <div class="image-caption">
-            <strong>Figure 1:</strong> MRI FLAIR sequence with AI-generated tumor segmentation overlay (red region)
-        </div>
-    </div>
+    async def generate_report_async(
+        self,
+        scan_id: str,
+        case_dir: str,
+        scan_data_path: Optional[str] = None,
+        consensus_path: Optional[str] = None,
+        visualization_path: Optional[str] = None,
+        output_path: Optional[str] = None,
+        embed_image: bool = True
+    ) -> str:
+        """
+        Async variant of generate_report. The OpenAI request is awaited and the file
+        loading and PDF rendering run in worker threads, so many reports can be in
+        flight on one event loop.
 
-    <!-- Critical Findings Summary -->
-    <div class="critical-findings">
-        <div class="critical-title">⚠ Critical Findings Summary</div>
-        <div class="findings-grid">
-            <div class="findings-row">
-                <div class="findings-cell findings-label">Tumor Location:</div>
-                <div class="findings-cell findings-value">{consensus_location}</div>
-            </div>
-            <div class="findings-row">
-                <div class="findings-cell findings-label">Tumor Type:</div>
-                <div class="findings-cell findings-value">{consensus_type}</div>
-            </div>
-            <div class="findings-row">
-                <div class="findings-cell findings-label">WHO Grade:</div>
-                <div class="findings-cell findings-value">{consensus_grade}</div>
-            </div>
-            <div class="findings-row">
-                <div class="findings-cell findings-label">Estimated Size:</div>
-                <div class="findings-cell findings-value">{consensus_size}</div>
-            </div>
-            <div class="findings-row">
-                <div class="findings-cell findings-label">Confidence Level:</div>
-                <div class="findings-cell findings-value">{consensus_confidence}</div>
-            </div>
-        </div>
-    </div>
+        Args:
+            Same as generate_report
 
-    <!-- Main Report Content -->
-    {html_content}
+        Returns:
+            Path to the generated PDF report
+        """
+        output_path, visualization_path, image_b64, messages, consensus_fields = await asyncio.to_thread(
+            self._prepare_report,
+            scan_id, case_dir, scan_data_path, consensus_path, visualization_path, output_path
+        )
 
-    <!-- Report Footer -->
-    <div class="report-footer">
-        <div class="footer-row"><strong>NeuroGrade Medical Report Generation System</strong></div>
-        <div class="footer-row">Multi-Radiologist Consensus Analysis with AI-Assisted Interpretation</div>
-        <div class="footer-row">Report ID: {scan_id} | Generated: {__import__('datetime').datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</div>
-        <div class="disclaimer">
-            This report is generated for medical professional use only. Clinical decisions should be made in consultation with qualified healthcare providers.
-            This AI-assisted analysis is intended to support, not replace, professional medical judgment.
-        </div>
-    </div>
-</body>
-</html>"""
+        try:
+            # Generate report using OpenAI API, buffering tokens as they are streamed
+            stream = await self._aclient.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_tokens=REPORT_MAX_TOKENS,
+                stream=True
+            )
 
-            # Generate PDF from HTML
-            if WEASYPRINT_AVAILABLE:
-                try:
-                    # Create HTML object and generate PDF
-                    html_doc = HTML(string=full_html)
-                    html_doc.write_pdf(output_path)
-
-                    logger.info(f"PDF medical report generated successfully: {output_path}")
-                    return output_path
-
-                except Exception as e:
-                    logger.error(f"Failed to generate PDF with weasyprint: {e}")
-                    # Fallback to HTML
-                    html_output_path = output_path.replace('.pdf', '.html')
-                    with open(html_output_path, "w", encoding="utf-8") as f:
-                        f.write(full_html)
-                    logger.info(f"Fallback: HTML report saved as {html_output_path}")
-                    return html_output_path
-            else:
-                # Weasyprint not available, save as HTML
-                logger.warning("weasyprint not available, generating HTML report instead of PDF")
-                html_output_path = output_path.replace('.pdf', '.html')
-                with open(html_output_path, "w", encoding="utf-8") as f:
-                    f.write(full_html)
-                logger.info(f"HTML report saved as {html_output_path}")
-                return html_output_path
+            chunks = [event.choices[0].delta.content or "" async for event in stream if event.choices]
+            html_content = "".join(chunks)
+
+            fields = dict(consensus_fields, html_content=html_content)
+            return await asyncio.to_thread(
+                self._write_report, scan_id, visualization_path, image_b64, fields, output_path, embed_image
+            )
 
         except Exception as e:
             logger.error(f"Failed to generate report: {e}")
@@ -1,17 +1,26 @@
 import os
+import io
 import sys
+import gzip
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 
 import numpy as np
 import nibabel as nib
-import cv2
 
 # TensorFlow / Keras
 import tensorflow as tf
 from tensorflow import keras
 import tensorflow.keras.backend as K
 
+# Numba is optional; prepare_input falls back to a batched tf.image.resize without it
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 
 # -----------------------------------------------------------------------------
 # Constants (aligned with the training notebook)
@@ -20,46 +29,45 @@ IMG_SIZE: int = 128
 VOLUME_SLICES: int = 100
 VOLUME_START_AT: int = 22
 
+# Per-call batch size when the full slice window does not fit on the device
+PREDICT_FALLBACK_BATCH: int = 16
+
+# Keras 3 (TF >= 2.16) can neither write nor load SavedModel directories via save/load_model
+SAVED_MODEL_SUPPORTED: bool = int(keras.__version__.split('.')[0]) < 3
+
 
 # -----------------------------------------------------------------------------
 # Custom metrics used during training (needed to load certain .h5 checkpoints)
 # -----------------------------------------------------------------------------
+@tf.function(jit_compile=True)
 def dice_coef(y_true, y_pred, smooth: float = 1.0):
-    class_num = 4
-    total_loss = None
-    for class_index in range(class_num):
-        y_true_f = K.flatten(y_true[:, :, :, class_index])
-        y_pred_f = K.flatten(y_pred[:, :, :, class_index])
-        intersection = K.sum(y_true_f * y_pred_f)
-        loss = ((2.0 * intersection + smooth) /
-                (K.sum(y_true_f) + K.sum(y_pred_f) + smooth))
-        if total_loss is None:
-            total_loss = loss
-        else:
-            total_loss = total_loss + loss
-    total_loss = total_loss / class_num
-    return total_loss
+    # Mean soft dice over the 4 classes, reduced over (batch, H, W) in one pass;
+    # XLA fuses the three reductions into a single kernel
+    axes = [0, 1, 2]
+    intersection = K.sum(y_true * y_pred, axis=axes)
+    per_class = (2.0 * intersection + smooth) / (
+        K.sum(y_true, axis=axes) + K.sum(y_pred, axis=axes) + smooth
+    )
+    return K.mean(per_class)
+
+
+def _class_dice(y_true, y_pred, class_index: int, epsilon: float):
+    y_true_c = y_true[:, :, :, class_index]
+    y_pred_c = y_pred[:, :, :, class_index]
+    intersection = K.sum(K.abs(y_true_c * y_pred_c))
+    return (2.0 * intersection) / (K.sum(K.square(y_true_c)) + K.sum(K.square(y_pred_c)) + epsilon)
 
 
 def dice_coef_necrotic(y_true, y_pred, epsilon: float = 1e-6):
-    intersection = K.sum(K.abs(y_true[:, :, :, 1] * y_pred[:, :, :, 1]))
-    return (2.0 * intersection) / (
-        K.sum(K.square(y_true[:, :, :, 1])) + K.sum(K.square(y_pred[:, :, :, 1])) + epsilon
-    )
+    return _class_dice(y_true, y_pred, 1, epsilon)
 
 
 def dice_coef_edema(y_true, y_pred, epsilon: float = 1e-6):
-    intersection = K.sum(K.abs(y_true[:, :, :, 2] * y_pred[:, :, :, 2]))
-    return (2.0 * intersection) / (
-        K.sum(K.square(y_true[:, :, :, 2])) + K.sum(K.square(y_pred[:, :, :, 2])) + epsilon
-    )
+    return _class_dice(y_true, y_pred, 2, epsilon)
 
 
 def dice_coef_enhancing(y_true, y_pred, epsilon: float = 1e-6):
-    intersection = K.sum(K.abs(y_true[:, :, :, 3] * y_pred[:, :, :, 3]))
-    return (2.0 * intersection) / (
-        K.sum(K.square(y_true[:, :, :, 3])) + K.sum(K.square(y_pred[:, :, :, 3])) + epsilon
-    )
+    return _class_dice(y_true, y_pred, 3, epsilon)
 
 
 def precision(y_true, y_pred):
@@ -95,41 +103,146 @@ CUSTOM_OBJECTS = {
 # -----------------------------------------------------------------------------
 # I/O helpers
 # -----------------------------------------------------------------------------
-def load_nifti(path: str) -> Tuple[np.ndarray, np.ndarray, nib.Nifti1Header]:
+def load_nifti(path: str) -> Tuple[nib.arrayproxy.ArrayProxy, np.ndarray, nib.Nifti1Header]:
+    # Returns the lazy array proxy; prepare_input reads only the slice window from disk
     if not os.path.exists(path):
         raise FileNotFoundError(f"Missing NIfTI file: {path}")
     img = nib.load(path)
+    return img.dataobj, img.affine, img.header
+
+
+def load_nifti_bytes(raw: bytes) -> Tuple[np.ndarray, np.ndarray, nib.Nifti1Header]:
+    # Decode a .nii or .nii.gz payload held in memory (e.g. an HTTP upload)
+    if raw[:2] == b"\x1f\x8b":
+        raw = gzip.decompress(raw)
+    file_holder = nib.FileHolder(fileobj=io.BytesIO(raw))
+    img = nib.Nifti1Image.from_file_map({"header": file_holder, "image": file_holder})
     data = img.get_fdata()
     return data, img.affine, img.header
 
 
 def save_nifti(label_volume: np.ndarray, affine: np.ndarray, header: nib.Nifti1Header, out_path: str) -> None:
-    # Ensure integer labels for segmentation and cast to int16 to save space
-    label_volume = label_volume.astype(np.int16)
+    # Segmentation labels {0,1,2,3} fit in uint8; override the source header dtype to match
+    label_volume = label_volume.astype(np.uint8, copy=False)
     seg_img = nib.Nifti1Image(label_volume, affine, header)
+    seg_img.set_data_dtype(np.uint8)
     nib.save(seg_img, out_path)
 
 
 # -----------------------------------------------------------------------------
 # Preprocessing and prediction
 # -----------------------------------------------------------------------------
-def build_model(model_path: str) -> keras.Model:
+def get_saved_model_path(model_path: str) -> str:
+    # SavedModel export kept next to the .h5 checkpoint
+    return os.path.splitext(model_path)[0] + '_savedmodel'
+
+
+def load_h5_model(model_path: str) -> keras.Model:
     # Try loading with custom_objects (safer if the model was saved with them referenced)
     try:
-        model = keras.models.load_model(model_path, custom_objects=CUSTOM_OBJECTS, compile=False)
-        return model
+        return keras.models.load_model(model_path, custom_objects=CUSTOM_OBJECTS, compile=False)
     except Exception as first_err:
         # Fallback to loading without custom objects
         try:
-            model = keras.models.load_model(model_path, compile=False)
-            return model
+            return keras.models.load_model(model_path, compile=False)
         except Exception as second_err:
             raise RuntimeError(
                 f"Failed to load model from {model_path}. First error: {first_err}. Second error: {second_err}"
             )
 
 
+def build_model(model_path: str, mixed_precision: bool = False) -> keras.Model:
+    # Prefer the SavedModel export (traced graph, no custom-object resolution) while
+    # it is newer than the .h5; otherwise load the .h5 and refresh the export
+    saved_path = get_saved_model_path(model_path)
+    model = None
+    if not SAVED_MODEL_SUPPORTED:
+        model = load_h5_model(model_path)
+    elif os.path.isdir(saved_path) and os.path.getmtime(saved_path) >= os.path.getmtime(model_path):
+        try:
+            model = keras.models.load_model(saved_path, compile=False)
+        except Exception as e:
+            print(f"Ignoring unreadable SavedModel at {saved_path}: {e}")
+
+    if model is None:
+        model = load_h5_model(model_path)
+        try:
+            model.save(saved_path, save_format='tf')
+        except Exception as e:
+            print(f"Could not export SavedModel to {saved_path}: {e}")
+
+    # float16 compute only pays off on GPUs; on CPU it is slower than float32
+    if mixed_precision and tf.config.list_physical_devices('GPU'):
+        model = to_mixed_precision(model)
+    return model
+
+
+def to_mixed_precision(model: keras.Model) -> keras.Model:
+    """
+    Rebuilds a loaded float32 model under the mixed_float16 policy (float16 compute,
+    float32 weights) and copies the trained weights over. The .h5 config pins every
+    layer to float32, so the per-layer dtypes are dropped before rebuilding.
+    """
+    config = model.get_config()
+    for layer in config['layers']:
+        if layer['class_name'] != 'InputLayer':
+            layer['config'].pop('dtype', None)
+
+    previous_policy = keras.mixed_precision.global_policy()
+    keras.mixed_precision.set_global_policy('mixed_float16')
+    try:
+        fp16_model = keras.Model.from_config(config, custom_objects=CUSTOM_OBJECTS)
+    finally:
+        keras.mixed_precision.set_global_policy(previous_policy)
+
+    fp16_model.set_weights(model.get_weights())
+    return fp16_model
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _resize_slices_bilinear(volume, z_start, out, slice_max):
+        """
+        Bilinear resize of volume[:, :, z_start:z_start + N] into the contiguous (N, H, W) out,
+        matching cv2.INTER_LINEAR (half-pixel centers, edge clamping). The maximum of
+        each resized slice is written to slice_max so no separate max pass is needed.
+        """
+        src_h, src_w = volume.shape[0], volume.shape[1]
+        num_slices, dst_h, dst_w = out.shape[0], out.shape[1], out.shape[2]
+        scale_y = src_h / dst_h
+        scale_x = src_w / dst_w
+        for s in prange(num_slices):
+            z = z_start + s
+            local_max = -np.inf
+            for dy in range(dst_h):
+                fy = (dy + 0.5) * scale_y - 0.5
+                sy = int(np.floor(fy))
+                fy -= sy
+                if sy < 0:
+                    sy, fy = 0, 0.0
+                if sy >= src_h - 1:
+                    sy, fy = src_h - 1, 0.0
+                sy1 = min(sy + 1, src_h - 1)
+                for dx in range(dst_w):
+                    fx = (dx + 0.5) * scale_x - 0.5
+                    sx = int(np.floor(fx))
+                    fx -= sx
+                    if sx < 0:
+                        sx, fx = 0, 0.0
+                    if sx >= src_w - 1:
+                        sx, fx = src_w - 1, 0.0
+                    sx1 = min(sx + 1, src_w - 1)
+                    top = volume[sy, sx, z] * (1.0 - fx) + volume[sy, sx1, z] * fx
+                    bottom = volume[sy1, sx, z] * (1.0 - fx) + volume[sy1, sx1, z] * fx
+                    value = top * (1.0 - fy) + bottom * fy
+                    out[s, dy, dx] = value
+                    if value > local_max:
+                        local_max = value
+            slice_max[s] = local_max
+
+
 def prepare_input(modality_to_volume: dict, channel_order: Tuple[str, ...]) -> np.ndarray:
+    # Volumes may be arrays or nibabel array proxies; only the slice window is read
     # Validate same shapes across chosen modalities
     shapes = [modality_to_volume[name].shape for name in channel_order]
     if len(set(shapes)) != 1:
@@ -144,17 +257,37 @@ def prepare_input(modality_to_volume: dict, channel_order: Tuple[str, ...]) -> n
     num_channels = len(channel_order)
     x_batch = np.empty((VOLUME_SLICES, IMG_SIZE, IMG_SIZE, num_channels), dtype=np.float32)
 
-    for slice_index in range(VOLUME_SLICES):
-        z = slice_index + VOLUME_START_AT
-        for channel_index, modality_name in enumerate(channel_order):
-            slice_2d = modality_to_volume[modality_name][:, :, z]
-            resized = cv2.resize(slice_2d, (IMG_SIZE, IMG_SIZE), interpolation=cv2.INTER_LINEAR)
-            x_batch[slice_index, :, :, channel_index] = resized
+    def read_slab(volume) -> np.ndarray:
+        return np.asarray(volume[:, :, VOLUME_START_AT:VOLUME_START_AT + VOLUME_SLICES], dtype=np.float32)
 
-    # Normalize by the global max across the input batch to match notebook logic
-    max_val = np.max(x_batch)
+    volumes = [modality_to_volume[name] for name in channel_order]
+    if num_channels > 1 and not all(isinstance(volume, np.ndarray) for volume in volumes):
+        # Proxy reads are file I/O and gzip inflation, which release the GIL; overlap them
+        with ThreadPoolExecutor(max_workers=num_channels) as executor:
+            slabs = list(executor.map(read_slab, volumes))
+    else:
+        slabs = [read_slab(volume) for volume in volumes]
+
+    if NUMBA_AVAILABLE:
+        # Fixed-shape compiled kernel: all slices of a channel resized in parallel,
+        # tracking the per-slice max while the values are still in registers. Each channel
+        # is written to its own contiguous buffer and interleaved once at the end
+        slice_max = np.empty((num_channels, VOLUME_SLICES), dtype=np.float32)
+        channels = [np.empty((VOLUME_SLICES, IMG_SIZE, IMG_SIZE), dtype=np.float32) for _ in slabs]
+        for channel_index, slab in enumerate(slabs):
+            _resize_slices_bilinear(slab, 0, channels[channel_index], slice_max[channel_index])
+        np.stack(channels, axis=-1, out=x_batch)
+        max_val = slice_max.max()
+    else:
+        # One batched bilinear resize over all slices and channels, shaped (Z, H, W, C)
+        slab = np.ascontiguousarray(np.transpose(np.stack(slabs, axis=-1), (2, 0, 1, 3)))
+        resized = tf.image.resize(slab, (IMG_SIZE, IMG_SIZE), method='bilinear')
+        max_val = float(tf.reduce_max(resized))
+        x_batch[...] = resized
+
+    # Normalize in place by the global max across the input batch to match notebook logic
     if max_val > 0:
-        x_batch = x_batch / max_val
+        np.divide(x_batch, max_val, out=x_batch)
 
     return x_batch
 
@@ -165,19 +298,43 @@ def predict_segmentation(model: keras.Model, x_batch: np.ndarray, original_hw: T
     original in-plane resolution and correct slice positions. Slices outside the
     predicted range are left as background (0).
     """
-    height, width = original_hw
+    # Predict per-slice softmax maps (VOLUME_SLICES, IMG_SIZE, IMG_SIZE, 4). The whole
+    # window is one batch, so call the model directly instead of predict()'s pipeline
+    try:
+        probs = model(tf.constant(x_batch), training=False)
+    except tf.errors.ResourceExhaustedError:
+        # The full window does not fit on the device; let predict() split it
+        probs = model.predict(x_batch, batch_size=PREDICT_FALLBACK_BATCH, verbose=0)
+
+    # Argmax and narrowing on the device; only the uint8 labels are copied back
+    labels_small = tf.cast(tf.argmax(probs, axis=-1, output_type=tf.int32), tf.uint8).numpy()
+    return upsample_labels(labels_small, original_hw)
+
 
-    # Predict per-slice softmax maps (VOLUME_SLICES, IMG_SIZE, IMG_SIZE, 4)
-    probs = model.predict(x_batch, verbose=1)
+def probs_to_labels(probs: np.ndarray, original_hw: Tuple[int, int]) -> np.ndarray:
+    """
+    Converts per-slice softmax maps to discrete labels and upsamples them back to
+    the original in-plane resolution.
+    """
     # Convert to discrete labels via argmax
     labels_small = np.argmax(probs, axis=-1).astype(np.uint8)
+    return upsample_labels(labels_small, original_hw)
 
-    # Upsample each slice back to original in-plane resolution using nearest neighbor
-    labels_fullres = np.empty((VOLUME_SLICES, height, width), dtype=np.uint8)
-    for i in range(VOLUME_SLICES):
-        labels_fullres[i] = cv2.resize(
-            labels_small[i], (width, height), interpolation=cv2.INTER_NEAREST
-        )
+
+def upsample_labels(labels_small: np.ndarray, original_hw: Tuple[int, int]) -> np.ndarray:
+    """
+    Upsamples per-slice label maps (VOLUME_SLICES, IMG_SIZE, IMG_SIZE) back to the
+    original in-plane resolution, returned in volume layout (H, W, VOLUME_SLICES).
+    """
+    height, width = original_hw
+
+    # Nearest-neighbor upsample of all slices in one gather, using the same source
+    # index rule as cv2.INTER_NEAREST: src = min(floor(dst * src_size / dst_size), src_size - 1)
+    src_h, src_w = labels_small.shape[1], labels_small.shape[2]
+    rows = np.minimum(np.floor(np.arange(height) * (src_h / height)).astype(np.intp), src_h - 1)
+    cols = np.minimum(np.floor(np.arange(width) * (src_w / width)).astype(np.intp), src_w - 1)
+    # Gathering from the (H, W, Z) view emits the result directly in volume layout
+    labels_fullres = labels_small.transpose(1, 2, 0)[rows[:, None], cols[None, :]]
 
     return labels_fullres
 
@@ -186,14 +343,14 @@ def assemble_full_volume(
     labels_fullres: np.ndarray, original_shape: Tuple[int, int, int]
 ) -> np.ndarray:
     """
-    Places the predicted slices back into a full 3D volume of shape (H, W, D),
-    leaving slices before/after the predicted window as background (0).
+    Places the predicted (H, W, VOLUME_SLICES) labels back into a full 3D volume of
+    shape (H, W, D), leaving slices before/after the predicted window as background (0).
     """
     height, width, depth = original_shape
     seg_volume = np.zeros((height, width, depth), dtype=np.uint8)
 
     slice_end = VOLUME_START_AT + VOLUME_SLICES
-    seg_volume[:, :, VOLUME_START_AT:slice_end] = np.transpose(labels_fullres, (1, 2, 0))
+    seg_volume[:, :, VOLUME_START_AT:slice_end] = labels_fullres
     return seg_volume
 
 
@@ -231,6 +388,10 @@ def parse_args() -> argparse.Namespace:
         default=os.path.join(default_public, 'BraTS20_Validation_008_seg.nii'),
         help='Path to save the predicted segmentation NIfTI.'
     )
+    parser.add_argument(
+        '--fp16', action='store_true',
+        help='Run the model with mixed_float16 compute when a GPU is available.'
+    )
     parser.add_argument(
         '--channels', type=str, default='',
         help='Comma-separated channel order to use from {flair,t1,t1ce,t2}. '
@@ -243,19 +404,18 @@ def main() -> None:
     args = parse_args()
 
     print(f"Loading model from: {args.model}")
-    model = build_model(args.model)
+    model = build_model(args.model, mixed_precision=args.fp16)
     print("Model loaded.")
 
-    # Load all available modalities
-    modalities = {}
-    print(f"Loading FLAIR: {args.flair}")
-    modalities['flair'], flair_affine, flair_header = load_nifti(args.flair)
-    print(f"Loading T1:    {args.t1}")
-    modalities['t1'], _, _ = load_nifti(args.t1)
-    print(f"Loading T1CE:  {args.t1ce}")
-    modalities['t1ce'], _, _ = load_nifti(args.t1ce)
-    print(f"Loading T2:    {args.t2}")
-    modalities['t2'], _, _ = load_nifti(args.t2)
+    # Open all available modalities (headers only; prepare_input reads the slice windows)
+    paths = {'flair': args.flair, 't1': args.t1, 't1ce': args.t1ce, 't2': args.t2}
+    results = {}
+    for name, path in paths.items():
+        print(f"Loading {name.upper() + ':':<6} {path}")
+        results[name] = load_nifti(path)
+
+    modalities = {name: data for name, (data, _, _) in results.items()}
+    _, flair_affine, flair_header = results['flair']
 
     # Validate shapes
     shapes = {name: vol.shape for name, vol in modalities.items()}
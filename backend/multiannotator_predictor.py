@@ -2,11 +2,97 @@ import numpy as np
 import pandas as pd
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import cross_val_predict
+from sklearn.preprocessing import StandardScaler
 from typing import Dict, Any, Optional, Union
 import warnings
 
 from cleanlab.multiannotator import get_label_quality_multiannotator, get_majority_vote_label
 
+# Numba is optional; without it majority voting always goes through cleanlab
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, cache=True)
+    def _majority_vote_counts(labels, num_classes):
+        """
+        Per-row majority vote over annotators (-1 marks a missing annotation).
+        Returns the winning class per row and whether the row's top count is tied.
+
+        num_classes is a runtime argument rather than a compile-time constant, so one
+        kernel serves every field and is cached to disk across processes.
+        """
+        n = labels.shape[0]
+        winners = np.empty(n, np.int64)
+        tied = np.zeros(n, np.bool_)
+        for i in prange(n):
+            counts = np.zeros(num_classes, np.int64)
+            for j in range(labels.shape[1]):
+                v = labels[i, j]
+                if v >= 0:
+                    counts[v] += 1
+            best = counts.argmax()
+            winners[i] = best
+            for c in range(num_classes):
+                if c != best and counts[c] == counts[best]:
+                    tied[i] = True
+                    break
+        return winners, tied
+
+
+def get_majority_vote_labels(
+    multiannotator_labels: pd.DataFrame,
+    label_values: Optional[np.ndarray] = None,
+    notna_mask: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Majority vote consensus labels, computed with a compiled per-row count when numba
+    is available. Cleanlab breaks ties using dataset-wide annotator statistics, so if
+    any row is tied the whole matrix is handed to get_majority_vote_label instead.
+
+    label_values / notna_mask may be passed in when the caller already has them.
+    """
+    if NUMBA_AVAILABLE:
+        if label_values is None:
+            label_values = multiannotator_labels.to_numpy()
+        if notna_mask is None:
+            notna_mask = pd.notna(label_values)
+        labels = np.where(notna_mask, label_values, -1).astype(np.int64)
+        num_classes = int(labels.max()) + 1
+        if num_classes > 0:
+            winners, tied = _majority_vote_counts(labels, num_classes)
+            if not tied.any():
+                return winners
+    return get_majority_vote_label(multiannotator_labels)
+
+
+def get_local_majority_vote_labels(label_values: np.ndarray, notna_mask: np.ndarray) -> np.ndarray:
+    """
+    Per-row majority vote that breaks ties by taking the lowest tied class, without
+    deferring to cleanlab. Used where there is no dataset to draw cleanlab's tie-breaking
+    statistics from (cleanlab raises on a single tied row).
+    """
+    labels = np.where(notna_mask, label_values, -1).astype(np.int64)
+    num_classes = max(int(labels.max()) + 1, 1) if labels.size else 1
+    if NUMBA_AVAILABLE:
+        return _majority_vote_counts(labels, num_classes)[0]
+    counts = np.zeros((labels.shape[0], num_classes), dtype=np.int64)
+    rows, cols = np.nonzero(labels >= 0)
+    np.add.at(counts, (rows, labels[rows, cols]), 1)
+    return counts.argmax(axis=1)
+
+
+def get_annotated_classes(label_values: np.ndarray, notna_mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Sorted unique class labels present in the annotation matrix, ignoring missing entries."""
+    if notna_mask is None:
+        notna_mask = pd.notna(label_values)
+    return np.unique(label_values[notna_mask].astype(np.int64))
+
+
 class MultiAnnotatorPredictor:
     """
     A class for analyzing multi-annotator labeled data and generating improved consensus labels.
@@ -19,6 +105,7 @@ class MultiAnnotatorPredictor:
     Attributes:
         model: The classifier model used for generating predicted probabilities
         num_crossval_folds: Number of cross-validation folds for generating out-of-sample predictions
+        standardize_features: Whether features are standardized once before cross-validation
         verbose: Whether to print verbose output during processing
     """
     
@@ -26,18 +113,22 @@ class MultiAnnotatorPredictor:
         self, 
         model=None, 
         num_crossval_folds: int = 5, 
+        standardize_features: bool = True,
         verbose: bool = False
     ):
         """
         Initialize the MultiAnnotatorPredictor.
         
         Args:
-            model: Sklearn-compatible classifier. Defaults to LogisticRegression()
+            model: Sklearn-compatible classifier. Defaults to LogisticRegression(solver='lbfgs', max_iter=200)
             num_crossval_folds: Number of cross-validation folds for out-of-sample predictions
+            standardize_features: Scale features to zero mean / unit variance once up front,
+                                  so lbfgs converges in fewer iterations on every fold
             verbose: Whether to print verbose output during processing
         """
-        self.model = model if model is not None else LogisticRegression()
+        self.model = model if model is not None else LogisticRegression(solver='lbfgs', max_iter=200)
         self.num_crossval_folds = num_crossval_folds
+        self.standardize_features = standardize_features
         self.verbose = verbose
         
         # Store results from the last prediction
@@ -89,7 +180,12 @@ class MultiAnnotatorPredictor:
         if self.verbose:
             print("Computing initial consensus labels via majority vote...")
         
-        majority_vote_labels = get_majority_vote_label(multiannotator_labels)
+        # Scan the missing-annotation mask once and share it with the helpers below
+        label_values = multiannotator_labels.to_numpy()
+        notna_mask = pd.notna(label_values)
+        all_classes = get_annotated_classes(label_values, notna_mask)
+
+        majority_vote_labels = get_majority_vote_labels(multiannotator_labels, label_values, notna_mask)
         self._last_majority_vote_labels = majority_vote_labels
         
         # Step 2: Train classifier and get out-of-sample predicted probabilities
@@ -110,13 +206,8 @@ class MultiAnnotatorPredictor:
             unique_class = majority_vote_labels[0]
             n_samples = len(majority_vote_labels)
             
-            # Find all possible classes to create proper probability matrix
-            all_classes = set()
-            for col in multiannotator_labels.columns:
-                unique_vals = multiannotator_labels[col].dropna().unique()
-                all_classes.update(unique_vals)
-            
-            max_class = int(max(all_classes)) if all_classes else unique_class
+            # Use all annotated classes to create proper probability matrix
+            max_class = int(all_classes.max()) if all_classes.size else unique_class
             expected_num_classes = max_class + 1
             
             # Create probability matrix with proper dimensions
@@ -146,6 +237,9 @@ class MultiAnnotatorPredictor:
                 print(f"Reducing cross-validation folds from {self.num_crossval_folds} to {cv_folds} due to class distribution.")
                 print(f"Class distribution: {dict(class_counts)}")
 
+            if self.standardize_features:
+                features = StandardScaler().fit_transform(features)
+
             pred_probs = cross_val_predict(
                 estimator=self.model,
                 X=features,
@@ -157,13 +251,8 @@ class MultiAnnotatorPredictor:
         # Handle case where pred_probs doesn't have enough columns for all classes
         # (Skip this if we already handled single-class case above)
         if num_unique_classes > 1:
-            # Find all unique classes in multiannotator_labels
-            all_classes = set()
-            for col in multiannotator_labels.columns:
-                unique_vals = multiannotator_labels[col].dropna().unique()
-                all_classes.update(unique_vals)
-            
-            max_class = int(max(all_classes)) if all_classes else 0
+            # Size the matrix by all annotated classes in multiannotator_labels
+            max_class = int(all_classes.max()) if all_classes.size else 0
             expected_num_classes = max_class + 1
             
             if pred_probs.shape[1] < expected_num_classes:
@@ -177,14 +266,13 @@ class MultiAnnotatorPredictor:
                 trained_classes = np.unique(majority_vote_labels)
                 
                 # Fill in probabilities for classes the model knows about
-                for i, cls in enumerate(trained_classes):
-                    expanded_pred_probs[:, cls] = pred_probs[:, i]
+                expanded_pred_probs[:, trained_classes] = pred_probs
                 
                 # For missing classes, assign small uniform probability
                 missing_prob = 1e-10
-                for cls in range(expected_num_classes):
-                    if cls not in trained_classes:
-                        expanded_pred_probs[:, cls] = missing_prob
+                missing_mask = np.ones(expected_num_classes, dtype=bool)
+                missing_mask[trained_classes] = False
+                expanded_pred_probs[:, missing_mask] = missing_prob
                 
                 # Renormalize to ensure probabilities sum to 1
                 row_sums = expanded_pred_probs.sum(axis=1, keepdims=True)
@@ -195,17 +283,204 @@ class MultiAnnotatorPredictor:
         self._last_pred_probs = pred_probs
         
         # Step 3: Use cleanlab to get improved consensus labels and quality scores
+        if all_classes.size == 1:
+            # Every annotation is the same class: the consensus and its quality are
+            # already known, so skip cleanlab's quality pipeline
+            if self.verbose:
+                print("All annotations agree - building quality scores directly.")
+            results = self._unanimous_label_quality(
+                multiannotator_labels, majority_vote_labels, notna_mask
+            )
+        else:
+            if self.verbose:
+                print("Computing improved consensus labels and quality scores...")
+            
+            results = get_label_quality_multiannotator(
+                multiannotator_labels, 
+                pred_probs, 
+                verbose=self.verbose
+            )
+        self._last_results = results
+        
+        output = self._format_output(results, majority_vote_labels, pred_probs, return_detailed_results)
+        
+        if self.verbose:
+            print("Analysis complete!")
+            print(f"Generated consensus labels for {len(output['consensus_labels'])} examples")
+            if return_detailed_results:
+                print(f"Analyzed {len(output['annotator_stats'])} annotators")
+        
+        return output
+
+    def fit_predict_single(
+        self,
+        multiannotator_labels: Union[pd.DataFrame, np.ndarray],
+        features: np.ndarray,
+        return_detailed_results: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Consensus labels for data too small to cross-validate (fewer than 2 examples).
+        
+        No classifier is trained: the consensus is the majority vote and every quality
+        score is the fraction of annotations that agree with it. Returns the same
+        dictionary as predict().
+        """
+        if isinstance(multiannotator_labels, np.ndarray):
+            multiannotator_labels = pd.DataFrame(multiannotator_labels)
+        
+        if features.shape[0] != multiannotator_labels.shape[0]:
+            raise ValueError(f"Number of examples in features ({features.shape[0]}) must match "
+                           f"number of examples in multiannotator_labels ({multiannotator_labels.shape[0]})")
+        
         if self.verbose:
-            print("Computing improved consensus labels and quality scores...")
+            print(f"Processing {multiannotator_labels.shape[0]} examples with "
+                  f"{multiannotator_labels.shape[1]} annotators without cross-validation")
+        
+        label_values = multiannotator_labels.to_numpy()
+        notna_mask = pd.notna(label_values)
+        all_classes = get_annotated_classes(label_values, notna_mask)
+        
+        # Ties go to the lowest tied class; cleanlab cannot break ties for a lone example
+        majority_vote_labels = get_local_majority_vote_labels(label_values, notna_mask)
+        self._last_majority_vote_labels = majority_vote_labels
         
-        results = get_label_quality_multiannotator(
-            multiannotator_labels, 
-            pred_probs, 
-            verbose=self.verbose
+        # Near one-hot probabilities on the voted class, sized by all annotated classes
+        num_classes = int(all_classes.max()) + 1 if all_classes.size else int(majority_vote_labels.max()) + 1
+        pred_probs = self._consensus_pred_probs(majority_vote_labels, num_classes)
+        self._last_pred_probs = pred_probs
+        
+        # Agreement of each annotation with the voted class
+        int_labels = np.where(notna_mask, label_values, -1).astype(np.int64)
+        matches = notna_mask & (int_labels == majority_vote_labels[:, None])
+        num_annotations = notna_mask.sum(axis=1)
+        num_labeled = notna_mask.sum(axis=0)
+        agreement = matches.sum(axis=1) / np.maximum(num_annotations, 1)
+        annotator_agreement = np.divide(
+            matches.sum(axis=0), num_labeled,
+            out=np.full(len(num_labeled), np.nan), where=num_labeled > 0
         )
+        annotators = multiannotator_labels.columns
+        
+        results = {
+            'label_quality': pd.DataFrame({
+                'consensus_label': majority_vote_labels,
+                'consensus_quality_score': agreement,
+                'annotator_agreement': agreement,
+                'num_annotations': num_annotations
+            }),
+            'annotator_stats': pd.DataFrame({
+                'annotator_quality': annotator_agreement,
+                'agreement_with_consensus': annotator_agreement,
+                'worst_class': majority_vote_labels[0],
+                'num_examples_labeled': num_labeled
+            }, index=annotators),
+            'detailed_label_quality': pd.DataFrame(
+                np.where(notna_mask, matches.astype(float), np.nan),
+                columns=[f"quality_annotator_{name}" for name in annotators]
+            )
+        }
+        self._last_results = results
+        
+        return self._format_output(results, majority_vote_labels, pred_probs, return_detailed_results)
+
+    def predict_ordinal(
+        self,
+        multiannotator_labels: Union[pd.DataFrame, np.ndarray],
+        features: np.ndarray,
+        num_classes: Optional[int] = None,
+        return_detailed_results: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Consensus labels for ordered classes (e.g. confidence bins) without training a classifier.
+        
+        The consensus is the rounded mean of each example's annotations. Its quality score is
+        1 - std / (half the class range), and each annotation scores 1 - |label - consensus| /
+        (class range). Returns the same dictionary as predict().
+        """
+        if isinstance(multiannotator_labels, np.ndarray):
+            multiannotator_labels = pd.DataFrame(multiannotator_labels)
+        
+        if features.shape[0] != multiannotator_labels.shape[0]:
+            raise ValueError(f"Number of examples in features ({features.shape[0]}) must match "
+                           f"number of examples in multiannotator_labels ({multiannotator_labels.shape[0]})")
+        
+        if self.verbose:
+            print(f"Processing {multiannotator_labels.shape[0]} examples with "
+                  f"{multiannotator_labels.shape[1]} annotators as ordinal labels")
+        
+        label_values = multiannotator_labels.to_numpy(dtype=float, na_value=np.nan)
+        notna_mask = ~np.isnan(label_values)
+        
+        if num_classes is None:
+            num_classes = int(np.nanmax(label_values)) + 1
+        class_range = max(num_classes - 1, 1)
+        
+        # Mean and spread of the annotations per example (rows without annotations score 0)
+        num_annotations = notna_mask.sum(axis=1)
+        counts = np.maximum(num_annotations, 1)
+        filled = np.where(notna_mask, label_values, 0.0)
+        means = filled.sum(axis=1) / counts
+        stds = np.sqrt((np.where(notna_mask, label_values - means[:, None], 0.0) ** 2).sum(axis=1) / counts)
+        
+        consensus_labels = np.clip(np.round(means), 0, num_classes - 1).astype(np.int64)
+        # The rounded mean stands in for the vote, so tied bins never reach cleanlab
+        majority_vote_labels = consensus_labels
+        self._last_majority_vote_labels = majority_vote_labels
+        consensus_quality = np.where(num_annotations > 0, np.clip(1.0 - stds / (class_range / 2), 0.0, 1.0), 0.0)
+        
+        deviation = np.abs(label_values - consensus_labels[:, None])
+        annotation_quality = 1.0 - deviation / class_range
+        matches = notna_mask & (deviation == 0)
+        num_labeled = notna_mask.sum(axis=0)
+        has_labels = num_labeled > 0
+        annotators = multiannotator_labels.columns
+        
+        results = {
+            'label_quality': pd.DataFrame({
+                'consensus_label': consensus_labels,
+                'consensus_quality_score': consensus_quality,
+                'annotator_agreement': matches.sum(axis=1) / counts,
+                'num_annotations': num_annotations
+            }),
+            'annotator_stats': pd.DataFrame({
+                'annotator_quality': np.divide(
+                    np.where(notna_mask, annotation_quality, 0.0).sum(axis=0), num_labeled,
+                    out=np.full(len(num_labeled), np.nan), where=has_labels
+                ),
+                'agreement_with_consensus': np.divide(
+                    matches.sum(axis=0), num_labeled,
+                    out=np.full(len(num_labeled), np.nan), where=has_labels
+                ),
+                'worst_class': consensus_labels[np.argmax(np.where(notna_mask, deviation, -1.0), axis=0)],
+                'num_examples_labeled': num_labeled
+            }, index=annotators),
+            'detailed_label_quality': pd.DataFrame(
+                annotation_quality,
+                columns=[f"quality_annotator_{name}" for name in annotators]
+            )
+        }
         self._last_results = results
         
-        # Prepare return dictionary
+        pred_probs = self._consensus_pred_probs(consensus_labels, num_classes)
+        self._last_pred_probs = pred_probs
+        
+        return self._format_output(results, majority_vote_labels, pred_probs, return_detailed_results)
+
+    @staticmethod
+    def _consensus_pred_probs(consensus_labels: np.ndarray, num_classes: int) -> np.ndarray:
+        """Near one-hot probabilities on each example's consensus class."""
+        pred_probs = np.full((len(consensus_labels), num_classes), 1e-10)
+        pred_probs[np.arange(len(consensus_labels)), consensus_labels] = 1.0 - (num_classes - 1) * 1e-10
+        return pred_probs
+
+    @staticmethod
+    def _format_output(
+        results: Dict[str, pd.DataFrame],
+        majority_vote_labels: np.ndarray,
+        pred_probs: np.ndarray,
+        return_detailed_results: bool
+    ) -> Dict[str, Any]:
+        """Package quality results in the dictionary returned by predict()."""
         output = {
             'consensus_labels': results['label_quality']['consensus_label'].values,
             'consensus_quality_scores': results['label_quality']['consensus_quality_score'].values,
@@ -218,14 +493,44 @@ class MultiAnnotatorPredictor:
             output['annotator_stats'] = results['annotator_stats']
             output['detailed_label_quality'] = results['detailed_label_quality']
         
-        if self.verbose:
-            print("Analysis complete!")
-            print(f"Generated consensus labels for {len(output['consensus_labels'])} examples")
-            if return_detailed_results:
-                print(f"Analyzed {len(output['annotator_stats'])} annotators")
-        
         return output
 
+    @staticmethod
+    def _unanimous_label_quality(
+        multiannotator_labels: pd.DataFrame,
+        majority_vote_labels: np.ndarray,
+        notna_mask: np.ndarray
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        Build results in the shape returned by get_label_quality_multiannotator for
+        data where every annotation is the same class (all scores are 1.0).
+        """
+        n_examples = len(majority_vote_labels)
+        annotators = multiannotator_labels.columns
+
+        label_quality = pd.DataFrame({
+            'consensus_label': majority_vote_labels,
+            'consensus_quality_score': np.ones(n_examples),
+            'annotator_agreement': np.ones(n_examples),
+            'num_annotations': notna_mask.sum(axis=1)
+        })
+        annotator_stats = pd.DataFrame({
+            'annotator_quality': 1.0,
+            'agreement_with_consensus': 1.0,
+            'worst_class': majority_vote_labels[0],
+            'num_examples_labeled': notna_mask.sum(axis=0)
+        }, index=annotators)
+        detailed_label_quality = pd.DataFrame(
+            np.where(notna_mask, 1.0, np.nan),
+            columns=[f"quality_annotator_{name}" for name in annotators]
+        )
+
+        return {
+            'label_quality': label_quality,
+            'annotator_stats': annotator_stats,
+            'detailed_label_quality': detailed_label_quality
+        }
+
     def get_summary_stats(self) -> Optional[Dict[str, Any]]:
         """
         Get summary statistics from the last prediction results.
@@ -284,27 +589,17 @@ def create_example_data(
     np.random.seed(seed)
 
     # Generate synthetic 2D data for any number of classes
-    means = [np.random.uniform(0, 10, size=2) for _ in range(num_classes)]
-    covs = []
-    for _ in range(num_classes):
-        A = np.random.uniform(0.5, 2.0, size=(2, 2))
-        cov = np.dot(A, A.T)  # ensures positive-definite
-        covs.append(cov)
-    sizes = [num_examples // num_classes] * num_classes
-    for i in range(num_examples % num_classes):
-        sizes[i] += 1
-
-    local_data = []
-    labels = []
-
-    for idx in range(num_classes):
-        local_data.append(
-            np.random.multivariate_normal(mean=means[idx], cov=covs[idx], size=sizes[idx])
-        )
-        labels.append(np.array([idx for _ in range(sizes[idx])]))
-
-    features = np.vstack(local_data)
-    true_labels = np.hstack(labels)
+    means = np.random.uniform(0, 10, size=(num_classes, 2))
+    A = np.random.uniform(0.5, 2.0, size=(num_classes, 2, 2))
+    covs = A @ A.transpose(0, 2, 1)  # ensures positive-definite
+    sizes = np.full(num_classes, num_examples // num_classes)
+    sizes[:num_examples % num_classes] += 1
+
+    # Draw every sample in one pass: x = mean + L z with L the Cholesky factor of its class covariance
+    true_labels = np.repeat(np.arange(num_classes), sizes)
+    L = np.linalg.cholesky(covs)
+    z = np.random.standard_normal((num_examples, 2))
+    features = means[true_labels] + np.einsum('nij,nj->ni', L[true_labels], z)
 
     # Shuffle features and true_labels together to randomize class order
     indices = np.arange(features.shape[0])
@@ -338,10 +633,9 @@ def create_example_data(
             annotator_labels[:, j] = generate_noisy_labels(true_labels, noise_matrix_bad)
 
     # Create DataFrame and mask out labels based on annotation_rate
-    multiannotator_labels = pd.DataFrame(annotator_labels)
-    multiannotator_labels = multiannotator_labels.apply(
-        lambda x: x.mask(np.random.random(len(x)) < (1 - annotation_rate))
-    ).astype("Int64")
+    # One 2D mask; drawn annotator-major so each column gets the same draws as a per-column mask
+    missing = np.random.random(annotator_labels.shape[::-1]).T < (1 - annotation_rate)
+    multiannotator_labels = pd.DataFrame(annotator_labels).mask(missing).astype("Int64")
 
     # Remove columns (annotators) that have no labels
     multiannotator_labels.dropna(axis=1, how="all", inplace=True)
@@ -386,6 +680,17 @@ if __name__ == "__main__":
     print(f"- Average consensus quality score: {results['consensus_quality_scores'].mean():.3f}")
     print(f"- Analyzed {len(results['annotator_stats'])} annotators")
 
+    # Regression case: a single scan where two annotators disagree must still get a
+    # consensus (the tie goes to the lowest class instead of reaching cleanlab)
+    print("\nRunning single-scan analysis with a two-annotator disagreement...")
+    single = MultiAnnotatorPredictor().fit_predict_single(
+        multiannotator_labels=pd.DataFrame({'A': [0], 'B': [1]}),
+        features=np.zeros((1, 1))
+    )
+    assert single['consensus_labels'][0] == 0, single['consensus_labels']
+    print(f"- Tied single-scan consensus: {single['consensus_labels'][0]} "
+          f"(quality {single['consensus_quality_scores'][0]:.2f})")
+
     # Show summary statistics
     stats = predictor.get_summary_stats()
     if stats:
@@ -2,15 +2,81 @@ import numpy as np
 import pandas as pd
 import pickle
 import os
+import hashlib
+import json
+import time
+from collections import deque
 from datetime import datetime
 from typing import Dict, Any, Optional, List, Tuple
+from sklearn.base import clone
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import cross_val_predict
 from sklearn.metrics import accuracy_score, classification_report
+from sklearn.exceptions import ConvergenceWarning
 import warnings
 
 from backend.multiannotator_predictor import MultiAnnotatorPredictor, create_example_data
 
+# Small per-field batches rarely let lbfgs fully converge; don't pay for a warning per CV fold
+warnings.filterwarnings("ignore", category=ConvergenceWarning)
+
+# joblib (shipped with scikit-learn) stores arrays in chunks with compression; plain pickle otherwise
+try:
+    import joblib
+    JOBLIB_AVAILABLE = True
+except ImportError:
+    JOBLIB_AVAILABLE = False
+
+# lz4 is much faster than joblib's default zlib at similar ratios on sparse label matrices
+try:
+    import lz4  # noqa: F401
+    JOBLIB_COMPRESS = ('lz4', 3)
+except ImportError:
+    JOBLIB_COMPRESS = 3
+
+# orjson reads/writes the consensus label files much faster and serializes NumPy integers natively
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Shared generator for the placeholder features of newly added scans
+_rng = np.random.default_rng()
+
+# I/O buffer for field model files; large enough to stream pickled arrays in few syscalls
+PICKLE_BUFFER_SIZE = 1 << 20
+
+# Label matrices are stored as int8 class codes (pandas Categorical codes); -1 marks a missing annotation
+MISSING_LABEL_CODE = -1
+
+# Upper edges of the 10%-wide confidence bins below the last one ("90-100%" also takes 100%)
+CONFIDENCE_BIN_EDGES = np.arange(10, 100, 10)
+
+
+def bin_confidence_indices(confidence_strs: np.ndarray, bin_to_idx: Dict[str, int]) -> np.ndarray:
+    """
+    Map a matrix of confidence strings like '65%' to int8 confidence bin codes, given the
+    bin label -> index mapping of the 'Confidence' field. Strings that already are a bin label keep it;
+    anything that is not a percentage in [0, 101) becomes MISSING_LABEL_CODE.
+    """
+    values = pd.Series(np.asarray(confidence_strs, dtype=object).ravel()).astype(str).str.strip()
+
+    label_idx = values.map(bin_to_idx)
+    pct = pd.to_numeric(values.str[:-1].where(values.str.endswith("%")), errors="coerce").to_numpy()
+    in_range = (pct >= 0) & (pct < 101)
+
+    codes = np.where(in_range, np.digitize(np.nan_to_num(pct), CONFIDENCE_BIN_EDGES), MISSING_LABEL_CODE)
+    codes = np.where(label_idx.notna(), label_idx.fillna(MISSING_LABEL_CODE).to_numpy(dtype=np.int64), codes)
+    return codes.astype(np.int8).reshape(np.shape(confidence_strs))
+
+
+def to_label_codes(labels_df: pd.DataFrame) -> pd.DataFrame:
+    """Convert a NaN-marked annotator label DataFrame to int8 codes with MISSING_LABEL_CODE."""
+    labels_df = labels_df.drop(columns=["scan_id"], errors="ignore")
+    return labels_df.fillna(MISSING_LABEL_CODE).astype(np.int8)
+
+
 class MultiFieldAnnotatorPredictor:
     """
     Enhanced wrapper to run MultiAnnotatorPredictor on multiple tumor-related fields
@@ -22,7 +88,8 @@ class MultiFieldAnnotatorPredictor:
         num_crossval_folds: int = 5,
         verbose: bool = False,
         model_save_dir: str = "models",
-        auto_retrain_threshold: float = 0.1
+        auto_retrain_threshold: float = 0.1,
+        training_history_size: int = 100
     ):
         """
         Initialize the MultiFieldAnnotatorPredictor with training loop capabilities.
@@ -33,12 +100,15 @@ class MultiFieldAnnotatorPredictor:
             verbose: Whether to print verbose output
             model_save_dir: Directory to save trained models
             auto_retrain_threshold: Threshold for automatic retraining when data changes significantly
+            training_history_size: Training records kept per field; older ones are dropped so a
+                                   long-lived predictor does not grow with every scan
         """
         self.base_model = model if model is not None else LogisticRegression(random_state=42, max_iter=1000)
         self.num_crossval_folds = num_crossval_folds
         self.verbose = verbose
         self.model_save_dir = model_save_dir
         self.auto_retrain_threshold = auto_retrain_threshold
+        self.training_history_size = training_history_size
 
         self.original_training_data = {}
         # Define tumor classification constants
@@ -49,12 +119,22 @@ class MultiFieldAnnotatorPredictor:
             "Size": ["<10cm³", "10-50cm³", ">50cm³"],
             "Confidence": ["0-10%", "10-20%", "20-30%", "30-40%", "40-50%", "50-60%", "60-70%", "70-80%", "80-90%", "90-100%"]
         }
+        # Fields whose classes are ordered bins: consensus is the mean annotation, no classifier needed
+        self.ORDINAL_FIELDS = {"Confidence"}
+        # Label string -> class index per field, for O(1) lookups when encoding annotations
+        self._label_to_idx = {
+            field: {label: idx for idx, label in enumerate(labels)}
+            for field, labels in self.TUMOR_FIELDS.items()
+        }
 
         # Training state
         self.field_results = {}
         self.field_models = {}  # Store trained models per field
         self.field_data_history = {}  # Track data changes per field
-        self.training_history = {}  # Track training metrics over time
+        self.training_history = {}  # Track recent training metrics per field (bounded deques)
+        self._train_cache = {}  # field -> (content hash, predictor, results) of the last fit
+        self._combined_feature_buf = {}  # field -> original + new feature matrix, reused across add_new_scan calls
+        self._model_dir_cache = None  # file names in model_save_dir, listed once per predict_for_fields call
 
         # Create model directory if it doesn't exist
         os.makedirs(model_save_dir, exist_ok=True)
@@ -107,32 +187,63 @@ class MultiFieldAnnotatorPredictor:
             'last_updated': datetime.now()
         }
 
+    def _field_model_path(self, field: str, extension: str) -> str:
+        """Path of the saved model file for a field."""
+        return os.path.join(self.model_save_dir, f"{field.replace(' ', '_').lower()}_model{extension}")
+
+    def _model_file_exists(self, model_path: str) -> bool:
+        """Check for a saved model file, using the cached directory listing when one is active."""
+        if self._model_dir_cache is None:
+            return os.path.exists(model_path)
+        return os.path.basename(model_path) in self._model_dir_cache
+
+    @staticmethod
+    def _training_data_hash(labels_df: pd.DataFrame, features: np.ndarray, cv_folds: int) -> bytes:
+        """Content hash of everything that determines a field's trained model."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update("\x1f".join(map(str, labels_df.columns)).encode())
+        h.update(pd.util.hash_pandas_object(labels_df, index=False).values.tobytes())
+        h.update(np.ascontiguousarray(features).tobytes())
+        h.update(int(cv_folds).to_bytes(4, "little"))
+        return h.digest()
+
     def _save_field_model(self, field: str, predictor: MultiAnnotatorPredictor):
         """Save a trained model for a specific field."""
-        model_path = os.path.join(self.model_save_dir, f"{field.replace(' ', '_').lower()}_model.pkl")
-
         model_data = {
             'predictor': predictor,
             'training_timestamp': datetime.now(),
             'data_info': self.field_data_history.get(field, {})
         }
 
-        with open(model_path, 'wb') as f:
-            pickle.dump(model_data, f)
+        if JOBLIB_AVAILABLE:
+            model_path = self._field_model_path(field, ".joblib")
+            joblib.dump(model_data, model_path, compress=JOBLIB_COMPRESS, protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            model_path = self._field_model_path(field, ".pkl")
+            with open(model_path, 'wb', buffering=PICKLE_BUFFER_SIZE) as f:
+                pickle.dump(model_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if self._model_dir_cache is not None:
+            self._model_dir_cache.add(os.path.basename(model_path))
 
         if self.verbose:
             print(f"Saved model for field '{field}' to {model_path}")
 
     def _load_field_model(self, field: str) -> Optional[MultiAnnotatorPredictor]:
         """Load a previously trained model for a specific field."""
-        model_path = os.path.join(self.model_save_dir, f"{field.replace(' ', '_').lower()}_model.pkl")
-
-        if not os.path.exists(model_path):
-            return None
+        # Prefer the joblib store; fall back to a .pkl written without joblib or by older versions
+        model_path = self._field_model_path(field, ".joblib")
+        if not (JOBLIB_AVAILABLE and self._model_file_exists(model_path)):
+            model_path = self._field_model_path(field, ".pkl")
+            if not self._model_file_exists(model_path):
+                return None
 
         try:
-            with open(model_path, 'rb') as f:
-                model_data = pickle.load(f)
+            if model_path.endswith(".joblib"):
+                model_data = joblib.load(model_path)
+            else:
+                with open(model_path, 'rb', buffering=PICKLE_BUFFER_SIZE) as f:
+                    model_data = pickle.load(f)
 
             if self.verbose:
                 print(f"Loaded existing model for field '{field}' from {model_path}")
@@ -152,6 +263,8 @@ class MultiFieldAnnotatorPredictor:
     ) -> Tuple[MultiAnnotatorPredictor, Dict[str, Any]]:
         """
         Train or retrain a model for a specific field with change detection.
+        Cross-validation needs at least 2 examples; a single example gets its
+        consensus from the annotator vote alone (MultiAnnotatorPredictor.fit_predict_single).
         
         Args:
             field: Field name
@@ -164,6 +277,11 @@ class MultiFieldAnnotatorPredictor:
         """
         # Always drop scan_id column if present
         labels_df = labels_df.drop(columns=["scan_id"], errors="ignore")
+        # Train on float32 features: half the memory traffic of float64 in every CV fold
+        features = np.asarray(features, dtype=np.float32)
+        # int8 label codes mark missing annotations with -1; the predictor expects NaN
+        if all(dtype.kind == "i" for dtype in labels_df.dtypes):
+            labels_df = labels_df.mask(labels_df == MISSING_LABEL_CODE)
         if self.verbose:
             print(f"\n=== Training model for field: {field} ===")
 
@@ -178,44 +296,83 @@ class MultiFieldAnnotatorPredictor:
             print(f"  - Requires retraining: {changes['requires_retraining']}")
 
         # Check if we need to retrain
-        if not force_retrain and not changes['requires_retraining']:
+        if changes['requires_retraining']:
+            # The in-memory model no longer matches the data
+            self.field_models.pop(field, None)
+        elif not force_retrain:
+            # Prefer the model already held in memory over reloading it from disk
+            if field in self.field_models:
+                if self.verbose:
+                    print("Using in-memory model (no significant changes detected)")
+                return self.field_models[field], {'reused_existing': True, 'changes': changes, 'cache': 'memory'}
+
             # Try to load existing model
             existing_predictor = self._load_field_model(field)
             if existing_predictor is not None:
                 if self.verbose:
                     print("Using existing model (no significant changes detected)")
-                return existing_predictor, {'reused_existing': True, 'changes': changes}
-
-        # Train new model
-        if self.verbose:
-            print("Training new model...")
+                self.field_models[field] = existing_predictor
+                return existing_predictor, {'reused_existing': True, 'changes': changes, 'cache': 'disk'}
 
         # Dynamically adjust num_crossval_folds for small batches
         # Find the minimum class count in the current labels
-        label_values = labels_df.values
-        # Flatten and count occurrences
-        unique, counts = np.unique(label_values, return_counts=True)
+        label_values = labels_df.to_numpy(dtype=float, na_value=np.nan)
+        # Flatten and count occurrences of the (small, non-negative) class indices
+        flat = label_values.ravel()
+        counts = np.bincount(flat[~np.isnan(flat)].astype(np.intp))
+        counts = counts[counts > 0]
         min_class_count = counts.min() if len(counts) > 0 else 1
         cv_folds = max(2, min(self.num_crossval_folds, min_class_count))
 
+        # Identical labels, annotators, features and folds give an identical fit, even when
+        # a retrain is forced, so reuse the last one
+        cache_key = self._training_data_hash(labels_df, features, cv_folds)
+        cached = self._train_cache.get(field)
+        if cached is not None and cached[0] == cache_key:
+            if self.verbose:
+                print("Using cached model (training data unchanged)")
+            _, predictor, results = cached
+            self.field_results[field] = results
+            self.field_models[field] = predictor
+            return predictor, {'reused_existing': True, 'changes': changes}
+
+        # Train new model
+        if self.verbose:
+            print("Training new model...")
+
         predictor = MultiAnnotatorPredictor(
-            model=self.base_model,
+            model=clone(self.base_model),  # unfitted copy, safe to train concurrently
             num_crossval_folds=cv_folds,
             verbose=self.verbose
         )
 
         # Train the model
-        start_time = datetime.now()
-        results = predictor.predict(
-            multiannotator_labels=labels_df,
-            features=features,
-            return_detailed_results=True
-        )
-        training_time = (datetime.now() - start_time).total_seconds()
+        start_time = time.perf_counter()
+        if field in self.ORDINAL_FIELDS:
+            results = predictor.predict_ordinal(
+                multiannotator_labels=labels_df,
+                features=features,
+                num_classes=len(self.TUMOR_FIELDS[field]),
+                return_detailed_results=True
+            )
+        elif len(labels_df) < 2:
+            results = predictor.fit_predict_single(
+                multiannotator_labels=labels_df,
+                features=features,
+                return_detailed_results=True
+            )
+        else:
+            results = predictor.predict(
+                multiannotator_labels=labels_df,
+                features=features,
+                return_detailed_results=True
+            )
+        training_time = time.perf_counter() - start_time
 
         # Store results and model
         self.field_results[field] = results
         self.field_models[field] = predictor
+        self._train_cache[field] = (cache_key, predictor, results)
 
         # Update data history
         self._update_data_history(field, labels_df, features)
@@ -236,7 +393,7 @@ class MultiFieldAnnotatorPredictor:
 
         # Update training history
         if field not in self.training_history:
-            self.training_history[field] = []
+            self.training_history[field] = deque(maxlen=self.training_history_size)
         self.training_history[field].append(training_info)
 
         if self.verbose:
@@ -262,23 +419,41 @@ class MultiFieldAnnotatorPredictor:
         Returns:
             dict: field name -> results from MultiAnnotatorPredictor.predict()
         """
-        training_summary = {}
-
-        for field, labels_df in multiannotator_labels_dict.items():
+        fields_to_train = []
+        for field in multiannotator_labels_dict:
             if field.lower() in ["tumor presence", "presence"]:
                 if self.verbose:
                     print(f"Skipping field '{field}' (always positive).")
                 continue
+            fields_to_train.append(field)
 
+        def train(field):
             # Train or load model for this field
-            predictor, training_info = self.train_field_model(
+            return self.train_field_model(
                 field=field,
-                labels_df=labels_df,
+                labels_df=multiannotator_labels_dict[field],
                 features=features_dict[field],
                 force_retrain=force_retrain
             )
 
-            training_summary[field] = training_info
+        # Fields are independent, so train them concurrently; threads suffice since
+        # the lbfgs fits spend their time in BLAS with the GIL released
+        n_jobs = min(len(fields_to_train), os.cpu_count() or 1)
+        # List the model directory once instead of probing each field's files
+        self._model_dir_cache = {entry.name for entry in os.scandir(self.model_save_dir)}
+        try:
+            if JOBLIB_AVAILABLE and n_jobs > 1:
+                outcomes = joblib.Parallel(n_jobs=n_jobs, prefer="threads")(
+                    joblib.delayed(train)(field) for field in fields_to_train
+                )
+            else:
+                outcomes = [train(field) for field in fields_to_train]
+        finally:
+            self._model_dir_cache = None
+
+        training_summary = {
+            field: training_info for field, (_, training_info) in zip(fields_to_train, outcomes)
+        }
 
         if self.verbose:
             self._print_training_summary(training_summary)
@@ -327,76 +502,41 @@ class MultiFieldAnnotatorPredictor:
         Add one or more new MRI scans from JSON format and retrain all field models.
         Combines new data with existing training data.
         """
-        def bin_confidence_value(conf_str: str) -> str:
-            """
-            Map a confidence string like '65%' to the closest bin in self.TUMOR_FIELDS['Confidence'].
-            If already a valid bin, return as is. If not a valid percentage, return ''.
-            """
-            bins = [
-                (0, 10, "0-10%"),
-                (10, 20, "10-20%"),
-                (20, 30, "20-30%"),
-                (30, 40, "30-40%"),
-                (40, 50, "40-50%"),
-                (50, 60, "50-60%"),
-                (60, 70, "60-70%"),
-                (70, 80, "70-80%"),
-                (80, 90, "80-90%"),
-                (90, 101, "90-100%")
-            ]
-            conf_str = conf_str.strip()
-            if conf_str in [b[2] for b in bins]:
-                return conf_str
-            if conf_str.endswith("%"):
-                try:
-                    val = float(conf_str[:-1])
-                    for low, high, label in bins:
-                        if low <= val < high:
-                            return label
-                except Exception:
-                    return ""
-            return ""
-
         if self.verbose:
             print(f"\nAdding new scan data for {len(scan_data)} scans")
 
         scan_ids = list(scan_data.keys())
         consensus_results = {}
+
+        # Collect all annotator names from new data
+        annotator_names = sorted({annotator for doctors in scan_data.values() for annotator in doctors})
+
+        # Walk the JSON once into a (scans, annotators, fields) matrix of label strings,
+        # with "" wherever an annotator did not label a scan or field
+        raw_labels = np.array([
+            [[scan_data[scan_id].get(annotator, {}).get(field, "") for field in self.TUMOR_FIELDS]
+             for annotator in annotator_names]
+            for scan_id in scan_ids
+        ], dtype=object)
+        
+        # Placeholder features for the new scans, drawn once per feature width and shared across fields
+        new_features_by_width = {}
         
         # Process each field
-        for field in self.TUMOR_FIELDS.keys():
+        for field_idx, field in enumerate(self.TUMOR_FIELDS.keys()):
             if self.verbose:
                 print(f"\nProcessing field: {field}")
             
-            # Convert new JSON data to DataFrame format for this field
-            new_field_labels = []
-            annotator_names = set()
-            
-            # Collect all annotator names from new data
-            for scan_id, doctors in scan_data.items():
-                annotator_names.update(doctors.keys())
-            
-            annotator_names = sorted(list(annotator_names))
-            
             # Build labels matrix for new scans
-            for scan_id in scan_ids:
-                scan_labels = []
-                for annotator in annotator_names:
-                    if annotator in scan_data[scan_id]:
-                        label_str = scan_data[scan_id][annotator].get(field, "")
-                        # Special handling for Confidence field: bin the value if needed
-                        if field == "Confidence":
-                            label_str = bin_confidence_value(label_str)
-                        if label_str in self.TUMOR_FIELDS[field]:
-                            label_idx = self.TUMOR_FIELDS[field].index(label_str)
-                        else:
-                            label_idx = np.nan
-                        scan_labels.append(label_idx)
-                    else:
-                        scan_labels.append(np.nan)
-                new_field_labels.append(scan_labels)
+            field_strs = raw_labels[:, :, field_idx]
+            if field == "Confidence":
+                # Special handling for Confidence field: bin the values if needed
+                new_field_labels = bin_confidence_indices(field_strs, self._label_to_idx[field])
+            else:
+                codes = pd.Categorical(field_strs.ravel(), categories=self.TUMOR_FIELDS[field]).codes
+                new_field_labels = codes.astype(np.int8).reshape(field_strs.shape)
             
-            # Create DataFrame for new data
+            # Create DataFrame of int8 label codes for new data
             new_labels_df = pd.DataFrame(new_field_labels, columns=annotator_names)
             
             # Generate features for new scans to match original feature dimensions
@@ -405,11 +545,15 @@ class MultiFieldAnnotatorPredictor:
             else:
                 num_features = 2
             
-            new_features = np.random.randn(len(scan_ids), num_features)
+            if num_features not in new_features_by_width:
+                new_features_by_width[num_features] = _rng.standard_normal(
+                    (len(scan_ids), num_features), dtype=np.float32
+                )
+            new_features = new_features_by_width[num_features]
             
             # Always combine with original training data if available
             if field in self.original_training_data:
-                original_labels = self.original_training_data[field]['labels']
+                original_labels = to_label_codes(self.original_training_data[field]['labels'])
                 original_features = self.original_training_data[field]['features']
                 
                 if self.verbose:
@@ -418,13 +562,19 @@ class MultiFieldAnnotatorPredictor:
                 # Align annotator columns - get union of all annotators
                 all_annotators = sorted(list(set(original_labels.columns) | set(new_labels_df.columns)))
                 
-                # Reindex both DataFrames to have same columns
-                original_aligned = original_labels.reindex(columns=all_annotators, fill_value=np.nan)
-                new_aligned = new_labels_df.reindex(columns=all_annotators, fill_value=np.nan)
+                col_idx = {name: i for i, name in enumerate(all_annotators)}
                 
-                # Combine labels and features
-                combined_labels = pd.concat([original_aligned, new_aligned], ignore_index=True)
-                combined_features = np.vstack([original_features, new_features])
+                # Combine labels by scattering both blocks into one preallocated matrix
+                num_original = len(original_labels)
+                combined = np.full(
+                    (num_original + len(new_labels_df), len(all_annotators)), MISSING_LABEL_CODE, dtype=np.int8
+                )
+                combined[:num_original, [col_idx[c] for c in original_labels.columns]] = original_labels.to_numpy(dtype=np.int8)
+                combined[num_original:, [col_idx[c] for c in new_labels_df.columns]] = new_labels_df.to_numpy(dtype=np.int8)
+                combined_labels = pd.DataFrame(combined, columns=all_annotators)
+                
+                # Combine features
+                combined_features = self._combine_features(field, original_features, new_features)
                 
                 if self.verbose:
                     print(f"Combined dataset: {len(combined_labels)} total scans, {len(combined_labels.columns)} annotators")
@@ -441,63 +591,16 @@ class MultiFieldAnnotatorPredictor:
                 if self.verbose:
                     print(f"No original data found for {field}, using only new data")
                 
-                # Handle single sample case by creating duplicates
-                if len(new_labels_df) == 1:
-                    if self.verbose:
-                        print(f"Single scan detected - creating duplicates for cross-validation")
-                    
-                    # Create multiple duplicates with different classes
-                    original_row = new_labels_df.iloc[0].copy()
-                    duplicated_rows = [original_row]
-                    
-                    # Get non-NaN columns to modify
-                    non_nan_cols = new_labels_df.columns[~new_labels_df.iloc[0].isna()]
-                    num_classes = len(self.TUMOR_FIELDS[field])
-                    
-                    if len(non_nan_cols) > 0:
-                        # Create 3 more duplicates with different classes
-                        for i in range(3):
-                            duplicate_row = original_row.copy()
-                            current_class = int(original_row[non_nan_cols[0]])
-                            new_class = (current_class + i + 1) % num_classes
-                            duplicate_row[non_nan_cols[0]] = new_class
-                            duplicated_rows.append(duplicate_row)
-                    else:
-                        # If all NaN, just duplicate as-is
-                        for i in range(3):
-                            duplicated_rows.append(original_row.copy())
-                    
-                    # Combine all duplicates
-                    duplicated_labels = pd.DataFrame(duplicated_rows)
-                    duplicated_features = np.tile(new_features, (4, 1))
-                    
-                    # Train with duplicated data
-                    predictor, training_info = self.train_field_model(
-                        field=field,
-                        labels_df=duplicated_labels,
-                        features=duplicated_features,
-                        force_retrain=True
-                    )
-                    
-                    # Keep only the first result (remove duplicates)
-                    if field in self.field_results:
-                        for key in ['consensus_labels', 'consensus_quality_scores']:
-                            if key in self.field_results[field]:
-                                self.field_results[field][key] = self.field_results[field][key][:1]
-                        
-                        if 'label_quality' in self.field_results[field]:
-                            self.field_results[field]['label_quality'] = self.field_results[field]['label_quality'].iloc[:1]
-                else:
-                    # Normal case with multiple samples
-                    predictor, training_info = self.train_field_model(
-                        field=field,
-                        labels_df=new_labels_df,
-                        features=new_features,
-                        force_retrain=True
-                    )
+                predictor, training_info = self.train_field_model(
+                    field=field,
+                    labels_df=new_labels_df,
+                    features=new_features,
+                    force_retrain=True
+                )
         
         # Generate consensus labels for NEW scans only
         num_new_scans = len(scan_ids)
+        save_indices = {}
         for i, scan_id in enumerate(scan_ids):
             scan_consensus = {}
             for field in self.TUMOR_FIELDS.keys():
@@ -524,7 +627,10 @@ class MultiFieldAnnotatorPredictor:
                 save_idx = len(self.original_training_data[field]['labels']) + i
             else:
                 save_idx = i
-            self.save_consensus_labels_json(scan_id, scan_index=save_idx)
+            save_indices[scan_id] = save_idx
+
+        # Write every new scan's entry with one load/dump per consensus file
+        self.save_consensus_labels_json_batch(save_indices)
 
         if self.verbose:
             if any(field in self.original_training_data for field in self.TUMOR_FIELDS.keys()):
@@ -540,6 +646,21 @@ class MultiFieldAnnotatorPredictor:
         }
 
 
+    def _combine_features(self, field: str, original_features: np.ndarray, new_features: np.ndarray) -> np.ndarray:
+        """Stack original and new features into the field's preallocated buffer, reallocating only on shape change."""
+        num_original = len(original_features)
+        shape = (num_original + len(new_features), original_features.shape[1])
+        dtype = np.result_type(original_features, new_features)
+
+        combined = self._combined_feature_buf.get(field)
+        if combined is None or combined.shape != shape or combined.dtype != dtype:
+            combined = np.empty(shape, dtype=dtype)
+            self._combined_feature_buf[field] = combined
+
+        combined[:num_original] = original_features
+        combined[num_original:] = new_features
+        return combined
+
     def save_consensus_labels_json(self, scan_id, scan_index=None, output_path=None):
         """
         Save the consensus labels for a specific scan to a JSON file.
@@ -549,29 +670,56 @@ class MultiFieldAnnotatorPredictor:
             scan_index: The index of the scan in the consensus_labels array
             output_path: Path to the JSON file. Defaults to public/data/{scan_id}/consensus_labels.json
         """
-        import json
-        import os
-
-        # Default to saving next to the case data inside public/data/{scan_id}/
-        if output_path is None:
-            project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
-            public_data_dir = os.path.join(project_root, "public", "data")
-            case_dir = os.path.join(public_data_dir, str(scan_id))
-            os.makedirs(case_dir, exist_ok=True)
-            output_path = os.path.join(case_dir, "consensus_labels.json")
-
-        # Load existing data if file exists
-        if os.path.exists(output_path):
-            with open(output_path, "r") as f:
-                consensus_data = json.load(f)
-        else:
-            consensus_data = {}
+        self.save_consensus_labels_json_batch({scan_id: scan_index}, output_path=output_path)
+
+    def save_consensus_labels_json_batch(self, scan_indices, output_path=None):
+        """
+        Save the consensus labels for several scans, reading and writing each JSON file once.
 
-        # Build the entry for this scan_id
+        Args:
+            scan_indices: Mapping of scan_id -> index of the scan in the consensus_labels array
+            output_path: Path to a shared JSON file. Defaults to public/data/{scan_id}/consensus_labels.json per scan
+        """
+        # Group the scan entries by the file they belong in
+        entries_by_path = {}
+        for scan_id, scan_index in scan_indices.items():
+            path = output_path
+            # Default to saving next to the case data inside public/data/{scan_id}/
+            if path is None:
+                project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+                public_data_dir = os.path.join(project_root, "public", "data")
+                case_dir = os.path.join(public_data_dir, str(scan_id))
+                os.makedirs(case_dir, exist_ok=True)
+                path = os.path.join(case_dir, "consensus_labels.json")
+            entries_by_path.setdefault(path, {})[scan_id] = self._consensus_entry(scan_index)
+
+        for path, scan_entries in entries_by_path.items():
+            # Load existing data if file exists
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    consensus_data = orjson.loads(f.read()) if ORJSON_AVAILABLE else json.load(f)
+            else:
+                consensus_data = {}
+
+            consensus_data.update(scan_entries)
+
+            # Save back to file
+            if ORJSON_AVAILABLE:
+                with open(path, "wb") as f:
+                    f.write(orjson.dumps(consensus_data, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+            else:
+                with open(path, "w") as f:
+                    json.dump(consensus_data, f, indent=2, default=int)
+
+        # if self.verbose:
+        #     print(f"Consensus labels for {len(scan_indices)} scans saved to {len(entries_by_path)} files")
+
+    def _consensus_entry(self, scan_index=None):
+        """Build the field -> consensus label string entry for the scan at scan_index."""
         scan_entry = {}
         for field, res in self.field_results.items():
             if scan_index is not None and len(res["consensus_labels"]) > scan_index:
-                label_idx = int(res["consensus_labels"][scan_index])
+                label_idx = res["consensus_labels"][scan_index]
                 # Convert index to actual string value
                 if field in self.TUMOR_FIELDS and label_idx < len(self.TUMOR_FIELDS[field]):
                     scan_entry[field] = self.TUMOR_FIELDS[field][label_idx]
@@ -579,22 +727,14 @@ class MultiFieldAnnotatorPredictor:
                     scan_entry[field] = label_idx
             elif scan_index is None and len(res["consensus_labels"]) > 0:
                 # Fallback to last label if no index provided
-                label_idx = int(res["consensus_labels"][-1])
+                label_idx = res["consensus_labels"][-1]
                 if field in self.TUMOR_FIELDS and label_idx < len(self.TUMOR_FIELDS[field]):
                     scan_entry[field] = self.TUMOR_FIELDS[field][label_idx]
                 else:
                     scan_entry[field] = label_idx
             else:
                 scan_entry[field] = None
-
-        consensus_data[scan_id] = scan_entry
-
-        # Save back to file
-        with open(output_path, "w") as f:
-            json.dump(consensus_data, f, indent=2)
-
-        # if self.verbose:
-        #     print(f"Consensus labels for scan_id {scan_id} (index {scan_index}) saved to {output_path}")
+        return scan_entry
         
         
 if __name__ == "__main__":
@@ -5,12 +5,23 @@ Creates FLAIR background images with red segmentation overlays.
 
 import os
 import logging
+from functools import lru_cache
 from typing import Optional, Tuple
 import numpy as np
 import nibabel as nib
-import matplotlib.pyplot as plt
 from PIL import Image
 import io
+import json
+import argparse
+
+from .config import config
+
+# Try to import numba for the fused tint kernel, fall back to NumPy if not available
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -21,6 +32,35 @@ BRATS_DATA_PATH = os.path.join(
     "MICCAI_BraTS2020_TrainingData"
 )
 
+# Number of encoded overlay PNGs kept in memory
+OVERLAY_CACHE_SIZE = 512
+
+# Encoded overlays persisted across restarts (populate with `python -m backend.overlay_generator`)
+OVERLAY_DISK_CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache", "overlays")
+
+# Middle FLAIR (normalized uint8) and segmentation (bool) slices of every BraTS case, stacked
+# into two (N, H, W) .npy files read through a memmap (build with `--slice-store`)
+SLICE_STORE_DIR = os.path.join(os.path.dirname(__file__), "cache", "brats_slices")
+
+# Encoder settings for overlay thumbnails; PNG at zlib level 1 is ~4x cheaper than the
+# default level 6, and WebP at method 0 is cheaper still
+OVERLAY_SAVE_OPTIONS = {
+    "PNG": {"format": "PNG", "optimize": False, "compress_level": 1},
+    "WEBP": {"format": "WEBP", "quality": 85, "method": 0},
+}
+OVERLAY_IMAGE_FORMAT = config.OVERLAY_IMAGE_FORMAT if config.OVERLAY_IMAGE_FORMAT in OVERLAY_SAVE_OPTIONS else "PNG"
+OVERLAY_MEDIA_TYPE = f"image/{OVERLAY_IMAGE_FORMAT.lower()}"
+
+# Number of opened NIfTI images (header + array proxy, not voxel data) kept in memory
+NIFTI_CACHE_SIZE = 64
+
+
+@lru_cache(maxsize=NIFTI_CACHE_SIZE)
+def _open_nifti(nifti_path: str, mtime: float) -> nib.Nifti1Image:
+    # mtime is only part of the cache key so an edited file is reopened;
+    # nibabel slices .nii.gz files seekably when indexed_gzip is installed
+    return nib.load(nifti_path, mmap=True)
+
 
 def load_nifti_slice(nifti_path: str, slice_idx: Optional[int] = None) -> Optional[np.ndarray]:
     """
@@ -38,16 +78,17 @@ def load_nifti_slice(nifti_path: str, slice_idx: Optional[int] = None) -> Option
             logger.warning(f"NIfTI file not found: {nifti_path}")
             return None
             
-        img = nib.load(nifti_path)
-        data = img.get_fdata()
+        img = _open_nifti(nifti_path, os.path.getmtime(nifti_path))
+        depth = img.shape[2]
         
         if slice_idx is None:
-            slice_idx = data.shape[2] // 2  # Middle slice
+            slice_idx = depth // 2  # Middle slice
             
-        if slice_idx >= data.shape[2]:
-            slice_idx = data.shape[2] - 1
+        if slice_idx >= depth:
+            slice_idx = depth - 1
             
-        return data[:, :, slice_idx]
+        # Read only the requested slab through the array proxy instead of the full volume
+        return np.asarray(img.dataobj[:, :, slice_idx], dtype=np.float32)
         
     except Exception as e:
         logger.error(f"Failed to load NIfTI slice from {nifti_path}: {e}")
@@ -56,11 +97,53 @@ def load_nifti_slice(nifti_path: str, slice_idx: Optional[int] = None) -> Option
 
 def normalize_image(image: np.ndarray) -> np.ndarray:
     """Normalize image to 0-255 range."""
-    if image.max() == image.min():
-        return np.zeros_like(image, dtype=np.uint8)
+    image_min = image.min()
+    value_range = image.max() - image_min
+    if value_range == 0:
+        return np.zeros(image.shape, dtype=np.uint8)
     
-    normalized = (image - image.min()) / (image.max() - image.min())
-    return (normalized * 255).astype(np.uint8)
+    # Shift and scale in one float32 buffer; only the uint8 result is allocated besides it.
+    # Divide before multiplying so the maximum maps to exactly 1.0 and then 255; a
+    # precomputed 255 / range factor can round the brightest pixel down to 254
+    scaled = np.subtract(image, image_min, dtype=np.float32)
+    np.divide(scaled, np.float32(value_range), out=scaled)
+    np.multiply(scaled, np.float32(255.0), out=scaled)
+    return scaled.astype(np.uint8)
+
+
+def _tint_overlay_numpy(gray: np.ndarray, seg2d: np.ndarray, out: np.ndarray) -> None:
+    """NumPy fallback for `_tint_overlay`."""
+    # Create RGB image from FLAIR (grayscale background), broadcast into the uint8 buffer
+    out[...] = gray[..., None]
+
+    # Create red overlay for segmentation (tumor regions)
+    tumor_mask = seg2d > 0
+    if np.any(tumor_mask):
+        # Apply red overlay with some transparency, writing all three channels in one pass
+        tumor_pixels = gray[tumor_mask]
+        red = np.minimum(tumor_pixels.astype(np.int16) + 128, 255).astype(np.uint8)  # Enhance red
+        dimmed = tumor_pixels >> 1  # Reduce green and blue
+        out[tumor_mask] = np.stack([red, dimmed, dimmed], axis=-1)
+
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _tint_overlay(gray, seg2d, out):
+        """Expand the uint8 FLAIR slice to RGB and tint tumor pixels red in one pass."""
+        height, width = gray.shape
+        for y in prange(height):
+            for x in range(width):
+                g = gray[y, x]
+                if seg2d[y, x] > 0:
+                    out[y, x, 0] = np.uint8(min(np.int32(g) + 128, 255))
+                    out[y, x, 1] = np.uint8(g >> 1)
+                    out[y, x, 2] = np.uint8(g >> 1)
+                else:
+                    out[y, x, 0] = g
+                    out[y, x, 1] = g
+                    out[y, x, 2] = g
+else:
+    _tint_overlay = _tint_overlay_numpy
 
 
 def create_overlay_image(flair_slice: np.ndarray, seg_slice: np.ndarray, 
@@ -79,19 +162,12 @@ def create_overlay_image(flair_slice: np.ndarray, seg_slice: np.ndarray,
     # Normalize FLAIR to 0-255
     flair_normalized = normalize_image(flair_slice)
     
-    # Create RGB image from FLAIR (grayscale background)
-    rgb_image = np.stack([flair_normalized, flair_normalized, flair_normalized], axis=-1)
-    
-    # Create red overlay for segmentation (tumor regions)
-    tumor_mask = seg_slice > 0
-    if np.any(tumor_mask):
-        # Apply red overlay with some transparency
-        rgb_image[tumor_mask, 0] = np.minimum(255, rgb_image[tumor_mask, 0] + 128)  # Enhance red
-        rgb_image[tumor_mask, 1] = rgb_image[tumor_mask, 1] // 2  # Reduce green
-        rgb_image[tumor_mask, 2] = rgb_image[tumor_mask, 2] // 2  # Reduce blue
+    # Grayscale background with the red tumor tint (enhanced red, halved green/blue)
+    rgb_image = np.empty(flair_normalized.shape + (3,), dtype=np.uint8)
+    _tint_overlay(flair_normalized, np.ascontiguousarray(seg_slice), rgb_image)
     
     # Convert to PIL Image and resize with high quality resampling
-    pil_image = Image.fromarray(rgb_image.astype(np.uint8))
+    pil_image = Image.fromarray(rgb_image)
 
     # Use high-quality resampling for medical images
     if size != rgb_image.shape[:2]:
@@ -100,6 +176,128 @@ def create_overlay_image(flair_slice: np.ndarray, seg_slice: np.ndarray,
     return pil_image
 
 
+def get_case_paths(case_id: str) -> Tuple[str, str]:
+    """Return the (FLAIR, segmentation) NIfTI paths for a BraTS training case."""
+    case_dir = os.path.join(BRATS_DATA_PATH, case_id)
+    return (
+        os.path.join(case_dir, f"{case_id}_flair.nii"),
+        os.path.join(case_dir, f"{case_id}_seg.nii"),
+    )
+
+
+def _slice_store() -> Optional[Tuple[dict, np.ndarray, np.ndarray, float]]:
+    """Open the prebuilt middle-slice store (index, FLAIR, seg, build time), or None if it has not been built."""
+    try:
+        built_at = os.path.getmtime(os.path.join(SLICE_STORE_DIR, "case_ids.json"))
+    except OSError:
+        return None
+    return _open_slice_store(built_at)
+
+
+@lru_cache(maxsize=1)
+def _open_slice_store(built_at: float) -> Optional[Tuple[dict, np.ndarray, np.ndarray, float]]:
+    # built_at (the case_ids.json mtime) is only part of the cache key so a rebuilt store is reopened
+    flair_path = os.path.join(SLICE_STORE_DIR, "flair_mid.npy")
+    seg_path = os.path.join(SLICE_STORE_DIR, "seg_mid.npy")
+    try:
+        # build_slice_store replaces case_ids.json last; newer arrays mean a rebuild is in progress
+        if os.path.getmtime(flair_path) > built_at or os.path.getmtime(seg_path) > built_at:
+            return None
+        with open(os.path.join(SLICE_STORE_DIR, "case_ids.json")) as f:
+            case_index = {case_id: i for i, case_id in enumerate(json.load(f))}
+        flair = np.load(flair_path, mmap_mode="r")
+        seg = np.load(seg_path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if not len(case_index) == len(flair) == len(seg):
+        return None
+    return case_index, flair, seg, built_at
+
+
+def build_slice_store() -> int:
+    """
+    Write the middle FLAIR/segmentation slice of every BraTS case into the slice store.
+    Cases whose slice shape differs from the first case are skipped.
+
+    Returns:
+        Number of cases stored
+    """
+    if not os.path.isdir(BRATS_DATA_PATH):
+        logger.warning(f"BraTS data directory not found: {BRATS_DATA_PATH}")
+        return 0
+
+    slices = {}
+    for case_id in sorted(entry.name for entry in os.scandir(BRATS_DATA_PATH) if entry.is_dir()):
+        flair_slice, seg_slice = _read_case_middle_slices(case_id)
+        if flair_slice is None:
+            continue
+        if slices and flair_slice.shape != next(iter(slices.values()))[0].shape:
+            logger.warning(f"Skipping case {case_id}: slice shape {flair_slice.shape} differs")
+            continue
+        slices[case_id] = (flair_slice, seg_slice)
+
+    if not slices:
+        return 0
+
+    os.makedirs(SLICE_STORE_DIR, exist_ok=True)
+    shape = (len(slices),) + next(iter(slices.values()))[0].shape
+    flair_path = os.path.join(SLICE_STORE_DIR, "flair_mid.npy")
+    seg_path = os.path.join(SLICE_STORE_DIR, "seg_mid.npy")
+    index_path = os.path.join(SLICE_STORE_DIR, "case_ids.json")
+
+    # Write to temp files and swap them in, so a running server keeps its mapping of the
+    # old arrays instead of seeing them truncated underneath it
+    suffix = f".{os.getpid()}.tmp"
+    flair = np.lib.format.open_memmap(flair_path + suffix, mode="w+", dtype=np.uint8, shape=shape)
+    seg = np.lib.format.open_memmap(seg_path + suffix, mode="w+", dtype=np.bool_, shape=shape)
+    for i, (flair_slice, seg_slice) in enumerate(slices.values()):
+        flair[i] = normalize_image(flair_slice)
+        seg[i] = seg_slice > 0 if seg_slice is not None else False
+    flair.flush()
+    seg.flush()
+    del flair, seg
+    with open(index_path + suffix, "w") as f:
+        json.dump(list(slices), f)
+
+    os.replace(flair_path + suffix, flair_path)
+    os.replace(seg_path + suffix, seg_path)
+    os.replace(index_path + suffix, index_path)
+
+    _open_slice_store.cache_clear()
+    return len(slices)
+
+
+def _load_case_middle_slices(case_id: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """
+    Load the FLAIR and segmentation slices at the FLAIR volume's middle z-index,
+    from the slice store when the case is in it and its files are not newer than the store.
+
+    Returns:
+        (flair_slice, seg_slice); either is None if its file is missing or unreadable
+    """
+    store = _slice_store()
+    if store is not None and case_id in store[0]:
+        case_index, flair, seg, built_at = store
+        if all(not os.path.exists(path) or os.path.getmtime(path) <= built_at for path in get_case_paths(case_id)):
+            idx = case_index[case_id]
+            return flair[idx], seg[idx]
+
+    return _read_case_middle_slices(case_id)
+
+
+def _read_case_middle_slices(case_id: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """Read the middle FLAIR and segmentation slices from the case's NIfTI files."""
+    flair_path, seg_path = get_case_paths(case_id)
+
+    flair_slice = load_nifti_slice(flair_path)
+    if flair_slice is None:
+        return None, None
+
+    # Same z as the FLAIR slice; load_nifti_slice clamps it to the segmentation's depth
+    z = _open_nifti(flair_path, os.path.getmtime(flair_path)).shape[2] // 2
+    return flair_slice, load_nifti_slice(seg_path, z)
+
+
 def generate_overlay_for_case(case_id: str, size: Tuple[int, int] = (96, 96)) -> Optional[Image.Image]:
     """
     Generate overlay image for a specific case.
@@ -111,14 +309,8 @@ def generate_overlay_for_case(case_id: str, size: Tuple[int, int] = (96, 96)) ->
     Returns:
         PIL Image with overlay, or None if generation fails
     """
-    # Build paths to FLAIR and segmentation files
-    case_dir = os.path.join(BRATS_DATA_PATH, case_id)
-    flair_path = os.path.join(case_dir, f"{case_id}_flair.nii")
-    seg_path = os.path.join(case_dir, f"{case_id}_seg.nii")
-
     # Load FLAIR and segmentation slices
-    flair_slice = load_nifti_slice(flair_path)
-    seg_slice = load_nifti_slice(seg_path)
+    flair_slice, seg_slice = _load_case_middle_slices(case_id)
 
     if flair_slice is None:
         logger.error(f"Failed to load FLAIR slice for case {case_id}")
@@ -190,7 +382,6 @@ def get_nifti_preview_bytes(nifti_path: str, size: Tuple[int, int] = (128, 128))
     # Convert to bytes with high quality PNG settings
     img_buffer = io.BytesIO()
     preview_image.save(img_buffer, format='PNG', optimize=False, compress_level=1)
-    img_buffer.seek(0)
     return img_buffer.getvalue()
 
 
@@ -205,12 +396,92 @@ def get_overlay_image_bytes(case_id: str, size: Tuple[int, int] = (96, 96)) -> O
     Returns:
         Image bytes, or None if generation fails
     """
+    # Serve from the disk cache unless a case file is newer than the cached overlay
+    cache_path = os.path.join(
+        OVERLAY_DISK_CACHE_DIR, f"{case_id}_{size[0]}x{size[1]}.{OVERLAY_IMAGE_FORMAT.lower()}"
+    )
+    source_mtime = max(
+        (os.path.getmtime(path) for path in get_case_paths(case_id) if os.path.exists(path)),
+        default=0.0
+    )
+    try:
+        if os.path.getmtime(cache_path) >= source_mtime:
+            with open(cache_path, 'rb') as f:
+                return f.read()
+    except OSError:
+        pass
+
     overlay_image = generate_overlay_for_case(case_id, size)
     if overlay_image is None:
         return None
 
-    # Convert to bytes with high quality PNG settings
+    # Convert to bytes in the configured thumbnail format (OVERLAY_MEDIA_TYPE)
     img_buffer = io.BytesIO()
-    overlay_image.save(img_buffer, format='PNG', optimize=False, compress_level=1)
-    img_buffer.seek(0)
-    return img_buffer.getvalue()
+    overlay_image.save(img_buffer, **OVERLAY_SAVE_OPTIONS[OVERLAY_IMAGE_FORMAT])
+    image_bytes = img_buffer.getvalue()
+
+    # Write atomically so concurrent readers never see a partial file
+    try:
+        os.makedirs(OVERLAY_DISK_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Failed to cache overlay for case {case_id}: {e}")
+
+    return image_bytes
+
+
+@lru_cache(maxsize=OVERLAY_CACHE_SIZE)
+def _cached_overlay_bytes(case_id: str, size: Tuple[int, int], mtimes: Tuple[Optional[float], ...]) -> Optional[bytes]:
+    # mtimes is only part of the cache key so edited case files invalidate the entry
+    return get_overlay_image_bytes(case_id, size)
+
+
+def get_cached_overlay_image_bytes(case_id: str, size: Tuple[int, int] = (96, 96)) -> Optional[bytes]:
+    """
+    Get overlay image bytes through an in-process LRU cache keyed on the case files' mtimes.
+
+    Args:
+        case_id: Case ID
+        size: Image size
+
+    Returns:
+        Image bytes, or None if generation fails
+    """
+    mtimes = tuple(
+        os.path.getmtime(path) if os.path.exists(path) else None
+        for path in get_case_paths(case_id)
+    )
+    return _cached_overlay_bytes(case_id, tuple(size), mtimes)
+
+
+def warm_overlay_cache(size: Tuple[int, int] = (96, 96)) -> int:
+    """
+    Pre-render the overlay of every BraTS case into the disk cache.
+
+    Args:
+        size: Image size
+
+    Returns:
+        Number of cases with an overlay available
+    """
+    if not os.path.isdir(BRATS_DATA_PATH):
+        logger.warning(f"BraTS data directory not found: {BRATS_DATA_PATH}")
+        return 0
+
+    case_ids = sorted(entry.name for entry in os.scandir(BRATS_DATA_PATH) if entry.is_dir())
+    return sum(get_overlay_image_bytes(case_id, size) is not None for case_id in case_ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute BraTS overlay data")
+    parser.add_argument("--slice-store", action="store_true",
+                        help="Build the middle-slice store before caching overlays")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.slice_store:
+        print(f"Stored middle slices for {build_slice_store()} cases in {SLICE_STORE_DIR}")
+    print(f"Cached overlays for {warm_overlay_cache()} cases in {OVERLAY_DISK_CACHE_DIR}")
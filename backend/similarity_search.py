@@ -4,22 +4,62 @@ Integrates CLIP model with Pinecone vector database for medical image similarity
 """
 
 import os
+import time
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Tuple, Union
 import numpy as np
 import nibabel as nib
+import cv2
+import json
 from PIL import Image
-import torch
+
+# torch is imported where CLIP is used, so importing this module stays cheap
+if TYPE_CHECKING:
+    import torch
 
 from .config import config
 
+# FAISS is optional; without it CLIP queries always go to Pinecone
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
 # Global variables for model caching
-_clip_model = None
+_clip_model = None  # CLIP image encoder: pixel_values -> image features (eager or TorchScript)
 _clip_processor = None
-_pinecone_index = None
+_clip_encode = None  # compiled _clip_model, when torch.compile is available
+_clip_pixel_norm: Dict[str, Tuple["torch.Tensor", "torch.Tensor", int]] = {}  # device -> (mean, std, crop size)
+_pinecone_indexes: Dict[str, Any] = {}  # index name -> connected Pinecone index
+_local_index = None  # LocalVectorIndex over the saved CLIP embeddings
+
+# IVF-PQ settings for the local index; PQ codebooks need ~39 training points per centroid
+IVFPQ_NLIST = 16
+IVFPQ_M = 64
+IVFPQ_NBITS = 8
+IVFPQ_NPROBE = 4
+IVFPQ_MIN_TRAINING = 39 * (1 << IVFPQ_NBITS)
+
+# Cases embedded per CLIP forward pass, and vectors per Pinecone upsert request, when indexing
+INDEX_BATCH_SIZE = 32
+UPSERT_BATCH_SIZE = 100
+
+# Length of the shape descriptor produced by compute_mask_descriptor
+MASK_DESCRIPTOR_DIM = 32
+
+# Query caches keyed on the segmentation content: sha256 -> query vector, and
+# (sha256, mask-descriptor mode, top_k, threshold) -> (timestamp, results); both LRU, results also expire
+_embedding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_results_cache: "OrderedDict[Tuple[str, bool, int, float], Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+_cache_lock = threading.Lock()
 
 
 class SimilaritySearchError(Exception):
@@ -27,21 +67,151 @@ class SimilaritySearchError(Exception):
     pass
 
 
+class LocalVectorIndex:
+    """
+    In-process FAISS inner-product index over L2-normalized CLIP embeddings (inner product
+    equals cosine similarity). query() mirrors the Pinecone index's response shape.
+    
+    Vectors are stored int8 scalar-quantized by default (4x smaller, int8 distance kernels);
+    IVF-PQ is used only when requested and the corpus is large enough to train it.
+    """
+    
+    def __init__(self, ids: List[str], embeddings: np.ndarray, metadata: Optional[Dict[str, Dict[str, Any]]] = None,
+                 quantization: str = "sq8"):
+        self.ids = list(ids)
+        self.metadata = metadata or {}
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        dim = embeddings.shape[1]
+        
+        if quantization == "ivfpq" and len(embeddings) >= IVFPQ_MIN_TRAINING:
+            self._quantizer = faiss.IndexFlatIP(dim)
+            self.index = faiss.IndexIVFPQ(
+                self._quantizer, dim, IVFPQ_NLIST, IVFPQ_M, IVFPQ_NBITS, faiss.METRIC_INNER_PRODUCT
+            )
+            self.index.nprobe = IVFPQ_NPROBE
+        elif quantization in ("sq8", "ivfpq"):
+            self.index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        else:
+            # Exact fp32 search
+            self.index = faiss.IndexFlatIP(dim)
+        
+        if not self.index.is_trained:
+            self.index.train(embeddings)
+        self.index.add(embeddings)
+    
+    def query(self, vector: List[float], top_k: int, include_metadata: bool = True) -> Dict[str, Any]:
+        scores, indices = self.index.search(np.asarray([vector], dtype=np.float32), top_k)
+        return {
+            'matches': [
+                {
+                    'id': self.ids[i],
+                    'score': float(score),
+                    'metadata': self.metadata.get(self.ids[i], {}) if include_metadata else {}
+                }
+                for score, i in zip(scores[0], indices[0]) if i >= 0
+            ]
+        }
+
+
+def save_local_index(ids: List[str], embeddings: np.ndarray, metadata: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+    """
+    Save CLIP embeddings for the local FAISS backend (config.LOCAL_INDEX_DIR).
+    
+    Args:
+        ids: Vector IDs (e.g. "BraTS20_Training_009_seg"), one per embedding row
+        embeddings: (len(ids), 512) L2-normalized CLIP embeddings
+        metadata: Optional ID -> metadata mapping returned with matches
+    """
+    global _local_index
+    
+    os.makedirs(config.LOCAL_INDEX_DIR, exist_ok=True)
+    np.save(os.path.join(config.LOCAL_INDEX_DIR, "embeddings.npy"), np.asarray(embeddings, dtype=np.float32))
+    with open(os.path.join(config.LOCAL_INDEX_DIR, "ids.json"), "w") as f:
+        json.dump(list(ids), f)
+    with open(os.path.join(config.LOCAL_INDEX_DIR, "metadata.json"), "w") as f:
+        json.dump(metadata or {}, f)
+    _local_index = None
+    # Cached results were ranked against the old index
+    invalidate_similarity_cache()
+
+
+def _load_local_index() -> Optional[LocalVectorIndex]:
+    """Load and cache the local FAISS index, or return None if it is unavailable."""
+    global _local_index
+    
+    if _local_index is not None:
+        return _local_index
+    
+    embeddings_path = os.path.join(config.LOCAL_INDEX_DIR, "embeddings.npy")
+    ids_path = os.path.join(config.LOCAL_INDEX_DIR, "ids.json")
+    if not (FAISS_AVAILABLE and os.path.exists(embeddings_path) and os.path.exists(ids_path)):
+        return None
+    
+    with open(ids_path) as f:
+        ids = json.load(f)
+    metadata_path = os.path.join(config.LOCAL_INDEX_DIR, "metadata.json")
+    metadata = {}
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+    
+    _local_index = LocalVectorIndex(ids, np.load(embeddings_path), metadata, config.LOCAL_INDEX_QUANTIZATION)
+    logger.info(f"Loaded local FAISS index with {len(ids)} vectors from {config.LOCAL_INDEX_DIR}")
+    return _local_index
+
+
+def initialize_vector_index():
+    """
+    Return the index CLIP queries go to: the local FAISS index when VECTOR_BACKEND is
+    "faiss", or "auto" with a saved index present; otherwise the Pinecone index.
+    """
+    if config.VECTOR_BACKEND != "pinecone":
+        try:
+            local_index = _load_local_index()
+        except Exception as e:
+            logger.warning(f"Failed to load local FAISS index: {e}")
+            local_index = None
+        if local_index is not None:
+            return local_index
+        if config.VECTOR_BACKEND == "faiss":
+            raise SimilaritySearchError(
+                f"Local FAISS index unavailable (faiss installed: {FAISS_AVAILABLE}, dir: {config.LOCAL_INDEX_DIR})"
+            )
+    
+    return initialize_pinecone_client()
+
+
 def initialize_clip_model():
-    """Initialize and cache the CLIP model and processor."""
+    """
+    Initialize and cache the CLIP image encoder and processor.
+    
+    The encoder maps pixel_values to image features. It is loaded from the TorchScript
+    export next to config.CLIP_MODEL_CACHE_PATH when one matches the model, device and
+    dtype; otherwise it is built from the Hugging Face weights and exported there.
+    """
     global _clip_model, _clip_processor
     
     if _clip_model is not None and _clip_processor is not None:
         return _clip_model, _clip_processor
     
     try:
-        from transformers import CLIPProcessor, CLIPModel
+        import torch
+        from transformers import CLIPProcessor
         
         device = config.get_device()
         logger.info(f"Loading CLIP model on device: {device}")
         
-        _clip_model = CLIPModel.from_pretrained(config.CLIP_MODEL_NAME).to(device)
         _clip_processor = CLIPProcessor.from_pretrained(config.CLIP_MODEL_NAME)
+        encoder, scripted = _load_clip_encoder(_clip_processor.image_processor.crop_size["height"], device)
+        
+        if scripted:
+            try:
+                encoder = torch.jit.optimize_for_inference(torch.jit.freeze(encoder))
+            except Exception as e:
+                logger.warning(f"TorchScript inference optimization failed for CLIP: {e}")
+        _clip_model = encoder
+        if not scripted:
+            _compile_clip_encoder(device)
         
         logger.info("CLIP model loaded successfully")
         return _clip_model, _clip_processor
@@ -51,12 +221,115 @@ def initialize_clip_model():
         raise SimilaritySearchError(f"Failed to load CLIP model: {e}")
 
 
-def initialize_pinecone_client():
-    """Initialize and cache the Pinecone client and index."""
-    global _pinecone_index
+def _clip_cache_path(device: str, dtype: str) -> str:
+    """TorchScript cache file for one device/dtype; a trace bakes in both, so they are not shared."""
+    base, ext = os.path.splitext(config.CLIP_MODEL_CACHE_PATH)
+    return f"{base}_{device}_{dtype}{ext or '.pt'}"
+
+
+def _load_clip_encoder(image_size: int, device: str) -> Tuple["torch.nn.Module", bool]:
+    """
+    Load the CLIP image encoder on the device, in fp16 on CUDA: the cached TorchScript
+    export if it was traced for the same model, device, dtype and image size, else the
+    Hugging Face model, traced and saved to the cache path for later processes.
+    
+    Returns:
+        (encoder, whether it is a TorchScript module)
+    """
+    import torch
+    
+    # fp16 weights halve memory traffic and run on tensor cores
+    dtype = torch.float16 if device == "cuda" else torch.float32
+    cache_key = {
+        "model": config.CLIP_MODEL_NAME,
+        "device": device,
+        "dtype": str(dtype),
+        "image_size": image_size,
+    }
+    cache_path = ""
+    if config.CLIP_MODEL_CACHE_PATH:
+        cache_path = _clip_cache_path(device, "fp16" if dtype == torch.float16 else "fp32")
+    
+    if cache_path and os.path.exists(cache_path):
+        try:
+            extra_files = {"clip_encoder.json": ""}
+            encoder = torch.jit.load(cache_path, map_location=device, _extra_files=extra_files)
+            cached_key = json.loads(extra_files["clip_encoder.json"] or "{}")
+            if cached_key == cache_key:
+                logger.info(f"Loaded TorchScript CLIP encoder from {cache_path}")
+                return encoder, True
+            logger.info(f"TorchScript CLIP encoder at {cache_path} was traced for {cached_key}, rebuilding")
+        except Exception as e:
+            logger.warning(f"Failed to load TorchScript CLIP encoder from {cache_path}: {e}")
+    
+    from transformers import CLIPModel
+    
+    class ClipImageEncoder(torch.nn.Module):
+        """CLIP's vision tower and projection as a plain module, so it can be traced to TorchScript."""
+        
+        def __init__(self, clip_model):
+            super().__init__()
+            self.clip_model = clip_model
+        
+        def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+            return self.clip_model.get_image_features(pixel_values=pixel_values)
+    
+    encoder = ClipImageEncoder(CLIPModel.from_pretrained(config.CLIP_MODEL_NAME)).to(device, dtype).eval()
+    if cache_path:
+        # Trace on the serving device and dtype: HF casts pixel_values to the patch
+        # embedding's dtype, and the trace records that cast
+        try:
+            with torch.inference_mode():
+                example = torch.zeros(1, 3, image_size, image_size, device=device, dtype=dtype)
+                traced = torch.jit.trace(encoder, example, check_trace=False)
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            torch.jit.save(traced, tmp_path, _extra_files={"clip_encoder.json": json.dumps(cache_key)})
+            os.replace(tmp_path, cache_path)
+            logger.info(f"Saved TorchScript CLIP encoder to {cache_path}")
+        except Exception as e:
+            logger.warning(f"Failed to export TorchScript CLIP encoder: {e}")
+    return encoder, False
+
+
+def _compile_clip_encoder(device: str) -> None:
+    """
+    Compile the CLIP vision tower once and warm it up on a blank image, so queries
+    skip per-module Python dispatch. Falls back to eager mode if compilation fails.
+    """
+    global _clip_encode
+    
+    import torch
+    
+    if not hasattr(torch, "compile"):
+        return
+    
+    try:
+        encode = torch.compile(_clip_model, mode="reduce-overhead")
+        blank = Image.new("RGB", (config.CLIP_IMAGE_SIZE, config.CLIP_IMAGE_SIZE))
+        pixel_values = _clip_processor(images=blank, return_tensors="pt")["pixel_values"].to(device)
+        if device == "cuda":
+            pixel_values = pixel_values.half()
+        with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=(device == "cuda")):
+            encode(pixel_values)
+        _clip_encode = encode
+        logger.info("CLIP vision encoder compiled")
+    except Exception as e:
+        logger.warning(f"torch.compile failed for CLIP, using eager mode: {e}")
+
+
+def initialize_pinecone_client(index_name: Optional[str] = None, dimension: int = 512):
+    """
+    Initialize and cache the Pinecone client and index.
+    
+    Args:
+        index_name: Index to connect to (defaults to the CLIP index, config.PINECONE_INDEX_NAME)
+        dimension: Vector dimension used if the index has to be created (512 for CLIP)
+    """
+    index_name = index_name or config.PINECONE_INDEX_NAME
     
-    if _pinecone_index is not None:
-        return _pinecone_index
+    if index_name in _pinecone_indexes:
+        return _pinecone_indexes[index_name]
     
     try:
         from pinecone import Pinecone, ServerlessSpec
@@ -65,11 +338,11 @@ def initialize_pinecone_client():
         pc = Pinecone(api_key=config.PINECONE_API_KEY)
         
         # Check if index exists, create if it doesn't
-        if config.PINECONE_INDEX_NAME not in [index.name for index in pc.list_indexes()]:
-            logger.info(f"Creating Pinecone index: {config.PINECONE_INDEX_NAME}")
+        if index_name not in [index.name for index in pc.list_indexes()]:
+            logger.info(f"Creating Pinecone index: {index_name}")
             pc.create_index(
-                name=config.PINECONE_INDEX_NAME,
-                dimension=512,  # CLIP embedding dimension
+                name=index_name,
+                dimension=dimension,
                 metric="cosine",
                 spec=ServerlessSpec(
                     cloud=config.PINECONE_CLOUD,
@@ -78,33 +351,99 @@ def initialize_pinecone_client():
             )
         
         # Connect to index
-        _pinecone_index = pc.Index(config.PINECONE_INDEX_NAME)
-        logger.info(f"Connected to Pinecone index: {config.PINECONE_INDEX_NAME}")
-        return _pinecone_index
+        _pinecone_indexes[index_name] = pc.Index(index_name)
+        logger.info(f"Connected to Pinecone index: {index_name}")
+        return _pinecone_indexes[index_name]
         
     except Exception as e:
         logger.error(f"Failed to initialize Pinecone: {e}")
         raise SimilaritySearchError(f"Failed to initialize Pinecone: {e}")
 
 
-def convert_segmentation_to_clip_input(seg_path: str) -> Image.Image:
+def _middle_slice(seg: Union[str, np.ndarray]) -> np.ndarray:
+    """Middle axial slice of a segmentation given as a NIfTI path or a 3D label volume."""
+    # Extract middle slice
+    if isinstance(seg, np.ndarray):
+        return seg[:, :, seg.shape[2] // 2]
+    
+    # Read only that slice through the array proxy, in the file's native dtype
+    seg_img = nib.load(seg)
+    z_idx = seg_img.shape[2] // 2
+    return np.asanyarray(seg_img.dataobj[:, :, z_idx])
+
+
+def compute_mask_descriptor(seg2d: np.ndarray) -> np.ndarray:
+    """
+    Describe the shape of a 2D tumor mask as a fixed-length vector for cosine search.
+    
+    The CLIP input built from a segmentation is only a red-on-black silhouette, so its
+    shape can be described directly: scaled log Hu moments (7), area ratio (1),
+    centroid (2), bounding box (4), bounding-box aspect (1), extent (1) and a 4x4
+    occupancy grid (16).
+    
+    Args:
+        seg2d: 2D segmentation slice (tumor wherever > 0)
+        
+    Returns:
+        float32 array of length MASK_DESCRIPTOR_DIM (all zeros for an empty mask)
+    """
+    mask = (np.asarray(seg2d) > 0).astype(np.uint8)
+    descriptor = np.zeros(MASK_DESCRIPTOR_DIM, dtype=np.float32)
+    if not mask.any():
+        return descriptor
+    
+    height, width = mask.shape
+    moments = cv2.moments(mask, binaryImage=True)
+    hu = cv2.HuMoments(moments).ravel()
+    # Log scaling brings the moments' magnitudes together; /30 keeps them near [-1, 1]
+    descriptor[:7] = -np.sign(hu) * np.log10(np.abs(hu) + 1e-30) / 30.0
+    
+    area = moments["m00"]
+    ys, xs = np.nonzero(mask)
+    y0, y1, x0, x1 = ys.min(), ys.max(), xs.min(), xs.max()
+    box_w, box_h = x1 - x0 + 1, y1 - y0 + 1
+    
+    descriptor[7] = area / (height * width)
+    descriptor[8:10] = (moments["m10"] / area / width, moments["m01"] / area / height)
+    descriptor[10:14] = (x0 / width, y0 / height, box_w / width, box_h / height)
+    descriptor[14] = min(box_w, box_h) / max(box_w, box_h)
+    descriptor[15] = area / (box_w * box_h)
+    descriptor[16:] = cv2.resize(mask.astype(np.float32), (4, 4), interpolation=cv2.INTER_AREA).ravel()
+    return descriptor
+
+
+def index_mask_descriptors(segmentations: Dict[str, Union[str, np.ndarray]]) -> int:
+    """
+    Populate the mask-descriptor index used when ENABLE_MASK_DESCRIPTOR_SEARCH is set.
+    
+    Args:
+        segmentations: case ID -> segmentation NIfTI path or 3D label volume
+        
+    Returns:
+        Number of vectors upserted
+    """
+    index = initialize_pinecone_client(config.PINECONE_MASK_INDEX_NAME, MASK_DESCRIPTOR_DIM)
+    vectors = [
+        (f"{case_id}_seg", compute_mask_descriptor(_middle_slice(seg)).tolist())
+        for case_id, seg in segmentations.items()
+    ]
+    if vectors:
+        index.upsert(vectors=vectors)
+    return len(vectors)
+
+
+def convert_segmentation_to_clip_input(seg: Union[str, np.ndarray]) -> Image.Image:
     """
     Convert a 3D segmentation mask to a 2D RGB image suitable for CLIP.
     
     Args:
-        seg_path: Path to the segmentation NIfTI file
+        seg: Path to the segmentation NIfTI file, or the already-decoded 3D label volume
         
     Returns:
         PIL Image in RGB format with red overlay for tumor regions
     """
     try:
-        # Load the segmentation image
-        seg_img = nib.load(seg_path)
-        seg_data = seg_img.get_fdata()
-        
-        # Extract middle slice
-        z_idx = seg_data.shape[2] // 2
-        slice_seg = seg_data[:, :, z_idx]
+        slice_seg = _middle_slice(seg)
         
         # Convert to RGB (tumor mask in red)
         seg_rgb = np.zeros((slice_seg.shape[0], slice_seg.shape[1], 3), dtype=np.uint8)
@@ -120,55 +459,245 @@ def convert_segmentation_to_clip_input(seg_path: str) -> Image.Image:
         raise SimilaritySearchError(f"Failed to convert segmentation: {e}")
 
 
-def generate_clip_embedding(image: Image.Image) -> np.ndarray:
+def generate_clip_embeddings(images: List[Image.Image]) -> np.ndarray:
     """
-    Generate CLIP embedding for an image.
+    Generate CLIP embeddings for a batch of images in a single forward pass.
     
     Args:
-        image: PIL Image to encode
+        images: PIL Images to encode
         
     Returns:
-        Normalized CLIP embedding as numpy array
+        Normalized CLIP embeddings as a (len(images), dim) numpy array
     """
     try:
         model, processor = initialize_clip_model()
         device = config.get_device()
         
-        # Preprocess image
-        inputs = processor(images=image, return_tensors="pt").to(device)
+        # Preprocess all images into one batch tensor
+        inputs = processor(images=list(images), return_tensors="pt").to(device)
         
-        # Generate embedding
-        with torch.no_grad():
-            image_features = model.get_image_features(**inputs)
-            # Normalize the embedding
-            image_features = image_features / image_features.norm(p=2, dim=-1, keepdim=True)
-            
-        return image_features.cpu().numpy()[0]
+        return _encode_pixel_values(model, inputs["pixel_values"], device)
         
     except Exception as e:
-        logger.error(f"Failed to generate CLIP embedding: {e}")
+        logger.error(f"Failed to generate CLIP embeddings: {e}")
+        raise SimilaritySearchError(f"Failed to generate embeddings: {e}")
+
+
+def _encode_pixel_values(model, pixel_values: "torch.Tensor", device: str) -> np.ndarray:
+    """Run the CLIP image encoder on preprocessed pixel values and L2-normalize the output."""
+    import torch
+    import torch.nn.functional as F
+    
+    # Generate embeddings (fp16 autocast on CUDA to match the half-precision weights)
+    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=(device == "cuda")):
+        encode = _clip_encode if _clip_encode is not None else model
+        if device == "cuda":
+            # Match the fp16 weights; TorchScript modules do not pick up autocast
+            pixel_values = pixel_values.half()
+        # Normalize the embeddings in one fused op, in fp32 so the L2 reduction cannot overflow
+        image_features = F.normalize(encode(pixel_values).float(), p=2, dim=-1)
+        
+    return image_features.cpu().numpy()
+
+
+def _seg_to_clip_tensor(slice_seg: np.ndarray, device: str) -> "torch.Tensor":
+    """
+    Build CLIP pixel values for a segmentation slice (tumor in red on black) directly
+    on the device, replacing the numpy -> PIL -> processor round-trip.
+    """
+    import torch
+    import torch.nn.functional as F
+    
+    if device not in _clip_pixel_norm:
+        _, processor = initialize_clip_model()
+        image_processor = processor.image_processor
+        _clip_pixel_norm[device] = (
+            torch.tensor(image_processor.image_mean, device=device).view(1, 3, 1, 1),
+            torch.tensor(image_processor.image_std, device=device).view(1, 3, 1, 1),
+            image_processor.crop_size["height"],
+        )
+    mean, std, size = _clip_pixel_norm[device]
+    
+    # Red channel is the mask (255 rescaled to 1.0), green and blue stay 0
+    mask = torch.from_numpy(np.ascontiguousarray(slice_seg > 0)).to(device)
+    pixels = torch.zeros((1, 3, size, size), device=device)
+    pixels[:, :1] = F.interpolate(
+        mask.to(torch.float32)[None, None], size=(size, size), mode="bilinear", antialias=True, align_corners=False
+    )
+    return (pixels - mean) / std
+
+
+def generate_segmentation_embedding(seg: Union[str, np.ndarray]) -> np.ndarray:
+    """
+    Generate the CLIP embedding of a segmentation's middle-slice tumor mask.
+    
+    Args:
+        seg: Path to the segmentation NIfTI file, or the already-decoded 3D label volume
+        
+    Returns:
+        Normalized CLIP embedding as numpy array
+    """
+    try:
+        model, _ = initialize_clip_model()
+        device = config.get_device()
+        return _encode_pixel_values(model, _seg_to_clip_tensor(_middle_slice(seg), device), device)[0]
+        
+    except Exception as e:
+        logger.error(f"Failed to generate segmentation embedding: {e}")
         raise SimilaritySearchError(f"Failed to generate embedding: {e}")
 
 
-def search_similar_cases(seg_path: str) -> List[Dict[str, Any]]:
+def generate_clip_embedding(image: Image.Image) -> np.ndarray:
+    """
+    Generate CLIP embedding for an image.
+    
+    Args:
+        image: PIL Image to encode
+        
+    Returns:
+        Normalized CLIP embedding as numpy array
+    """
+    return generate_clip_embeddings([image])[0]
+
+
+def batch_index_cases(case_ids: List[str], batch_size: int = INDEX_BATCH_SIZE,
+                      upsert: bool = False) -> Tuple[List[str], np.ndarray]:
+    """
+    Embed the segmentations of many BraTS cases, reading the next batch's NIfTI slices on a
+    worker thread while the current batch runs through CLIP.
+    
+    Args:
+        case_ids: BraTS case IDs (e.g. "BraTS20_Training_009")
+        batch_size: Cases per CLIP forward pass
+        upsert: Also upsert the vectors into the Pinecone CLIP index
+        
+    Returns:
+        (vector IDs, (n, 512) embeddings), ready for save_local_index; cases whose
+        segmentation cannot be read are skipped
+    """
+    import torch
+    from .overlay_generator import get_case_paths
+    
+    batches = [case_ids[i:i + batch_size] for i in range(0, len(case_ids), batch_size)]
+    if not batches:
+        return [], np.empty((0, 512), dtype=np.float32)
+    
+    model, _ = initialize_clip_model()
+    device = config.get_device()
+    
+    def load_batch(batch: List[str]) -> List[Tuple[str, np.ndarray]]:
+        loaded = []
+        for case_id in batch:
+            try:
+                loaded.append((case_id, _middle_slice(get_case_paths(case_id)[1])))
+            except Exception as e:
+                logger.warning(f"Skipping case {case_id}: {e}")
+        return loaded
+    
+    ids: List[str] = []
+    embeddings: List[np.ndarray] = []
+    
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(load_batch, batches[0])
+        for next_batch in batches[1:] + [None]:
+            loaded = pending.result()
+            # Start reading the next batch before this one's forward pass
+            pending = executor.submit(load_batch, next_batch) if next_batch is not None else None
+            if not loaded:
+                continue
+            
+            pixel_values = torch.cat([_seg_to_clip_tensor(slice_seg, device) for _, slice_seg in loaded])
+            embeddings.append(_encode_pixel_values(model, pixel_values, device))
+            ids.extend(f"{case_id}_seg" for case_id, _ in loaded)
+    
+    vectors = np.concatenate(embeddings) if embeddings else np.empty((0, 512), dtype=np.float32)
+    
+    if upsert and ids:
+        index = initialize_pinecone_client()
+        for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+            index.upsert(vectors=[
+                (vector_id, vector.tolist())
+                for vector_id, vector in zip(ids[start:start + UPSERT_BATCH_SIZE], vectors[start:start + UPSERT_BATCH_SIZE])
+            ])
+    
+    logger.info(f"Embedded {len(ids)} of {len(case_ids)} cases")
+    return ids, vectors
+
+
+def _segmentation_key(seg: Union[str, np.ndarray]) -> str:
+    """
+    Content hash identifying a segmentation query. For in-memory volumes only the middle
+    slice is hashed, since that is all the query embedding depends on.
+    """
+    h = hashlib.sha256()
+    if isinstance(seg, np.ndarray):
+        slice_seg = np.ascontiguousarray(seg[:, :, seg.shape[2] // 2])
+        h.update(f"{slice_seg.shape}{slice_seg.dtype}".encode())
+        h.update(slice_seg.tobytes())
+    else:
+        with open(seg, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def _cache_put(cache: OrderedDict, key, value) -> None:
+    """Insert into an LRU cache dict, evicting the oldest entries beyond QUERY_CACHE_SIZE."""
+    with _cache_lock:
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > config.QUERY_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def invalidate_similarity_cache() -> None:
+    """Drop all cached query embeddings and search results."""
+    with _cache_lock:
+        _embedding_cache.clear()
+        _results_cache.clear()
+
+
+def search_similar_cases(seg: Union[str, np.ndarray]) -> List[Dict[str, Any]]:
     """
     Search for similar cases using the segmentation mask.
     
     Args:
-        seg_path: Path to the segmentation NIfTI file
+        seg: Path to the segmentation NIfTI file, or the already-decoded 3D label volume
         
     Returns:
         List of similar cases with metadata and scores
     """
     try:
-        # Convert segmentation to CLIP input
-        clip_image = convert_segmentation_to_clip_input(seg_path)
+        use_mask_descriptor = config.ENABLE_MASK_DESCRIPTOR_SEARCH
+        seg_key = _segmentation_key(seg)
+        results_key = (seg_key, use_mask_descriptor, config.TOP_K_RESULTS, config.SIMILARITY_THRESHOLD)
         
-        # Generate embedding
-        query_vector = generate_clip_embedding(clip_image)
+        # Serve repeated queries from the cache while the results are fresh
+        with _cache_lock:
+            cached = _results_cache.get(results_key)
+            if cached is not None and time.monotonic() - cached[0] < config.QUERY_CACHE_TTL_SECONDS:
+                _results_cache.move_to_end(results_key)
+                logger.info(f"Found {len(cached[1])} similar cases (cached)")
+                return list(cached[1])
+            query_vector = _embedding_cache.get(seg_key)
+            if query_vector is not None:
+                _embedding_cache.move_to_end(seg_key)
         
-        # Initialize Pinecone and search
-        index = initialize_pinecone_client()
+        if use_mask_descriptor:
+            # The binary mask is described directly; no CLIP forward needed
+            query_vector = compute_mask_descriptor(_middle_slice(seg))
+            index = initialize_pinecone_client(config.PINECONE_MASK_INDEX_NAME, MASK_DESCRIPTOR_DIM)
+        else:
+            index = None
+        
+        if query_vector is None:
+            # Generate embedding from the mask tensor built on the CLIP device
+            query_vector = generate_segmentation_embedding(seg)
+            _cache_put(_embedding_cache, seg_key, query_vector)
+        
+        # Initialize the vector index (local FAISS or Pinecone) and search
+        if index is None:
+            index = initialize_vector_index()
         
         # Query for similar cases
         query_response = index.query(
@@ -188,8 +717,9 @@ def search_similar_cases(seg_path: str) -> List[Dict[str, Any]]:
                     'case_name': match['id'].replace('_seg', '') if '_seg' in match['id'] else match['id']
                 })
         
+        _cache_put(_results_cache, results_key, (time.monotonic(), results))
         logger.info(f"Found {len(results)} similar cases")
-        return results
+        return list(results)
         
     except Exception as e:
         logger.error(f"Similarity search failed: {e}")
@@ -213,11 +743,16 @@ def is_similarity_search_available() -> Tuple[bool, Optional[str]]:
         return False, f"Configuration error: {error_msg}"
     
     try:
+        if config.ENABLE_MASK_DESCRIPTOR_SEARCH:
+            # Test the mask-descriptor index connection; CLIP is not used
+            initialize_pinecone_client(config.PINECONE_MASK_INDEX_NAME, MASK_DESCRIPTOR_DIM)
+            return True, None
+        
         # Test CLIP model loading
         initialize_clip_model()
         
-        # Test Pinecone connection
-        initialize_pinecone_client()
+        # Test the vector index (local FAISS or Pinecone connection)
+        initialize_vector_index()
         
         return True, None
         
@@ -0,0 +1,440 @@
+"""
+TensorRT inference backend for the MedScan segmentation UNet.
+Converts the Keras .h5 checkpoint to FP16 (and, when calibration data is available,
+INT8) TensorRT engines cached on disk next to the checkpoint, and exposes the
+faster one through a small Keras-like wrapper.
+"""
+
+import os
+import glob
+import time
+import uuid
+import logging
+import threading
+import argparse
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Try to import TensorRT / CUDA bindings, handle gracefully if not available
+try:
+    import tensorrt as trt
+    import pycuda.driver as cuda
+    import pycuda.autoinit  # creates the CUDA context
+    TENSORRT_AVAILABLE = True
+except Exception:
+    TENSORRT_AVAILABLE = False
+    trt = None
+    cuda = None
+
+from backend.main import IMG_SIZE, VOLUME_SLICES, build_model, load_nifti, prepare_input
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ONNX_OPSET = 13
+WORKSPACE_BYTES = 1 << 30  # 1 GiB builder workspace
+
+# INT8 calibration: prepared input batches of chosen cases, written offline as .npy files
+# by `python -m backend.trt_engine --calibrate CASE_DIR ...` (never from live requests)
+CALIBRATION_DIR = os.path.join(os.path.dirname(__file__), "model", "calibration")
+CALIBRATION_MAX_BATCHES = 4
+BENCHMARK_RUNS = 5
+
+
+def get_engine_path(model_path: str, precision: str = "fp16") -> str:
+    """Return the cached engine path that sits next to the Keras checkpoint."""
+    return f"{os.path.splitext(model_path)[0]}.{precision}.engine"
+
+
+def export_onnx(model_path: str, onnx_path: str) -> Tuple[int, ...]:
+    """
+    Export the Keras checkpoint to ONNX with a fixed (VOLUME_SLICES, IMG_SIZE, IMG_SIZE, C) input.
+
+    Returns:
+        The static input shape used for the export
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    keras_model = build_model(model_path)
+    input_shape = (VOLUME_SLICES, IMG_SIZE, IMG_SIZE, int(keras_model.input_shape[-1]))
+    spec = (tf.TensorSpec(input_shape, tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=ONNX_OPSET, output_path=onnx_path)
+    return input_shape
+
+
+def save_calibration_batch(x_batch: np.ndarray, calib_dir: str = CALIBRATION_DIR) -> Optional[str]:
+    """
+    Keep a prepared input batch for INT8 calibration, up to CALIBRATION_MAX_BATCHES files.
+
+    Args:
+        x_batch: Output of prepare_input (VOLUME_SLICES, IMG_SIZE, IMG_SIZE, C)
+        calib_dir: Directory holding the calibration .npy files
+
+    Returns:
+        Path of the saved batch, or None if the directory is already full
+    """
+    os.makedirs(calib_dir, exist_ok=True)
+    if len(list_calibration_files(calib_dir)) >= CALIBRATION_MAX_BATCHES:
+        return None
+    path = os.path.join(calib_dir, f"batch_{uuid.uuid4().hex}.npy")
+    np.save(path, x_batch.astype(np.float32))
+    return path
+
+
+def _find_modality_file(case_dir: str, name: str) -> str:
+    """Return the case's `<case>_<name>.nii` or `.nii.gz` file."""
+    case_id = os.path.basename(os.path.normpath(case_dir))
+    for ext in (".nii", ".nii.gz"):
+        path = os.path.join(case_dir, f"{case_id}_{name}{ext}")
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"Missing {name} volume in {case_dir}")
+
+
+def collect_calibration_batches(case_dirs: List[str], channel_order: Tuple[str, ...],
+                                calib_dir: str = CALIBRATION_DIR) -> List[str]:
+    """
+    Prepare the given cases exactly as /predict does and save them as INT8 calibration
+    batches. The INT8 engine is rebuilt on next load when these are newer than it.
+
+    Args:
+        case_dirs: Case directories holding `<case>_<modality>.nii[.gz]` volumes
+        channel_order: Modalities in model input order, e.g. ("flair", "t1ce")
+        calib_dir: Directory holding the calibration .npy files
+
+    Returns:
+        Paths of the saved batches
+    """
+    saved = []
+    for case_dir in case_dirs:
+        modalities = {name: load_nifti(_find_modality_file(case_dir, name))[0] for name in channel_order}
+        path = save_calibration_batch(prepare_input(modalities, channel_order), calib_dir)
+        if path is None:
+            logger.warning(f"{calib_dir} already holds {CALIBRATION_MAX_BATCHES} batches, stopping")
+            break
+        saved.append(path)
+    return saved
+
+
+def list_calibration_files(calib_dir: str = CALIBRATION_DIR) -> List[str]:
+    """Return the sorted calibration .npy files in `calib_dir`."""
+    return sorted(glob.glob(os.path.join(calib_dir, "*.npy")))
+
+
+if TENSORRT_AVAILABLE:
+    class NpyEntropyCalibrator(trt.IInt8EntropyCalibrator2):
+        """Entropy calibrator fed by .npy batches shaped like prepare_input output."""
+
+        def __init__(self, files: List[str], cache_path: str, dtype=np.float32):
+            super().__init__()
+            self.files = files
+            self.cache_path = cache_path
+            self.dtype = dtype
+            self._index = 0
+            first = np.load(files[0])
+            self._batch_size = first.shape[0]
+            self._dev_in = cuda.mem_alloc(first.astype(dtype).nbytes)
+
+        def get_batch_size(self) -> int:
+            return self._batch_size
+
+        def get_batch(self, names):
+            if self._index >= len(self.files):
+                return None
+            batch = np.ascontiguousarray(np.load(self.files[self._index]), dtype=self.dtype)
+            self._index += 1
+            cuda.memcpy_htod(self._dev_in, batch)
+            return [int(self._dev_in)]
+
+        def read_calibration_cache(self):
+            if os.path.exists(self.cache_path):
+                with open(self.cache_path, "rb") as f:
+                    return f.read()
+            return None
+
+        def write_calibration_cache(self, cache):
+            with open(self.cache_path, "wb") as f:
+                f.write(cache)
+
+
+def _keep_sensitive_layers_fp16(network) -> None:
+    """
+    Pin the accuracy-sensitive head of the UNet (final 1x1 conv and softmax) to FP16
+    so INT8 quantization only applies to the encoder/decoder body.
+    """
+    last_conv = None
+    sensitive = []
+    for i in range(network.num_layers):
+        layer = network.get_layer(i)
+        if layer.type == trt.LayerType.CONVOLUTION:
+            last_conv = layer
+        elif layer.type == trt.LayerType.SOFTMAX:
+            sensitive.append(layer)
+    if last_conv is not None:
+        sensitive.append(last_conv)
+
+    for layer in sensitive:
+        layer.precision = trt.float16
+        for j in range(layer.num_outputs):
+            layer.set_output_type(j, trt.float16)
+
+
+def build_engine(
+    onnx_path: str,
+    engine_path: str,
+    precision: str = "fp16",
+    calibration_files: Optional[List[str]] = None
+) -> None:
+    """
+    Parse the ONNX graph and serialize a TensorRT engine to disk.
+
+    Args:
+        onnx_path: Path to the exported ONNX model
+        engine_path: Output path for the serialized engine
+        precision: "fp16" or "int8" (INT8 keeps FP16 enabled for fallback layers)
+        calibration_files: .npy calibration batches, required for "int8"
+    """
+    trt_logger = trt.Logger(trt.Logger.WARNING)
+    builder = trt.Builder(trt_logger)
+    network = builder.create_network(1 << int(trt.NetworkDefinitionCreationFlag.EXPLICIT_BATCH))
+    parser = trt.OnnxParser(network, trt_logger)
+
+    with open(onnx_path, "rb") as f:
+        if not parser.parse(f.read()):
+            errors = [str(parser.get_error(i)) for i in range(parser.num_errors)]
+            raise RuntimeError(f"Failed to parse ONNX model {onnx_path}: {errors}")
+
+    builder_config = builder.create_builder_config()
+    builder_config.set_memory_pool_limit(trt.MemoryPoolType.WORKSPACE, WORKSPACE_BYTES)
+    if builder.platform_has_fast_fp16:
+        builder_config.set_flag(trt.BuilderFlag.FP16)
+        # Half-precision I/O halves host<->device traffic; TRTModel casts on copy
+        for i in range(network.num_inputs):
+            network.get_input(i).dtype = trt.float16
+        for i in range(network.num_outputs):
+            network.get_output(i).dtype = trt.float16
+
+    if precision == "int8":
+        if not builder.platform_has_fast_int8:
+            raise RuntimeError("Platform does not support fast INT8 inference")
+        if not calibration_files:
+            raise ValueError("INT8 engine requires calibration files")
+        builder_config.set_flag(trt.BuilderFlag.INT8)
+        builder_config.set_flag(trt.BuilderFlag.PREFER_PRECISION_CONSTRAINTS)
+        builder_config.int8_calibrator = NpyEntropyCalibrator(
+            calibration_files,
+            f"{os.path.splitext(engine_path)[0]}.calib",
+            trt.nptype(network.get_input(0).dtype)
+        )
+        _keep_sensitive_layers_fp16(network)
+
+    serialized = builder.build_serialized_network(network, builder_config)
+    if serialized is None:
+        raise RuntimeError(f"TensorRT failed to build an engine from {onnx_path}")
+
+    with open(engine_path, "wb") as f:
+        f.write(serialized)
+
+
+class TRTModel:
+    """
+    Thin wrapper around a deserialized TensorRT engine that mimics the parts of
+    the Keras model API used by the prediction pipeline (`input_shape`, `predict`).
+
+    Host buffers are page-locked and device buffers are allocated once. Batches
+    larger than the engine batch are processed in chunks through two buffer slots
+    on a dedicated CUDA stream, so the host can stage chunk k+1 while the GPU
+    copies and runs chunk k. The CUDA context is pushed around every call so
+    predict() can run from worker threads; calls are serialized because they
+    share the buffers and stream.
+    """
+
+    NUM_SLOTS = 2
+
+    def __init__(self, engine_path: str):
+        self._cuda_context = pycuda.autoinit.context
+        trt_logger = trt.Logger(trt.Logger.WARNING)
+        with open(engine_path, "rb") as f:
+            self.engine = trt.Runtime(trt_logger).deserialize_cuda_engine(f.read())
+        if self.engine is None:
+            raise RuntimeError(f"Failed to deserialize TensorRT engine: {engine_path}")
+        self.context = self.engine.create_execution_context()
+
+        self._input_name = None
+        self._output_name = None
+        for i in range(self.engine.num_io_tensors):
+            name = self.engine.get_tensor_name(i)
+            if self.engine.get_tensor_mode(name) == trt.TensorIOMode.INPUT:
+                self._input_name = name
+            else:
+                self._output_name = name
+
+        in_shape = tuple(self.engine.get_tensor_shape(self._input_name))
+        out_shape = tuple(self.engine.get_tensor_shape(self._output_name))
+        # Keras reports input_shape with an unspecified batch dimension
+        self.input_shape = (None,) + in_shape[1:]
+        self.output_shape = (None,) + out_shape[1:]
+        self.batch_size = in_shape[0]
+
+        # Engines built with FP16 I/O take/return float16 buffers
+        self.input_dtype = trt.nptype(self.engine.get_tensor_dtype(self._input_name))
+        self.output_dtype = trt.nptype(self.engine.get_tensor_dtype(self._output_name))
+
+        self._lock = threading.Lock()
+        self._stream = cuda.Stream()
+        self._slots = [self._allocate_slot(in_shape, out_shape) for _ in range(self.NUM_SLOTS)]
+
+    def _allocate_slot(self, in_shape: Tuple[int, ...], out_shape: Tuple[int, ...]) -> dict:
+        """Allocate one set of pinned host / device buffers plus a completion event."""
+        host_in = cuda.pagelocked_empty(in_shape, dtype=self.input_dtype)
+        host_out = cuda.pagelocked_empty(out_shape, dtype=self.output_dtype)
+        return {
+            "host_in": host_in,
+            "host_out": host_out,
+            "dev_in": cuda.mem_alloc(host_in.nbytes),
+            "dev_out": cuda.mem_alloc(host_out.nbytes),
+            "done": cuda.Event(),
+            "pending": None,  # (start, length) of the chunk in flight
+        }
+
+    @staticmethod
+    def _drain(slot: dict, outputs: np.ndarray) -> None:
+        """Copy a completed chunk from its pinned output buffer into `outputs`."""
+        start, m = slot["pending"]
+        outputs[start:start + m] = slot["host_out"][:m]
+        slot["pending"] = None
+
+    def predict(self, x_batch: np.ndarray, **kwargs) -> np.ndarray:
+        """
+        Run the engine on a prepared batch of any length, in engine-sized chunks.
+        Extra Keras kwargs (e.g. verbose) are ignored.
+        """
+        n = x_batch.shape[0]
+        outputs = np.empty((n,) + self.output_shape[1:], dtype=self.output_dtype)
+
+        with self._lock:
+            self._run_chunks(x_batch, outputs)
+        return outputs
+
+    def _run_chunks(self, x_batch: np.ndarray, outputs: np.ndarray) -> None:
+        """Stream `x_batch` through the engine in engine-sized chunks into `outputs`."""
+        n = x_batch.shape[0]
+        self._cuda_context.push()
+        try:
+            for k, start in enumerate(range(0, n, self.batch_size)):
+                slot = self._slots[k % self.NUM_SLOTS]
+                if slot["pending"] is not None:
+                    slot["done"].synchronize()
+                    self._drain(slot, outputs)
+
+                chunk = x_batch[start:start + self.batch_size]
+                m = chunk.shape[0]
+                slot["host_in"][:m] = chunk
+                if m < self.batch_size:
+                    slot["host_in"][m:] = 0.0
+
+                cuda.memcpy_htod_async(slot["dev_in"], slot["host_in"], self._stream)
+                self.context.set_tensor_address(self._input_name, int(slot["dev_in"]))
+                self.context.set_tensor_address(self._output_name, int(slot["dev_out"]))
+                self.context.execute_async_v3(self._stream.handle)
+                cuda.memcpy_dtoh_async(slot["host_out"], slot["dev_out"], self._stream)
+                slot["done"].record(self._stream)
+                slot["pending"] = (start, m)
+
+            self._stream.synchronize()
+            for slot in self._slots:
+                if slot["pending"] is not None:
+                    self._drain(slot, outputs)
+        finally:
+            self._cuda_context.pop()
+
+
+def benchmark_model(model: TRTModel, runs: int = BENCHMARK_RUNS) -> float:
+    """Return the median latency in seconds of a full-batch predict() call."""
+    dummy = np.zeros((model.batch_size,) + tuple(model.input_shape[1:]), dtype=model.input_dtype)
+    model.predict(dummy)  # warmup
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(dummy)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def _ensure_engine(model_path: str, precision: str, calibration_files: Optional[List[str]] = None) -> str:
+    """
+    Build the engine for `precision` if it is not cached yet, or if calibration batches
+    were added after it was built, and return its path.
+    """
+    engine_path = get_engine_path(model_path, precision)
+    stale = bool(calibration_files) and os.path.exists(engine_path) and (
+        max(os.path.getmtime(path) for path in calibration_files) > os.path.getmtime(engine_path)
+    )
+    if stale:
+        # The calibration cache would otherwise be replayed instead of re-reading the batches
+        calib_cache = f"{os.path.splitext(engine_path)[0]}.calib"
+        if os.path.exists(calib_cache):
+            os.remove(calib_cache)
+        logger.info(f"Calibration data changed, rebuilding {engine_path}")
+    if stale or not os.path.exists(engine_path):
+        onnx_path = f"{os.path.splitext(model_path)[0]}.onnx"
+        if not os.path.exists(onnx_path):
+            export_onnx(model_path, onnx_path)
+        logger.info(f"Building TensorRT {precision.upper()} engine: {engine_path}")
+        build_engine(onnx_path, engine_path, precision, calibration_files)
+    return engine_path
+
+
+def load_trt_model(model_path: str) -> Optional[TRTModel]:
+    """
+    Load the cached TensorRT engine for `model_path`, building it on first use.
+
+    An INT8 engine is only used when calibration batches exist and it benchmarks
+    faster than the FP16 engine; INT8 can regress on some layer mixes.
+
+    Returns:
+        TRTModel, or None if TensorRT is unavailable or the build fails
+    """
+    if not TENSORRT_AVAILABLE:
+        logger.info("TensorRT not available, using Keras inference")
+        return None
+
+    try:
+        fp16_model = TRTModel(_ensure_engine(model_path, "fp16"))
+    except Exception as e:
+        logger.warning(f"Failed to load TensorRT engine, using Keras inference: {e}")
+        return None
+
+    calibration_files = list_calibration_files()
+    if not calibration_files:
+        return fp16_model
+
+    try:
+        int8_model = TRTModel(_ensure_engine(model_path, "int8", calibration_files))
+        fp16_latency = benchmark_model(fp16_model)
+        int8_latency = benchmark_model(int8_model)
+        logger.info(f"TensorRT latency: FP16 {fp16_latency * 1000:.1f} ms, INT8 {int8_latency * 1000:.1f} ms")
+        if int8_latency < fp16_latency:
+            return int8_model
+    except Exception as e:
+        logger.warning(f"INT8 engine unavailable, using FP16: {e}")
+
+    return fp16_model
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Collect INT8 calibration batches for the TensorRT engine")
+    parser.add_argument('--calibrate', nargs='+', required=True, metavar='CASE_DIR',
+                        help='Case directories with <case>_<modality>.nii[.gz] volumes')
+    parser.add_argument('--channels', type=str, default='flair,t1ce',
+                        help='Comma-separated modalities in model input order')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    channel_order = tuple(c.strip().lower() for c in args.channels.split(',') if c.strip())
+    saved = collect_calibration_batches(args.calibrate, channel_order)
+    print(f"Saved {len(saved)} calibration batches to {CALIBRATION_DIR}")